@@ -2,13 +2,16 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 import geopandas as gpd
-from shapely import wkb
 from datetime import datetime
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gss_utils.geom_utils import normalize_gdf
+
 
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
@@ -36,7 +39,7 @@ def process_bcts_blocks (in_folder):
          if filename.endswith(".shp"):
              print(f'..processing {filename}')
              filepath = os.path.join(in_folder, filename)
-             gdf = gpd.read_file(filepath)
+             gdf = normalize_gdf(gpd.read_file(filepath), label=filename)
              
              gdf['Area_ha']= round(gdf['geometry'].area /10000,2)
              
@@ -59,15 +62,11 @@ def process_habitat_polys (rng, in_folder):
              print(f'..processing {filename}')
              lyr = os.path.splitext(filename)[0]
              filepath = os.path.join(in_folder, filename)
-             gdf = gpd.read_file(filepath)
+             gdf = normalize_gdf(gpd.read_file(filepath), label=filename)
              
              gdf['Range']= rng
              gdf['Source']= lyr
              
-             #flatten geometries 3D to 2D
-             _drop_z = lambda geom: wkb.loads(wkb.dumps(geom, output_dimension=2))
-             gdf.geometry = gdf.geometry.transform(_drop_z)
-             
              gdf= gdf[['Range','Source','geometry']]
              polys.append(gdf)
              
@@ -85,15 +84,11 @@ def process_calving_polys (in_folder):
              print(f'..processing {filename}')
              lyr = os.path.splitext(filename)[0]
              filepath = os.path.join(in_folder, filename)
-             gdf = gpd.read_file(filepath)
+             gdf = normalize_gdf(gpd.read_file(filepath), label=filename)
              
              gdf['Range']= 'Wolverine & Chase'
              gdf['Source']= lyr
              
-             #flatten geometries 3D to 2D
-             _drop_z = lambda geom: wkb.loads(wkb.dumps(geom, output_dimension=2))
-             gdf.geometry = gdf.geometry.transform(_drop_z)
-             
              gdf= gdf[['Range','Source','geometry']]
              polys.append(gdf)
              
@@ -106,7 +101,7 @@ def process_calving_polys (in_folder):
 def gdf_to_duckdb (conn, gdf, table_name):
     """Insert data from a gdf into a duckdb table """
     gdf_wkb= gdf.copy()
-    gdf_wkb['geometry']= gdf_wkb['geometry'].apply(lambda x: wkb.dumps(x, output_dimension=2))
+    gdf_wkb['geometry']= gdf_wkb['geometry'].to_wkb(output_dimension=2)
     create_table_query = f"""
             CREATE OR REPLACE TABLE {table_name} AS
               SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS geometry
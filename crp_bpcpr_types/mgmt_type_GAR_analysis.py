@@ -18,50 +18,24 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
-import json
+import sys
 import timeit
-import cx_Oracle
 import duckdb
 import pandas as pd
+import pyarrow.compute as pc
 import geopandas as gpd
-from shapely import wkb, wkt
+from shapely import wkb
 from datetime import datetime
 
-
-class OracleConnector:
-    def __init__(self, dbname='BCGW'):
-        self.dbname = dbname
-        self.cnxinfo = self.get_db_cnxinfo()
-
-    def get_db_cnxinfo(self):
-        """ Retrieves db connection params from the config file"""
-        with open(r'H:\config\db_config.json', 'r') as file:
-            data = json.load(file)
-        
-        if self.dbname in data:
-            return data[self.dbname]
-        
-        raise KeyError(f"Database '{self.dbname}' not found.")
-    
-    def connect_to_db(self):
-        """ Connects to Oracle DB and create a cursor"""
-        try:
-            self.connection = cx_Oracle.connect(self.cnxinfo['username'], 
-                                                self.cnxinfo['password'], 
-                                                self.cnxinfo['hostname'], 
-                                                encoding="UTF-8")
-            self.cursor = self.connection.cursor()
-            print  ("..Successffuly connected to the database")
-        except Exception as e:
-            raise Exception(f'..Connection failed: {e}')
-
-    def disconnect_db(self):
-        """Close the Oracle connection and cursor"""
-        if hasattr(self, 'cursor') and self.cursor:
-            self.cursor.close()
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-            print("....Disconnected from the database")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gss_utils.oracle_io import OraclePoolConnector, oracle_job
+from gss_utils.bcgw_cache import QueryCache
+from gss_utils.bcgw_mirror import mirror_exists, mirror_job
+from gss_utils.parallel_ingest import parallel_ingest
+from gss_utils.duckdb_io import replace_if_changed
+from gss_utils.geom_utils import normalize_gdf
+from gss_utils.dissolve import dissolve_gdf
+from gss_utils.subdivide import subdivide_table, reaggregate_sql
 
 
 class DuckDBConnector:
@@ -86,10 +60,8 @@ class DuckDBConnector:
 def process_pbcpr_data (pbcpr_gdb):
     """Return a gdf of PBCPR Mgmt types"""
     gdf= gpd.read_file(pbcpr_gdb, layer='PBCPR_Cleaned')
-    gdf= gdf.dissolve(by='Management').reset_index()
-    gdf['geometry'] = gdf['geometry'].apply(
-                lambda geom: wkb.loads(
-                        wkb.dumps(geom, output_dimension=2)))
+    gdf= dissolve_gdf(gdf, by='Management')
+    gdf= normalize_gdf(gdf, label='PBCPR_Cleaned')
     gdf = gdf.loc[gdf['Management'].str.contains('MGMT')]
     gdf['MGMT_TYPE']= gdf['Management'].str[:11]
     gdf= gdf[['MGMT_TYPE', 'geometry']]
@@ -100,17 +72,6 @@ def process_pbcpr_data (pbcpr_gdb):
     return gdf, gdf_env
 
 
-def read_query(connection,cursor,query,bvars):
-    "Returns a df containing SQL Query results"
-    cursor.execute(query, bvars)
-    names = [x[0] for x in cursor.description]
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=names)
-    
-    return df
-
-
- 
 def get_wkb_srid(gdf):
     """Returns SRID and WKB objects from gdf"""
     srid = gdf.crs.to_epsg()
@@ -126,7 +87,7 @@ def load_Orc_sql():
     orSql['herds'] = """
         SELECT
             HERD_NAME,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
             
         FROM 
             WHSE_WILDLIFE_INVENTORY.GCPB_CARIBOU_POPULATION_SP
@@ -137,7 +98,7 @@ def load_Orc_sql():
     orSql['tsa'] = """
         SELECT
             TSA_NUMBER_DESCRIPTION,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
             
         FROM 
             WHSE_ADMIN_BOUNDARIES.FADM_TSA
@@ -152,7 +113,7 @@ def load_Orc_sql():
             UWR_NUMBER,
             TIMBER_HARVEST_CODE,
             SPECIES_1,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_WILDLIFE_MANAGEMENT.WCP_UNGULATE_WINTER_RANGE_SP
         WHERE
@@ -164,7 +125,7 @@ def load_Orc_sql():
         SELECT
             wha.TAG,
             wha.TIMBER_HARVEST_CODE,
-            SDO_UTIL.TO_WKTGEOMETRY(wha.GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(wha.GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_WILDLIFE_MANAGEMENT.WCP_WILDLIFE_HABITAT_AREA_POLY wha
         WHERE
@@ -175,7 +136,7 @@ def load_Orc_sql():
     orSql['ogm'] = """
         SELECT
             LEGAL_OGMA_PROVID,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_LAND_USE_PLANNING.RMP_OGMA_LEGAL_CURRENT_SVW
         WHERE
@@ -185,7 +146,7 @@ def load_Orc_sql():
     orSql['fda'] = """
         SELECT
             CURRENT_PRIORITY_DEFERRAL_ID,
-            SDO_UTIL.TO_WKTGEOMETRY(SHAPE) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(SHAPE) AS GEOMETRY 
         FROM
             WHSE_FOREST_VEGETATION.OGSR_PRIORITY_DEF_AREA_CUR_SP
         WHERE
@@ -195,22 +156,39 @@ def load_Orc_sql():
                     
     return orSql
 
-def read_oracle_data (orcCnx, orcCur, dckCnx, dict_sqls, wkb_aoi, srid, data_dict):
-    counter = 1
+def load_mirror_jobs(aoi_geom):
+    """BCGW layers read from the local GeoParquet mirror, when snapshotted"""
+    mrJobs= {}
+    if mirror_exists('tsa'):
+        mrJobs['tsa']= mirror_job('tsa', 
+                                  columns= ['TSA_NUMBER_DESCRIPTION'],
+                                  filter= pc.field('TSB_NUMBER').is_null() & 
+                                          pc.field('TSA_NUMBER_DESCRIPTION').isin(['Fort Nelson TSA','Fort St. John TSA']))
+    if mirror_exists('priority_deferrals'):
+        mrJobs['fda']= mirror_job('priority_deferrals', aoi_geom,
+                                  columns= ['CURRENT_PRIORITY_DEFERRAL_ID'],
+                                  distance= 500)
+    return mrJobs
+
+
+def read_oracle_data (orcPool, dckCnx, dict_sqls, wkb_aoi, srid, cache=None, mirror_jobs=None):
+    """Streams the BCGW tables into duckdb, extracted concurrently
+       over the session pool. Mirrored layers are read locally"""
+    bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
+    jobs = {}
+    mirror_jobs = mirror_jobs or {}
     for k, v in dict_sqls.items():
-        print(f'....table {counter} of {len(dict_sqls)}: {k}')
-        if ':wkb_aoi' in v:
-            orcCur.setinputsizes(wkb_aoi=cx_Oracle.BLOB)
-            bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
-            df = read_query(orcCnx, orcCur, v ,bvars)
+        if k in mirror_jobs:
+            jobs[k] = mirror_jobs[k]
         else:
-            df = pd.read_sql(v, orcCnx)
-        
-        data_dict[k]= df
-        
-        counter+=1
+            jobs[k] = oracle_job(orcPool, v, bvars, cache=cache, label=k)
     
-    return data_dict
+    df_status = parallel_ingest(dckCnx, jobs, max_workers=orcPool.sessions)
+    print (df_status.to_string(index=False))
+    
+    failed = df_status.loc[df_status['STATUS'] != 'OK', 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
 
 
 def read_local_data(loc_dict, data_dict):
@@ -218,7 +196,7 @@ def read_local_data(loc_dict, data_dict):
     for k, v in loc_dict.items():
         print(f'..table {counter} of {len(loc_dict)}: {k}')
         df= v
-        df['GEOMETRY']= df['geometry'].apply(lambda x: wkt.dumps(x, output_dimension=2))
+        df['GEOMETRY']= df['geometry'].to_wkb(output_dimension=2)
         df = df.drop(columns=['geometry'])
         
         data_dict[k]= df
@@ -229,146 +207,97 @@ def read_local_data(loc_dict, data_dict):
         
 
 def add_data_to_duckdb(data_dict):
+    """Loads the dfs into duckdb, unless their content is already in the db"""
     counter = 1
     for k, v in data_dict.items():
         print(f'..table {counter} of {len(data_dict)}: {k}')
-        dck_tab_list= dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-        
-        if k in dck_tab_list:
-            dck_row_count= dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams= dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-                
-            if (dck_row_count != len(v)) or (set(list(v.columns)) != set(dck_col_nams)):
-                print (f'....import to Duckdb ({v.shape[0]} rows)')
-                create_table_query = f"""
-                CREATE OR REPLACE TABLE {k} AS
-                  SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-                  FROM v;
-                """
-                dckCnx.execute(create_table_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-        
-        else:
-            print (f'....import to Duckdb ({v.shape[0]} rows)')
-            create_table_query = f"""
-            CREATE OR REPLACE TABLE {k} AS
-              SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-              FROM v;
-            """
-            dckCnx.execute(create_table_query)
+        create_table_query = f"""
+        CREATE OR REPLACE TABLE {k}_stage AS
+          SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS GEOMETRY
+          FROM v;
+        """
+        dckCnx.execute(create_table_query)
+        replace_if_changed(dckCnx, k, f'{k}_stage')
          
         counter += 1    
 
 
+def subdivide_tables(dckCnx, tables, max_vertices=256):
+    """Splits the large polygons of the tables into pieces ({table}_subdiv) for the joins"""
+    counter = 1
+    for table in tables:
+        print(f'..table {counter} of {len(tables)}: {table}')
+        subdivide_table(dckCnx, table, max_vertices=max_vertices)
+        
+        counter += 1
+
+
 def load_dck_sql():
+    """Joins on the subdivided mgmt types, herds and TSAs: areas are summed
+       back by parent keys"""
     dkSql= {}
     
-    dkSql['mgt_q']="""
+    mgt_q="""
         SELECT
             mgm.MGMT_TYPE,
             tsa.TSA_NUMBER_DESCRIPTION AS TSA,
-            ROUND(ST_Area(
-                ST_Intersection(mgm.geometry, tsa.geometry))/10000, 2) AS MGMT_TYPE_AREA_HA
+            ST_Area(ST_Intersection(mgm.geometry, tsa.geometry)) AS AREA_M2
         FROM 
-            mgmt_types AS mgm
+            mgmt_types_subdiv AS mgm
             JOIN 
-            tsa ON ST_Intersects(mgm.geometry, tsa.geometry)
-        ORDER BY 
-            mgm.MGMT_TYPE;
+            tsa_subdiv AS tsa ON ST_Intersects(mgm.geometry, tsa.geometry)
                     """   
+    dkSql['mgt_q']= reaggregate_sql(mgt_q, ['MGMT_TYPE', 'TSA'],
+                                    {'MGMT_TYPE_AREA_HA': 'ROUND(SUM(AREA_M2)/10000, 2)'},
+                                    geom_col=None) + ' ORDER BY MGMT_TYPE'
 
-    dkSql['hrd_mgt_q']="""
+    hrd_mgt_q="""
         SELECT
             tsa.TSA_NUMBER_DESCRIPTION AS TSA,
             hrd.HERD_NAME,
             mgm.MGMT_TYPE,
-            ROUND(ST_Area(ST_Intersection(
-                ST_Intersection(hrd.geometry, mgm.geometry), tsa.geometry))/10000, 2) AS OVERLAP_HA
+            ST_Area(ST_Intersection(
+                ST_Intersection(hrd.geometry, mgm.geometry), tsa.geometry)) AS AREA_M2
         FROM 
-            herds AS hrd
+            herds_subdiv AS hrd
             JOIN 
-                mgmt_types AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
+                mgmt_types_subdiv AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
             JOIN 
-                tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
+                tsa_subdiv AS tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
                     AND ST_Intersects(mgm.geometry, tsa.geometry)
-        ORDER BY 
-            tsa.TSA_NUMBER_DESCRIPTION,
-            hrd.HERD_NAME;
                     """
-                    
-    dkSql['uwr_q']="""
-        SELECT 
-            tsa.TSA_NUMBER_DESCRIPTION AS TSA,
-            hrd.HERD_NAME,
-            mgm.MGMT_TYPE,
-            uwr.TIMBER_HARVEST_CODE,
-            ROUND(ST_Area(
-                ST_Intersection(
-                    ST_Intersection(
-                        ST_Intersection(hrd.geometry, mgm.geometry), uwr.geometry), tsa.geometry))/10000, 2) AS INTERSECT_HA
-        FROM 
-            herds AS hrd
-            JOIN 
-                mgmt_types AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
-            JOIN 
-                uwr ON ST_Intersects(hrd.geometry, uwr.geometry) 
-                    AND ST_Intersects(mgm.geometry, uwr.geometry)
-            JOIN 
-                tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
-                    AND ST_Intersects(mgm.geometry, tsa.geometry)
-                    AND ST_Intersects(uwr.geometry, tsa.geometry);
-                    """
-
-    dkSql['wha_q']="""
-        SELECT 
-            tsa.TSA_NUMBER_DESCRIPTION AS TSA,
-            hrd.HERD_NAME,
-            mgm.MGMT_TYPE,
-            wha.TIMBER_HARVEST_CODE,
-            ROUND(ST_Area(
-                ST_Intersection(
-                    ST_Intersection(
-                        ST_Intersection(hrd.geometry, mgm.geometry), wha.geometry), tsa.geometry))/10000, 2) AS INTERSECT_HA
-        FROM 
-            herds AS hrd
-            JOIN 
-                mgmt_types AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
-            JOIN 
-                wha ON ST_Intersects(hrd.geometry, wha.geometry) 
-                    AND ST_Intersects(mgm.geometry, wha.geometry)
-            JOIN 
-                tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
-                    AND ST_Intersects(mgm.geometry, tsa.geometry)
-                    AND ST_Intersects(wha.geometry, tsa.geometry);
-                    """
-
-    dkSql['fda_q']="""
-        SELECT
-            tsa.TSA_NUMBER_DESCRIPTION AS TSA,
-            hrd.HERD_NAME,
-            mgm.MGMT_TYPE,
-            fda.CURRENT_PRIORITY_DEFERRAL_ID,
-            ROUND(ST_Area(
-                ST_Intersection(
+    dkSql['hrd_mgt_q']= reaggregate_sql(hrd_mgt_q, ['TSA', 'HERD_NAME', 'MGMT_TYPE'],
+                                        {'OVERLAP_HA': 'ROUND(SUM(AREA_M2)/10000, 2)'},
+                                        geom_col=None) + ' ORDER BY TSA, HERD_NAME'
+    
+    for gar, cols in {'uwr': ['TIMBER_HARVEST_CODE'],
+                      'wha': ['TIMBER_HARVEST_CODE'],
+                      'fda': ['CURRENT_PRIORITY_DEFERRAL_ID']}.items():
+        gar_q=f"""
+            SELECT 
+                tsa.TSA_NUMBER_DESCRIPTION AS TSA,
+                hrd.HERD_NAME,
+                mgm.MGMT_TYPE,
+                {', '.join(f'{gar}.{c}' for c in cols)},
+                ST_Area(
                     ST_Intersection(
-                        ST_Intersection(hrd.geometry, mgm.geometry), fda.geometry), tsa.geometry))/10000, 2) AS INTERSECT_HA
-        FROM 
-            herds AS hrd
-            JOIN 
-                mgmt_types AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
-            JOIN 
-                fda ON ST_Intersects(hrd.geometry, fda.geometry)
-                    AND ST_Intersects(mgm.geometry, fda.geometry)
-            JOIN 
-                tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
-                    AND ST_Intersects(mgm.geometry, tsa.geometry)
-                    AND ST_Intersects(fda.geometry, tsa.geometry);
-                    """
-                    
+                        ST_Intersection(
+                            ST_Intersection(hrd.geometry, mgm.geometry), {gar}.geometry), tsa.geometry)) AS AREA_M2
+            FROM 
+                herds_subdiv AS hrd
+                JOIN 
+                    mgmt_types_subdiv AS mgm ON ST_Intersects(hrd.geometry, mgm.geometry)
+                JOIN 
+                    {gar} ON ST_Intersects(hrd.geometry, {gar}.geometry) 
+                        AND ST_Intersects(mgm.geometry, {gar}.geometry)
+                JOIN 
+                    tsa_subdiv AS tsa ON ST_Intersects(hrd.geometry, tsa.geometry)
+                        AND ST_Intersects(mgm.geometry, tsa.geometry)
+                        AND ST_Intersects({gar}.geometry, tsa.geometry)
+                        """
+        dkSql[f'{gar}_q']= reaggregate_sql(gar_q, ['TSA', 'HERD_NAME', 'MGMT_TYPE'] + cols,
+                                           {'INTERSECT_HA': 'ROUND(SUM(AREA_M2)/10000, 2)'},
+                                           geom_col=None)
                  
     return dkSql
 
@@ -424,10 +353,9 @@ if __name__ == "__main__":
     print ('Connecting to databases')    
     
     print ('..connect to BCGW') 
-    Oracle = OracleConnector()
-    Oracle.connect_to_db()
-    orcCnx= Oracle.connection
-    orcCur= Oracle.cursor
+    # the session pool connects on the first query not served from the cache
+    Oracle = OraclePoolConnector(sessions=4)
+    cache = QueryCache()
     
     print ('..connect to Duckdb') 
     projDB= os.path.join(wks, 'work', 'GR_2024_528_mgmt_type_GAR_analysis', 'habitat_types_analysis.db')
@@ -448,8 +376,9 @@ if __name__ == "__main__":
         loc_dict['mgmt_types']= gdf
         
         data_dict= {}
-        print('..reading from Oracle')
-        data_dict= read_oracle_data (orcCnx, orcCur, dckCnx, orSql_dict, wkb_aoi, srid, data_dict)
+        print('..reading from Oracle into duckdb')
+        mrJobs= load_mirror_jobs(gdf_env['geometry'].iloc[0])
+        read_oracle_data (Oracle, dckCnx, orSql_dict, wkb_aoi, srid, cache, mrJobs)
         
         print('\n..reading from Local files')
         data_dict= read_local_data(loc_dict, data_dict)
@@ -457,6 +386,9 @@ if __name__ == "__main__":
         print('\nWriting data to duckdb')
         add_data_to_duckdb(data_dict)
         
+        print('\nSubdividing the large polygons')
+        subdivide_tables(dckCnx, ['mgmt_types', 'herds', 'tsa'])
+        
         print ('\nRunning queries')
         dksql= load_dck_sql()
         q_rslt= run_duckdb_queries (dckCnx, dksql) 
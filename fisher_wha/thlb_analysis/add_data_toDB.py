@@ -1,47 +1,17 @@
 import os
-import json
+import sys
 import timeit
-import cx_Oracle
 import duckdb
 import pandas as pd
 import geopandas as gpd
 from shapely import wkb
 
-
-class OracleConnector:
-    def __init__(self, dbname='BCGW'):
-        self.dbname = dbname
-        self.cnxinfo = self.get_db_cnxinfo()
-
-    def get_db_cnxinfo(self):
-        """ Retrieves db connection params from the config file"""
-        with open(r'H:\config\db_config.json', 'r') as file:
-            data = json.load(file)
-        
-        if self.dbname in data:
-            return data[self.dbname]
-        
-        raise KeyError(f"Database '{self.dbname}' not found.")
-    
-    def connect_to_db(self):
-        """ Connects to Oracle DB and create a cursor"""
-        try:
-            self.connection = cx_Oracle.connect(self.cnxinfo['username'], 
-                                                self.cnxinfo['password'], 
-                                                self.cnxinfo['hostname'], 
-                                                encoding="UTF-8")
-            self.cursor = self.connection.cursor()
-            print  ("..Successffuly connected to the database")
-        except Exception as e:
-            raise Exception(f'..Connection failed: {e}')
-
-    def disconnect_db(self):
-        """Close the Oracle connection and cursor"""
-        if hasattr(self, 'cursor') and self.cursor:
-            self.cursor.close()
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-            print("....Disconnected from the database")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.oracle_io import OraclePoolConnector, oracle_job
+from gss_utils.bcgw_cache import QueryCache
+from gss_utils.parallel_ingest import parallel_ingest
+from gss_utils.vector_io import vectors_to_duckdb
+from gss_utils.overlay import overlay_sql
 
 
 class DuckDBConnector:
@@ -124,7 +94,7 @@ def load_Orc_sql():
             PROJ_AGE_2,
             PROJ_AGE_CLASS_CD_2,
             LIVE_STAND_VOLUME_125,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY
         WHERE
@@ -138,7 +108,7 @@ def load_Orc_sql():
             UWR_UNIT_NUMBER,
             SPECIES_1,
             TIMBER_HARVEST_CODE,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_WILDLIFE_MANAGEMENT.WCP_UNGULATE_WINTER_RANGE_SP
         WHERE
@@ -151,7 +121,7 @@ def load_Orc_sql():
             VLI_POLYGON_NO,
             REC_EVQO_CODE,
             SCENIC_AREA_IND,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_FOREST_VEGETATION.REC_VIMS_EVQO_SVW
         WHERE
@@ -162,7 +132,7 @@ def load_Orc_sql():
     orSql['cofa'] = """
         SELECT
             NON_LEGAL_OGMA_PROVID,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_LAND_USE_PLANNING.RMP_OGMA_NON_LEGAL_CURRENT_SVW
         WHERE
@@ -173,106 +143,40 @@ def load_Orc_sql():
     return orSql
 
 
-def oracle_2_duckdb(orcCnx, orcCur, dckCnx, dict_sqls, wkb_aoi, srid):
-    """Insert data from Oracle into a duckdb table"""
-    tables = {}
-    counter = 1
+def oracle_2_duckdb(orcPool, dckCnx, dict_sqls, wkb_aoi, srid, cache=None):
+    """Insert data from Oracle into duckdb tables.
+       Tables are extracted concurrently over the session pool"""
+    bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
+    jobs = {k: oracle_job(orcPool, v, bvars, cache=cache, label=k) for k, v in dict_sqls.items()}
     
-    for k, v in dict_sqls.items():
-        print(f'..adding table {counter} of {len(dict_sqls)}: {k}')
-        print('....export from Oracle')
-        if ':wkb_aoi' in v:
-            orcCur.setinputsizes(wkb_aoi=cx_Oracle.BLOB)
-            bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
-            df = read_query(orcCnx, orcCur, v ,bvars)
-        else:
-            df = pd.read_sql(v, orcCnx)
-            
-
-        dck_tab_list= dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-        
-        if k in dck_tab_list:
-            dck_row_count= dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams= dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-                
-            if (dck_row_count != len(df)) or (set(list(df.columns)) != set(dck_col_nams)):
-                print (f'....import to Duckdb ({df.shape[0]} rows)')
-                create_table_query = f"""
-                CREATE OR REPLACE TABLE {k} AS
-                  SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-                  FROM df;
-                """
-                dckCnx.execute(create_table_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-        
-        else:
-            print (f'....import to Duckdb ({df.shape[0]} rows)')
-            create_table_query = f"""
-            CREATE OR REPLACE TABLE {k} AS
-              SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-              FROM df;
-            """
-            dckCnx.execute(create_table_query)
-      
-        df = df.drop(columns=['GEOMETRY'])
-        
-        tables[k] = df
-      
-        counter += 1
+    print(f'..extracting {len(jobs)} tables over {orcPool.sessions} sessions')
+    df_status = parallel_ingest(dckCnx, jobs, max_workers=orcPool.sessions)
+    print(df_status.to_string(index=False))
+    
+    failed = df_status.loc[df_status['STATUS'] != 'OK', 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
+    
+    tables = {}
+    for k in dict_sqls:
+        tables[k] = dckCnx.execute(f'SELECT * EXCLUDE GEOMETRY FROM {k}').df()
 
     return tables
 
 
 def gdf_to_duckdb (dckCnx, loc_dict):
-    """Insert data from a gdfs into a duckdb table """
+    """Insert data from the local files into duckdb tables. Layers are read
+       concurrently; files already loaded and unmodified since are not read again"""
+    df_status = vectors_to_duckdb(dckCnx, loc_dict)
+    print(df_status.to_string(index=False))
+    
+    failed = df_status.loc[~df_status['STATUS'].isin(['OK', 'SKIPPED']), 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
+    
     tables = {}
-    counter= 1
-    for k, v in loc_dict.items():
-        print (f'..adding table {counter} of {len(loc_dict)}: {k}')
-        print ('....export from gdb')
-        df= esri_to_gdf (v)
-        df['GEOMETRY']= df['geometry'].apply(lambda x: wkb.dumps(x, output_dimension=2))
-        df = df.drop(columns=['geometry'])
-        
-        dck_tab_list= dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-        
-        if k in dck_tab_list:
-            dck_row_count= dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams= dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-                
-            if (dck_row_count != len(df)) or (set(list(df.columns)) != set(dck_col_nams)):
-                print (f'....import to Duckdb ({df.shape[0]} rows)')
-                create_table_query = f"""
-                CREATE OR REPLACE TABLE {k} AS
-                  SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS GEOMETRY
-                  FROM df;
-                """
-                dckCnx.execute(create_table_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-        
-        else:
-            print (f'....import to Duckdb ({df.shape[0]} rows)')
-            create_table_query = f"""
-            CREATE OR REPLACE TABLE {k} AS
-              SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS GEOMETRY
-              FROM df;
-            """
-            dckCnx.execute(create_table_query)
-            
-        
-        df = df.drop(columns=['GEOMETRY'])
-        
-        tables[k] = df
-        
-        counter+= 1
+    for k in loc_dict:
+        tables[k] = dckCnx.execute(f'SELECT * EXCLUDE GEOMETRY FROM {k}').df()
         
     return tables    
 
@@ -299,22 +203,17 @@ def load_dck_sql():
               vri.PROJ_AGE_1 >= 80;
                     """
     '''                
-    dkSql['thlb_curr_mature']="""
+    ovl= overlay_sql(['vri', 'thlb_curr thlb'],
+                     columns=['vri.POLYGON_ID AS VRI_POLY_ID', 'vri.PROJ_AGE_1', 'thlb.thlb_fact'],
+                     measures={'THLB_MATURE_HA': 'ROUND({area}/10000,2)'},
+                     where='vri.PROJ_AGE_1 >= 80')
+    dkSql['thlb_curr_mature']=f"""
         --Drop table if exists
         DROP TABLE IF EXISTS thlb_curr_mature;
         
         --Create table
         CREATE TABLE thlb_curr_mature AS
-            SELECT 
-              vri.POLYGON_ID AS VRI_POLY_ID,
-              vri.PROJ_AGE_1,
-              thlb.thlb_fact,
-              ROUND(ST_Area(ST_Intersection(vri.geometry, thlb.geometry))/10000,2)  AS THLB_MATURE_HA,
-              ST_Intersection(vri.geometry, thlb.geometry) AS geometry
-            FROM 
-              vri JOIN thlb_curr thlb ON ST_Intersects(vri.geometry, thlb.geometry)
-            WHERE 
-              vri.PROJ_AGE_1 >= 80;
+            {ovl};
                     """
                     
     return dkSql
@@ -343,10 +242,9 @@ if __name__ == "__main__":
     print ('Connect to databases')    
     
     print ('..connect to BCGW') 
-    Oracle = OracleConnector()
-    Oracle.connect_to_db()
-    orcCnx= Oracle.connection
-    orcCur= Oracle.cursor
+    # the session pool connects on the first query not served from the cache
+    Oracle = OraclePoolConnector(sessions=4)
+    cache = QueryCache()
     
     print ('..connect to Duckdb') 
     projDB= os.path.join(wks, 'inputs', 'thlb_analysis.db')
@@ -364,7 +262,7 @@ if __name__ == "__main__":
 
         print ('\nLoad BCGW datasets')
         orSql= load_Orc_sql ()
-        #orcTables= oracle_2_duckdb(orcCnx, orcCur, dckCnx, orSql, wkb_aoi, srid)
+        #orcTables= oracle_2_duckdb(Oracle, dckCnx, orSql, wkb_aoi, srid, cache)
         
         print ('\nLoad local datasets')
         
@@ -2,11 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 from datetime import datetime
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.overlay import overlay_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -40,91 +44,43 @@ def read_query(connection,cursor,query,bvars):
 def load_dck_sql():
     dkSql= {}
 
-    dkSql['poly_thlb_mature']="""
-        SELECT 
-          poly.DISTRICT,
-          poly.POLYGON_ID,
-          poly.POLYGON_HA,
-          thmt.VRI_POLY_ID,
-          thmt.PROJ_AGE_1 AS STAND_AGE,
-          thmt.thlb_fact,
-          ROUND(ST_Area(ST_Intersection(thmt.geometry, poly.geometry))/10000,4)  AS INTERSECT_HA,
-          ROUND((ST_Area(ST_Intersection(thmt.geometry, poly.geometry))* thmt.thlb_fact)/10000,4) AS THLB_MATURE_HA
-
-        FROM 
-          draft_fisher_polys poly  
-              JOIN thlb_curr_mature thmt 
-                  ON ST_Intersects(thmt.geometry, poly.geometry)
-                    """
-
-    dkSql['poly_uwr']="""
-        SELECT 
-          poly.DISTRICT,
-          poly.POLYGON_ID,
-          poly.POLYGON_HA,
-          thmt.VRI_POLY_ID,
-          thmt.PROJ_AGE_1 AS STAND_AGE,
-          uwg.UWR_NUMBER,
-          uwg.TIMBER_HARVEST_CODE,
-          thmt.thlb_fact,
-          ROUND(ST_Area(ST_Intersection(ST_Intersection(poly.geometry, uwg.geometry), thmt.geometry))/10000, 4) AS INTERSECT_HA,
-          ROUND((ST_Area(ST_Intersection(ST_Intersection(poly.geometry, uwg.geometry), thmt.geometry))) * thmt.thlb_fact/10000, 4) AS UWR_THLB_MATURE_HA
-          
-        FROM 
-            draft_fisher_polys AS poly
-            JOIN 
-                uwg ON ST_Intersects(poly.geometry, uwg.geometry)
-            JOIN 
-                thlb_curr_mature AS thmt ON ST_Intersects(poly.geometry, thmt.geometry) 
-                    AND ST_Intersects(uwg.geometry, thmt.geometry)
-                    
-        WHERE
-            uwg.UWR_NUMBER IN ('u-7-022', 'u-7-020', 'u-7-013', 'u-7-011');
-                    """
-
-    dkSql['poly_vqo']="""
-        SELECT 
-          poly.DISTRICT,
-          poly.POLYGON_ID,
-          poly.POLYGON_HA,
-          thmt.VRI_POLY_ID,
-          thmt.PROJ_AGE_1 AS STAND_AGE,
-          vqo.VLI_POLYGON_NO,
-          vqo.REC_EVQO_CODE,
-          vqo.SCENIC_AREA_IND,
-          thmt.thlb_fact,
-          ROUND(ST_Area(ST_Intersection(ST_Intersection(poly.geometry, vqo.geometry), thmt.geometry))/10000, 4) AS INTERSECT_HA,
-          ROUND((ST_Area(ST_Intersection(ST_Intersection(poly.geometry, vqo.geometry), thmt.geometry))) * thmt.thlb_fact/10000, 4) AS VQO_THLB_MATURE_HA
-          
-        FROM 
-            draft_fisher_polys AS poly
-            JOIN 
-                vqo ON ST_Intersects(poly.geometry, vqo.geometry)
-            JOIN 
-                thlb_curr_mature AS thmt ON ST_Intersects(poly.geometry, thmt.geometry) 
-                    AND ST_Intersects(vqo.geometry, thmt.geometry);
-                    """
-
-    dkSql['poly_cofa']="""
-        SELECT 
-          poly.DISTRICT,
-          poly.POLYGON_ID,
-          poly.POLYGON_HA,
-          thmt.VRI_POLY_ID,
-          thmt.PROJ_AGE_1 AS STAND_AGE,
-          cofa.NON_LEGAL_OGMA_PROVID,
-          thmt.thlb_fact,
-          ROUND(ST_Area(ST_Intersection(ST_Intersection(poly.geometry, cofa.geometry), thmt.geometry))/10000, 4) AS INTERSECT_HA,
-          ROUND((ST_Area(ST_Intersection(ST_Intersection(poly.geometry, cofa.geometry), thmt.geometry))) * thmt.thlb_fact/10000, 4) AS COFA_THLB_MATURE_HA
-          
-        FROM 
-            draft_fisher_polys AS poly
-            JOIN 
-                cofa ON ST_Intersects(poly.geometry, cofa.geometry)
-            JOIN 
-                thlb_curr_mature AS thmt ON ST_Intersects(poly.geometry, thmt.geometry) 
-                    AND ST_Intersects(cofa.geometry, thmt.geometry);
-                    """                    
+    # intersections computed once: INTERSECT_HA and the thlb area derive from the same geometry
+    dkSql['poly_thlb_mature']= overlay_sql(
+        ['draft_fisher_polys poly', 'thlb_curr_mature thmt'],
+        columns=['poly.DISTRICT', 'poly.POLYGON_ID', 'poly.POLYGON_HA',
+                 'thmt.VRI_POLY_ID', 'thmt.PROJ_AGE_1 AS STAND_AGE', 'thmt.thlb_fact'],
+        measures={'INTERSECT_HA': 'ROUND({area}/10000,4)',
+                  'THLB_MATURE_HA': 'ROUND(({area}* thlb_fact)/10000,4)'},
+        out_geom=None)
+
+    dkSql['poly_uwr']= overlay_sql(
+        ['draft_fisher_polys AS poly', 'uwg', 'thlb_curr_mature AS thmt'],
+        columns=['poly.DISTRICT', 'poly.POLYGON_ID', 'poly.POLYGON_HA',
+                 'thmt.VRI_POLY_ID', 'thmt.PROJ_AGE_1 AS STAND_AGE',
+                 'uwg.UWR_NUMBER', 'uwg.TIMBER_HARVEST_CODE', 'thmt.thlb_fact'],
+        measures={'INTERSECT_HA': 'ROUND({area}/10000, 4)',
+                  'UWR_THLB_MATURE_HA': 'ROUND({area} * thlb_fact/10000, 4)'},
+        where="uwg.UWR_NUMBER IN ('u-7-022', 'u-7-020', 'u-7-013', 'u-7-011')",
+        out_geom=None)
+
+    dkSql['poly_vqo']= overlay_sql(
+        ['draft_fisher_polys AS poly', 'vqo', 'thlb_curr_mature AS thmt'],
+        columns=['poly.DISTRICT', 'poly.POLYGON_ID', 'poly.POLYGON_HA',
+                 'thmt.VRI_POLY_ID', 'thmt.PROJ_AGE_1 AS STAND_AGE',
+                 'vqo.VLI_POLYGON_NO', 'vqo.REC_EVQO_CODE', 'vqo.SCENIC_AREA_IND', 'thmt.thlb_fact'],
+        measures={'INTERSECT_HA': 'ROUND({area}/10000, 4)',
+                  'VQO_THLB_MATURE_HA': 'ROUND({area} * thlb_fact/10000, 4)'},
+        out_geom=None)
+
+    dkSql['poly_cofa']= overlay_sql(
+        ['draft_fisher_polys AS poly', 'cofa', 'thlb_curr_mature AS thmt'],
+        columns=['poly.DISTRICT', 'poly.POLYGON_ID', 'poly.POLYGON_HA',
+                 'thmt.VRI_POLY_ID', 'thmt.PROJ_AGE_1 AS STAND_AGE',
+                 'cofa.NON_LEGAL_OGMA_PROVID', 'thmt.thlb_fact'],
+        measures={'INTERSECT_HA': 'ROUND({area}/10000, 4)',
+                  'COFA_THLB_MATURE_HA': 'ROUND({area} * thlb_fact/10000, 4)'},
+        out_geom=None)
+
     dkSql['vqo_slp']="""
           SELECT
               vqo.VLI_POLYGON_NO,
@@ -2,50 +2,19 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
-import json
 import duckdb
-import cx_Oracle
 import pandas as pd
 import geopandas as gpd
 from shapely import wkb
 from datetime import datetime
 
-
-class OracleConnector:
-    def __init__(self, dbname='BCGW'):
-        self.dbname = dbname
-        self.cnxinfo = self.get_db_cnxinfo()
-
-    def get_db_cnxinfo(self):
-        """ Retrieves db connection params from the config file"""
-        with open(r'H:\config\db_config.json', 'r') as file:
-            data = json.load(file)
-        
-        if self.dbname in data:
-            return data[self.dbname]
-        
-        raise KeyError(f"Database '{self.dbname}' not found.")
-    
-    def connect_to_db(self):
-        """ Connects to Oracle DB and create a cursor"""
-        try:
-            self.connection = cx_Oracle.connect(self.cnxinfo['username'], 
-                                                self.cnxinfo['password'], 
-                                                self.cnxinfo['hostname'], 
-                                                encoding="UTF-8")
-            self.cursor = self.connection.cursor()
-            print  ("..Successffuly connected to the database")
-        except Exception as e:
-            raise Exception(f'..Connection failed: {e}')
-
-    def disconnect_db(self):
-        """Close the Oracle connection and cursor"""
-        if hasattr(self, 'cursor') and self.cursor:
-            self.cursor.close()
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-            print("....Disconnected from the database")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.oracle_io import OraclePoolConnector, oracle_job
+from gss_utils.bcgw_cache import QueryCache
+from gss_utils.parallel_ingest import parallel_ingest
+from gss_utils.vector_io import vectors_to_duckdb
 
 
 class DuckDBConnector:
@@ -121,7 +90,7 @@ def load_Orc_sql():
             CLIENT_NUMBER,
             CLIENT_NAME,
             ADMIN_DISTRICT_CODE,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY
             
         FROM 
             WHSE_FOREST_TENURE.FTEN_MANAGED_LICENCE_POLY_SVW   
@@ -136,7 +105,7 @@ def load_Orc_sql():
     orSql['pofd'] = """
         SELECT
             CURRENT_PRIORITY_DEFERRAL_ID,
-            SDO_UTIL.TO_WKTGEOMETRY(SHAPE) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(SHAPE) AS GEOMETRY
             
         FROM
             WHSE_FOREST_VEGETATION.OGSR_PRIORITY_DEF_AREA_CUR_SP ofd
@@ -207,106 +176,39 @@ def load_dck_sql():
     return dkSql  
 
 
-def oracle_2_duckdb(orcCnx, orcCur, dckCnx, dict_sqls):
-    """Insert data from Oracle into a duckdb table"""
-    tables = {}
-    counter = 1
+def oracle_2_duckdb(orcPool, dckCnx, dict_sqls, cache=None):
+    """Insert data from Oracle into duckdb tables.
+       Tables are extracted concurrently over the session pool"""
+    bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
+    jobs = {k: oracle_job(orcPool, v, bvars, cache=cache, label=k) for k, v in dict_sqls.items()}
     
-    for k, v in dict_sqls.items():
-        print(f'..adding table {counter} of {len(dict_sqls)}: {k}')
-        print('....export from Oracle')
-        if ':wkb_aoi' in v:
-            orcCur.setinputsizes(wkb_aoi=cx_Oracle.BLOB)
-            bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
-            df = read_query(orcCnx, orcCur, v ,bvars)
-        else:
-            df = pd.read_sql(v, orcCnx)
-            
-
-        dck_tab_list= dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-        
-        if k in dck_tab_list:
-            dck_row_count= dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams= dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-                
-            if (dck_row_count != len(df)) or (set(list(df.columns)) != set(dck_col_nams)):
-                print (f'....import to Duckdb ({df.shape[0]} rows)')
-                create_table_query = f"""
-                CREATE OR REPLACE TABLE {k} AS
-                  SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-                  FROM df;
-                """
-                dckCnx.execute(create_table_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-        
-        else:
-            print (f'....import to Duckdb ({df.shape[0]} rows)')
-            create_table_query = f"""
-            CREATE OR REPLACE TABLE {k} AS
-              SELECT * EXCLUDE geometry, ST_GeomFromText(geometry) AS GEOMETRY
-              FROM df;
-            """
-            dckCnx.execute(create_table_query)
-      
-        df = df.drop(columns=['GEOMETRY'])
-        
-        tables[k] = df
-      
-        counter += 1
+    df_status = parallel_ingest(dckCnx, jobs, max_workers=orcPool.sessions)
+    print(df_status.to_string(index=False))
+    
+    failed = df_status.loc[df_status['STATUS'] != 'OK', 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
+    
+    tables = {}
+    for k in dict_sqls:
+        tables[k] = dckCnx.execute(f'SELECT * EXCLUDE GEOMETRY FROM {k}').df()
 
     return tables
 
 
 def gdf_to_duckdb (dckCnx, loc_dict):
-    """Insert data from a gdfs into a duckdb table """
+    """Insert data from the local files into duckdb tables. Layers are read
+       concurrently; files already loaded and unmodified since are not read again"""
+    df_status = vectors_to_duckdb(dckCnx, loc_dict)
+    print(df_status.to_string(index=False))
+    
+    failed = df_status.loc[~df_status['STATUS'].isin(['OK', 'SKIPPED']), 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
+    
     tables = {}
-    counter= 1
-    for k, v in loc_dict.items():
-        print (f'..adding table {counter} of {len(loc_dict)}: {k}')
-        print ('....export from gdb')
-        df= esri_to_gdf (v)
-        df['GEOMETRY']= df['geometry'].apply(lambda x: wkb.dumps(x, output_dimension=2))
-        df = df.drop(columns=['geometry'])
-        
-        dck_tab_list= dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-        
-        if k in dck_tab_list:
-            dck_row_count= dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams= dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-                
-            if (dck_row_count != len(df)) or (set(list(df.columns)) != set(dck_col_nams)):
-                print (f'....import to Duckdb ({df.shape[0]} rows)')
-                create_table_query = f"""
-                CREATE OR REPLACE TABLE {k} AS
-                  SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS GEOMETRY
-                  FROM df;
-                """
-                dckCnx.execute(create_table_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-        
-        else:
-            print (f'....import to Duckdb ({df.shape[0]} rows)')
-            create_table_query = f"""
-            CREATE OR REPLACE TABLE {k} AS
-              SELECT * EXCLUDE geometry, ST_GeomFromWKB(geometry) AS GEOMETRY
-              FROM df;
-            """
-            dckCnx.execute(create_table_query)
-            
-        
-        df = df.drop(columns=['GEOMETRY'])
-        
-        tables[k] = df
-        
-        counter+= 1
+    for k in loc_dict:
+        tables[k] = dckCnx.execute(f'SELECT * EXCLUDE GEOMETRY FROM {k}').df()
         
     return tables
 
@@ -359,11 +261,9 @@ if __name__ == "__main__":
     wks= r'W:\srm\kam\Workarea\ksc_proj\Wildlife\Fisher\20240404_new_Fisher_draft_polygons'
     
     print ('Connect to databases')    
-    # Connect to the Oracle database
-    Oracle = OracleConnector()
-    Oracle.connect_to_db()
-    orcCnx= Oracle.connection
-    orcCur= Oracle.cursor
+    # Oracle session pool: connects on the first query not served from the cache
+    Oracle = OraclePoolConnector(sessions=4)
+    cache = QueryCache()
     
     # Connect to duckdb
     Duckdb= DuckDBConnector()
@@ -380,7 +280,7 @@ if __name__ == "__main__":
 
         print ('\nLoad BCGW datasets')
         orSql= load_Orc_sql ()
-        orcTables= oracle_2_duckdb(orcCnx, orcCur, dckCnx, orSql)
+        orcTables= oracle_2_duckdb(Oracle, dckCnx, orSql, cache)
         
         print ('\nLoad local datasets')
         gdb= os.path.join(wks,'test.gdb')
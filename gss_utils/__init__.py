@@ -0,0 +1,7 @@
+"""
+Helpers shared by the GSS project scripts (BCGW extraction, DuckDB loading).
+
+Scripts add the repository root to sys.path and import from here, e.g.:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+    from gss_utils.oracle_io import read_query_batches
+"""
@@ -0,0 +1,202 @@
+"""
+Local cache of BCGW query results.
+
+Entries are keyed by a hash of the SQL text and the bind variables (which
+include the AOI WKB) and stored as GeoParquet files. Entries expire after a
+TTL; the least recently used ones are evicted once the cache exceeds its
+size bound. Each entry keeps its metadata in a JSON file beside its
+parquet file: there is no shared index file for concurrent processes to
+overwrite. The cache directory defaults to ~/.gss_cache and can be set
+with the GSS_CACHE_DIR environment variable.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DEFAULT_CACHE_DIR = os.environ.get('GSS_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.gss_cache'))
+
+
+def query_key(query, bvars):
+    """Returns the cache key of a query: sha256 of the SQL text
+       (whitespace-normalized) and of the bind variables"""
+    h = hashlib.sha256(' '.join(query.split()).encode('utf-8'))
+    for k in sorted(bvars):
+        v = bvars[k]
+        h.update(k.encode('utf-8'))
+        h.update(v if isinstance(v, bytes) else repr(v).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _projjson(srid):
+    """Returns the PROJJSON of an EPSG code (None if it cannot be resolved)"""
+    try:
+        from pyproj import CRS
+        return CRS.from_epsg(int(srid)).to_json_dict()
+    except Exception:
+        return None
+
+
+def geoparquet_schema(schema, geom_col='GEOMETRY', srid=None):
+    """Returns the schema with GeoParquet metadata when geom_col holds WKB"""
+    if geom_col not in schema.names:
+        return schema
+    geom_type = schema.field(geom_col).type
+    if not (pa.types.is_binary(geom_type) or pa.types.is_large_binary(geom_type)):
+        return schema
+
+    geo = {'version': '1.0.0',
+           'primary_column': geom_col,
+           'columns': {geom_col: {'encoding': 'WKB',
+                                  'geometry_types': [],
+                                  'crs': _projjson(srid) if srid else None}}}
+    metadata = dict(schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo).encode('utf-8')
+    return schema.with_metadata(metadata)
+
+
+class QueryCache:
+    """GeoParquet cache of query results with TTL and LRU size bound"""
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl_hours=168, max_size_gb=10):
+        self.cache_dir = cache_dir
+        self.ttl = ttl_hours * 3600
+        self.max_size = max_size_gb * 1024**3
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _read_meta(self, key):
+        """Returns the metadata of an entry (None if it is gone)"""
+        try:
+            with open(self._meta_path(key), 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, key, entry):
+        tmp = f'{self._meta_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(entry, file, indent=1)
+        os.replace(tmp, self._meta_path(key))
+
+    def _load_index(self):
+        """Returns {key: metadata} of the entries on disk. Parquet files
+           without metadata (a process stopped during put) are listed from
+           their file stats, so that eviction still counts and removes them"""
+        index = {}
+        for f in os.listdir(self.cache_dir):
+            if not f.endswith('.parquet'):
+                continue
+            key = f[:-len('.parquet')]
+            entry = self._read_meta(key)
+            if entry is None:
+                try:
+                    st = os.stat(self._path(key))
+                except FileNotFoundError:
+                    continue
+                entry = {'label': '', 'rows': None, 'size': st.st_size,
+                         'created': st.st_mtime, 'last_access': st.st_mtime}
+            index[key] = entry
+        return index
+
+    def _remove(self, key):
+        for path in (self._path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """Returns the path of a fresh entry (None on miss or expiry)"""
+        with self._lock:
+            entry = self._read_meta(key)
+            if entry is None or not os.path.exists(self._path(key)):
+                return None
+            if time.time() - entry['created'] > self.ttl:
+                self._remove(key)
+                return None
+            entry['last_access'] = time.time()
+            self._write_meta(key, entry)
+            return self._path(key)
+
+    def put(self, key, tmp_path, n_rows, label=''):
+        """Moves a completed parquet file into the cache, then evicts"""
+        with self._lock:
+            os.replace(tmp_path, self._path(key))
+            now = time.time()
+            self._write_meta(key, {'label': label,
+                                   'rows': n_rows,
+                                   'size': os.path.getsize(self._path(key)),
+                                   'created': now,
+                                   'last_access': now})
+            self._evict()
+
+    def _evict(self):
+        """Drops expired entries, then the least recently used ones
+           until the cache fits in max_size"""
+        index = self._load_index()
+        now = time.time()
+        for k in [k for k, e in index.items() if now - e['created'] > self.ttl]:
+            self._remove(k)
+            del index[k]
+
+        lru = sorted(index, key=lambda k: index[k]['last_access'])
+        total = sum(e['size'] for e in index.values())
+        while lru and total > self.max_size:
+            k = lru.pop(0)
+            total -= index[k]['size']
+            self._remove(k)
+
+    def clear(self):
+        """Removes all entries"""
+        with self._lock:
+            for k in self._load_index():
+                self._remove(k)
+
+    def wrap(self, query, bvars, job, label='', geom_col='GEOMETRY', batch_size=10000):
+        """Returns a parallel_ingest job served from the cache on a hit.
+           On a miss, the batches of job are written to the cache as they
+           pass through; the entry is kept only if the job completes"""
+        key = query_key(query, bvars)
+
+        def _job():
+            path = self.get(key)
+            if path is not None:
+                print(f'....{label}: read from cache')
+                pf = pq.ParquetFile(path)
+                yield pf.schema_arrow
+                yield from pf.iter_batches(batch_size=batch_size)
+                return
+
+            stream = job()
+            schema = next(stream)
+            tmp = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            writer = pq.ParquetWriter(tmp, geoparquet_schema(schema, geom_col, bvars.get('srid')))
+            n_rows = 0
+            try:
+                yield schema
+                for batch in stream:
+                    writer.write_batch(batch)
+                    n_rows += batch.num_rows
+                    yield batch
+                writer.close()
+                self.put(key, tmp, n_rows, label)
+            finally:
+                stream.close()
+                writer.close()
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        return _job
@@ -0,0 +1,108 @@
+"""
+Persistent catalog of BCGW table metadata: geometry column, SRID, spatial
+index presence, approximate row count and column types.
+
+Entries are looked up once in the Oracle dictionary views and kept in a
+json file shared by all scripts (next to the query cache by default).
+An entry is refreshed lazily when requested after max_age_days.
+"""
+
+import os
+import json
+import time
+import threading
+
+from gss_utils.bcgw_cache import DEFAULT_CACHE_DIR
+
+
+DEFAULT_CATALOG_PATH = os.path.join(DEFAULT_CACHE_DIR, 'bcgw_catalog.json')
+
+SCALAR_TYPES = ('NUMBER', 'FLOAT', 'VARCHAR2', 'NVARCHAR2', 'CHAR', 'DATE')
+
+
+def _fetch(cursor, query, bvars):
+    cursor.execute(query, bvars)
+    return cursor.fetchall()
+
+
+def describe_table(cursor, table):
+    """Returns the metadata of a BCGW table (owner.table_name) from the dictionary views"""
+    owner, tab = [x.strip().upper() for x in table.split('.')]
+    bvars = {'owner': owner, 'tab_name': tab}
+
+    geom = _fetch(cursor, """SELECT COLUMN_NAME, SRID
+                             FROM ALL_SDO_GEOM_METADATA
+                             WHERE OWNER = :owner AND TABLE_NAME = :tab_name""", bvars)
+    if not geom:
+        raise KeyError(f"No spatial metadata found for '{table}'")
+    geom_col, srid = geom[0]
+
+    index = _fetch(cursor, """SELECT INDEX_NAME
+                              FROM ALL_SDO_INDEX_INFO
+                              WHERE TABLE_OWNER = :owner AND TABLE_NAME = :tab_name
+                                AND COLUMN_NAME = :geom_col""",
+                   dict(bvars, geom_col=geom_col))
+
+    # views (e.g. *_SVW) have no statistics
+    stats = _fetch(cursor, """SELECT NUM_ROWS
+                              FROM ALL_TABLES
+                              WHERE OWNER = :owner AND TABLE_NAME = :tab_name""", bvars)
+
+    cols = _fetch(cursor, """SELECT COLUMN_NAME, DATA_TYPE
+                             FROM ALL_TAB_COLUMNS
+                             WHERE OWNER = :owner AND TABLE_NAME = :tab_name
+                             ORDER BY COLUMN_ID""", bvars)
+
+    return {'geom_col': geom_col,
+            'srid': int(srid) if srid is not None else None,
+            'spatial_index': index[0][0] if index else None,
+            'num_rows': stats[0][0] if stats else None,
+            'columns': {c: t for c, t in cols},
+            'updated': time.time()}
+
+
+class BCGWCatalog:
+    """Local, lazily refreshed catalog of BCGW table metadata"""
+    def __init__(self, path=DEFAULT_CATALOG_PATH, max_age_days=30):
+        self.path = path
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self.tables = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.tables, file, indent=1)
+        os.replace(tmp, self.path)
+
+    def table_info(self, cursor, table, refresh=False):
+        """Returns the catalog entry of a table, looking it up in BCGW
+           if missing, older than max_age_days or refresh is set"""
+        key = table.strip().upper()
+        with self._lock:
+            entry = self.tables.get(key)
+            if refresh or entry is None or time.time() - entry['updated'] > self.max_age:
+                entry = describe_table(cursor, key)
+                self.tables[key] = entry
+                self._save()
+            return entry
+
+    def geom_col(self, cursor, table):
+        """Returns the geometry column of a BCGW table: SHAPE or GEOMETRY"""
+        return self.table_info(cursor, table)['geom_col']
+
+    def srid(self, cursor, table):
+        """Returns the SRID of the geometry column of a BCGW table"""
+        return self.table_info(cursor, table)['srid']
+
+    def scalar_columns(self, cursor, table):
+        """Returns the non-spatial, non-LOB columns of a BCGW table"""
+        cols = self.table_info(cursor, table)['columns']
+        return [c for c, t in cols.items() if t in SCALAR_TYPES or t.startswith('TIMESTAMP')]
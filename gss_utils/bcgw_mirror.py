@@ -0,0 +1,254 @@
+"""
+Local GeoParquet mirror of core BCGW reference layers.
+
+Each layer is snapshotted once into a hive-partitioned dataset on a square
+grid (CELL_X=../CELL_Y=..), with per-feature XMIN/YMIN/XMAX/YMAX columns so
+that parquet row-group statistics can prune on bbox. The manifest records
+the extent of each cell: reads only open the cells intersecting the AOI.
+Snapshots older than max_age_days are not used (see mirror_exists): the
+loaders read the layer from BCGW until it is snapshotted again.
+
+The mirror directory defaults to ~/.gss_mirror and can be set with the
+GSS_MIRROR_DIR environment variable. To (re)build snapshots:
+    python bcgw_mirror.py [layer ...]
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import shapely
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gss_utils.oracle_io import read_query_batches
+from gss_utils.bcgw_cache import geoparquet_schema
+from gss_utils.bcgw_catalog import BCGWCatalog
+
+
+DEFAULT_MIRROR_DIR = os.environ.get('GSS_MIRROR_DIR',
+                                    os.path.join(os.path.expanduser('~'), '.gss_mirror'))
+
+# layer name: BCGW table
+MIRROR_LAYERS = {
+    'tsa': 'WHSE_ADMIN_BOUNDARIES.FADM_TSA',
+    'bec': 'WHSE_FOREST_VEGETATION.BEC_BIOGEOCLIMATIC_POLY',
+    'lakes': 'WHSE_BASEMAPPING.FWA_LAKES_POLY',
+    'wetlands': 'WHSE_BASEMAPPING.FWA_WETLANDS_POLY',
+    'watershed_groups': 'WHSE_BASEMAPPING.FWA_WATERSHED_GROUPS_POLY',
+    'priority_deferrals': 'WHSE_FOREST_VEGETATION.OGSR_PRIORITY_DEF_AREA_CUR_SP',
+}
+
+MIRROR_SRID = 3005
+DEFAULT_MAX_AGE_DAYS = 30
+BBOX_COLS = ['XMIN', 'YMIN', 'XMAX', 'YMAX']
+
+
+def _layer_dir(name, mirror_dir):
+    return os.path.join(mirror_dir, name)
+
+
+def load_manifest(name, mirror_dir=DEFAULT_MIRROR_DIR):
+    """Returns the manifest of a mirrored layer (None if not snapshotted)"""
+    path = os.path.join(_layer_dir(name, mirror_dir), 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def snapshot_age_days(manifest):
+    """Returns the age in days of the snapshot of a manifest"""
+    return (datetime.now() - datetime.fromisoformat(manifest['snapshot'])).total_seconds() / 86400
+
+
+def mirror_exists(name, mirror_dir=DEFAULT_MIRROR_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """Returns True if the layer has been snapshotted less than max_age_days
+       ago (at any time if None)"""
+    manifest = load_manifest(name, mirror_dir)
+    if manifest is None:
+        return False
+
+    age = snapshot_age_days(manifest)
+    if max_age_days is not None and age > max_age_days:
+        print(f"....{name}: mirror snapshot of {manifest['snapshot']} is {int(age)} days old "
+              f"(max {max_age_days}): reading BCGW. Run snapshot_layer to refresh it")
+        return False
+
+    return True
+
+
+def _add_bbox_cells(batch, grid_size, extents):
+    """Appends the bbox and grid cell columns to a batch, growing the cell extents"""
+    bounds = shapely.bounds(shapely.from_wkb(batch.column('GEOMETRY').to_numpy(zero_copy_only=False)))
+    centers = np.nan_to_num(bounds)
+    cell_x = ((centers[:, 0] + centers[:, 2]) / 2 // grid_size).astype('int32')
+    cell_y = ((centers[:, 1] + centers[:, 3]) / 2 // grid_size).astype('int32')
+
+    for cx, cy, b in zip(cell_x, cell_y, bounds):
+        if math.isnan(b[0]):
+            continue
+        key = f'{cx}_{cy}'
+        e = extents.get(key, [b[0], b[1], b[2], b[3]])
+        extents[key] = [min(e[0], b[0]), min(e[1], b[1]), max(e[2], b[2]), max(e[3], b[3])]
+
+    arrays = batch.columns + [pa.array(bounds[:, i]) for i in range(4)] + [pa.array(cell_x), pa.array(cell_y)]
+    names = batch.schema.names + BBOX_COLS + ['CELL_X', 'CELL_Y']
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def snapshot_layer(pool_connector, name, mirror_dir=DEFAULT_MIRROR_DIR,
+                   grid_size=50000, batch_size=10000, catalog=None):
+    """Snapshots a BCGW layer into the mirror. The new snapshot replaces
+       the previous one only once fully written"""
+    table = MIRROR_LAYERS[name]
+    catalog = catalog or BCGWCatalog()
+    layer_dir = _layer_dir(name, mirror_dir)
+    tmp_dir = f'{layer_dir}.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    connection = pool_connector.acquire()
+    try:
+        cursor = connection.cursor()
+        geom_col = catalog.geom_col(cursor, table)
+        cols = catalog.scalar_columns(cursor, table)
+        query = f"""SELECT {', '.join(cols)}, SDO_UTIL.TO_WKBGEOMETRY({geom_col}) AS GEOMETRY
+                    FROM {table}"""
+
+        print(f'..snapshotting {table}')
+        batches = read_query_batches(cursor, query, {}, batch_size, prefetchrows=batch_size)
+        first = next(batches, None)
+        if first is None:
+            raise Exception(f'..{table} returned no rows')
+
+        extents = {}
+        first = _add_bbox_cells(first, grid_size, extents)
+        schema = geoparquet_schema(first.schema, 'GEOMETRY', MIRROR_SRID)
+
+        def _batches():
+            yield first
+            for batch in batches:
+                yield _add_bbox_cells(batch, grid_size, extents)
+
+        ds.write_dataset(_batches(), tmp_dir, schema=schema, format='parquet',
+                         partitioning=ds.partitioning(pa.schema([('CELL_X', pa.int32()),
+                                                                 ('CELL_Y', pa.int32())]),
+                                                      flavor='hive'),
+                         max_rows_per_group=batch_size,
+                         max_partitions=100000)
+        cursor.close()
+    finally:
+        pool_connector.release(connection)
+
+    n_rows = sum(f.count_rows() for f in ds.dataset(tmp_dir, format='parquet').get_fragments())
+    manifest = {'table': table,
+                'srid': MIRROR_SRID,
+                'snapshot': datetime.now().isoformat(timespec='seconds'),
+                'rows': n_rows,
+                'grid_size': grid_size,
+                'cells': extents}
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1)
+
+    if os.path.exists(layer_dir):
+        shutil.rmtree(layer_dir)
+    os.replace(tmp_dir, layer_dir)
+    print(f'....{name}: {n_rows} rows in {len(extents)} cells')
+
+    return manifest
+
+
+def mirror_files(name, bbox=None, mirror_dir=DEFAULT_MIRROR_DIR):
+    """Returns the parquet files of the cells whose extent intersects bbox"""
+    manifest = load_manifest(name, mirror_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"Layer '{name}' is not in the mirror: run snapshot_layer first")
+
+    files = []
+    for key, (xmin, ymin, xmax, ymax) in manifest['cells'].items():
+        if bbox is not None and (xmin > bbox[2] or xmax < bbox[0] or ymin > bbox[3] or ymax < bbox[1]):
+            continue
+        cx, cy = key.split('_')
+        cell_dir = os.path.join(_layer_dir(name, mirror_dir), f'CELL_X={cx}', f'CELL_Y={cy}')
+        files.extend(os.path.join(cell_dir, f) for f in sorted(os.listdir(cell_dir)))
+
+    return files
+
+
+def bbox_filter(bbox):
+    """Returns the Arrow filter on the bbox columns, pushed down to row-group stats"""
+    xmin, ymin, xmax, ymax = bbox
+    return ((pc.field('XMIN') <= xmax) & (pc.field('XMAX') >= xmin) &
+            (pc.field('YMIN') <= ymax) & (pc.field('YMAX') >= ymin))
+
+
+def mirror_job(name, aoi_geom=None, columns=None, rename=None, filter=None, distance=0,
+               mirror_dir=DEFAULT_MIRROR_DIR, batch_size=10000):
+    """Returns a parallel_ingest job reading a mirrored layer. Features are
+       kept if within distance of the AOI (all features if no AOI) and
+       matching the Arrow filter expression"""
+    def _job():
+        bbox = None
+        if aoi_geom is not None:
+            xmin, ymin, xmax, ymax = aoi_geom.bounds
+            bbox = (xmin - distance, ymin - distance, xmax + distance, ymax + distance)
+            shapely.prepare(aoi_geom)
+
+        files = mirror_files(name, bbox, mirror_dir)
+        # no cell in the AOI: the schema is read from any cell of the layer
+        dataset = ds.dataset(files or mirror_files(name, None, mirror_dir)[:1], format='parquet')
+        cols = (columns or [c for c in dataset.schema.names if c not in BBOX_COLS + ['GEOMETRY']]) + ['GEOMETRY']
+        names = [(rename or {}).get(c, c) for c in cols]
+        yield pa.schema([dataset.schema.field(c).with_name(n) for c, n in zip(cols, names)])
+
+        if not files:
+            return
+
+        expr = bbox_filter(bbox) if bbox is not None else None
+        if filter is not None:
+            expr = filter if expr is None else expr & filter
+
+        for batch in dataset.to_batches(columns=cols, filter=expr, batch_size=batch_size):
+            if aoi_geom is not None:
+                geoms = shapely.from_wkb(batch.column('GEOMETRY').to_numpy(zero_copy_only=False))
+                if distance:
+                    keep = shapely.dwithin(geoms, aoi_geom, distance)
+                else:
+                    keep = shapely.intersects(geoms, aoi_geom)
+                batch = batch.filter(pa.array(keep))
+            if batch.num_rows:
+                yield pa.RecordBatch.from_arrays(batch.columns, names=names)
+
+    return _job
+
+
+def read_mirror(name, aoi_geom=None, columns=None, filter=None, distance=0,
+                mirror_dir=DEFAULT_MIRROR_DIR):
+    """Returns a gdf of the mirrored layer features within distance of the AOI"""
+    import geopandas as gpd
+
+    stream = mirror_job(name, aoi_geom, columns, None, filter, distance, mirror_dir)()
+    schema = next(stream)
+    table = pa.Table.from_batches(list(stream), schema=schema)
+    df = table.to_pandas()
+    geoms = gpd.GeoSeries.from_wkb(df.pop('GEOMETRY'), crs=f'EPSG:{MIRROR_SRID}')
+
+    return gpd.GeoDataFrame(df, geometry=geoms)
+
+
+if __name__ == "__main__":
+    from gss_utils.oracle_io import OraclePoolConnector
+
+    layers = sys.argv[1:] or list(MIRROR_LAYERS)
+    Oracle = OraclePoolConnector(sessions=1)
+    try:
+        for layer in layers:
+            snapshot_layer(Oracle, layer)
+    finally:
+        Oracle.disconnect_db()
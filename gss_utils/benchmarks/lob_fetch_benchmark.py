@@ -0,0 +1,90 @@
+"""
+Compares fetch throughput (rows/sec) of WKT CLOB columns with and without
+the inline LOB output type handler of OracleConnector.
+
+Runs against a local stand-in Oracle instance (e.g. an Oracle XE container)
+registered in H:\\config\\db_config.json, never against BCGW:
+    python lob_fetch_benchmark.py LOCAL_XE 50000 200
+"""
+
+import os
+import sys
+import timeit
+import cx_Oracle
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.oracle_io import OracleConnector, read_query_batches
+
+
+BENCH_TABLE = 'GSS_BENCH_WKT'
+
+
+def make_wkt(i, n_vertices):
+    """Returns the WKT of a closed ring polygon with n_vertices"""
+    x0, y0 = 1000000 + (i % 500) * 1000, 500000 + (i // 500) * 1000
+    pts = [(x0 + (j % 2) * 10 + j, y0 + (j // 2) * 3) for j in range(n_vertices)]
+    pts.append(pts[0])
+    coords = ', '.join(f'{x} {y}' for x, y in pts)
+    return f'POLYGON (({coords}))'
+
+
+def create_stand_in(connector, n_rows, n_vertices):
+    """Creates and populates the stand-in table of WKT CLOBs"""
+    cursor = connector.connection.cursor()
+    cursor.execute(f"""
+        BEGIN
+            EXECUTE IMMEDIATE 'DROP TABLE {BENCH_TABLE}';
+        EXCEPTION WHEN OTHERS THEN NULL;
+        END;""")
+    cursor.execute(f'CREATE TABLE {BENCH_TABLE} (ID NUMBER(10), GEOMETRY CLOB)')
+
+    chunk = 5000
+    for start in range(0, n_rows, chunk):
+        rows = [(i, make_wkt(i, n_vertices)) for i in range(start, min(start + chunk, n_rows))]
+        cursor.setinputsizes(None, cx_Oracle.DB_TYPE_CLOB)
+        cursor.executemany(f'INSERT INTO {BENCH_TABLE} VALUES (:1, :2)', rows)
+
+    connector.connection.commit()
+    cursor.close()
+
+
+def time_fetch(dbname, inline_lobs, batch_size):
+    """Returns (rows, seconds) for a full fetch of the stand-in table"""
+    connector = OracleConnector(dbname=dbname, inline_lobs=inline_lobs,
+                                arraysize=batch_size, prefetchrows=batch_size)
+    connector.connect_to_db()
+    try:
+        start_t = timeit.default_timer()
+        n_rows = 0
+        for batch in read_query_batches(connector.cursor,
+                                        f'SELECT ID, GEOMETRY FROM {BENCH_TABLE}', {},
+                                        batch_size=batch_size, prefetchrows=batch_size):
+            n_rows += batch.num_rows
+        return n_rows, timeit.default_timer() - start_t
+    finally:
+        connector.disconnect_db()
+
+
+if __name__ == "__main__":
+    dbname = sys.argv[1] if len(sys.argv) > 1 else 'LOCAL_XE'
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    n_vertices = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    batch_size = 5000
+
+    print(f'Creating stand-in table ({n_rows} rows, {n_vertices} vertices)')
+    setup = OracleConnector(dbname=dbname)
+    setup.connect_to_db()
+    try:
+        create_stand_in(setup, n_rows, n_vertices)
+    finally:
+        setup.disconnect_db()
+
+    results = {}
+    for label, inline in (('LOB locators (before)', False), ('inline LOBs (after)', True)):
+        print(f'\nFetching with {label}')
+        rows, secs = time_fetch(dbname, inline, batch_size)
+        results[label] = rows / secs
+        print(f'..{rows} rows in {secs:.1f} s: {rows / secs:,.0f} rows/sec')
+
+    before, after = results.values()
+    print(f'\nSpeed-up: {after / before:.1f}x')
@@ -0,0 +1,155 @@
+"""
+Tiled parallel dissolve (cascaded union) of polygon layers.
+
+A single ST_Union/unary_union over a whole layer runs on one core, holds
+everything in memory and returns one huge multipolygon. Here the extent is
+split into quadtree tiles sized on the vertex count (see
+tiling.quadtree_tiles); the features are clipped to each tile and unioned
+by group in a thread pool (the shapely ops release the GIL). Parts away
+from the tile edges are final; only the parts touching a seam are unioned
+again, by group, to stitch them across the tiles.
+
+Output is one (multi)polygon per group, or its single parts with a stable
+PART_ID: parts are numbered in (group, xmin, ymin, area) order, so the IDs
+do not depend on the tiling or on the thread scheduling.
+"""
+
+import numpy as np
+import shapely
+import pandas as pd
+import pyarrow as pa
+import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+
+from gss_utils.duckdb_io import arrow_to_duckdb, replace_if_changed
+from gss_utils.tiling import quadtree_tiles
+
+
+def _tile_union(tile, geoms, codes, tree, aoi_edge, grid_size):
+    """Returns the parts of the union by group of the geometries clipped to
+       the tile, their group codes and a mask of the parts touching the tile
+       seams (edges inside the AOI)"""
+    idx = tree.query(tile)
+    clipped = shapely.intersection(geoms[idx], tile, grid_size=grid_size)
+    parts, part_codes = [], []
+    for code in np.unique(codes[idx]):
+        union = shapely.union_all(clipped[codes[idx] == code], grid_size=grid_size)
+        p = shapely.get_parts(union)
+        p = p[shapely.get_type_id(p) == 3]
+        parts.append(p)
+        part_codes.append(np.full(len(p), code))
+
+    parts = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+    part_codes = np.concatenate(part_codes) if part_codes else np.empty(0, dtype=int)
+    seam = shapely.dwithin(parts, shapely.difference(shapely.boundary(tile), aoi_edge),
+                           2 * (grid_size or 0))
+
+    return parts, part_codes, seam
+
+
+def dissolve_geometries(geoms, groups=None, explode=False, max_vertices=200000,
+                        max_depth=8, max_workers=4, grid_size=None):
+    """Dissolves the polygons by group (all together if None). Returns the
+       group values and the dissolved geometries: one per group, or their
+       single parts in stable order if explode. Inputs are normalized on
+       ingest (geom_utils): set grid_size only to snap again, it is much slower"""
+    geoms = np.asarray(geoms, dtype=object)
+    groups = np.zeros(len(geoms), dtype=int) if groups is None else np.asarray(groups)
+    keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    geoms, groups = geoms[keep], groups[keep]
+    if not len(geoms):
+        return groups, geoms
+
+    values, codes = np.unique(groups, return_inverse=True)
+    codes = codes.ravel()
+    tree = shapely.STRtree(geoms)
+    n_vertices = shapely.get_num_coordinates(geoms)
+
+    def _count(tile):
+        return int(n_vertices[tree.query(tile)].sum())
+
+    aoi_geom = shapely.box(*shapely.total_bounds(geoms))
+    tiles = quadtree_tiles(aoi_geom, _count, max_vertices, max_depth, max_workers)
+    print(f'....dissolve: {len(geoms)} features, {len(tiles)} tiles')
+    aoi_edge = shapely.boundary(aoi_geom)
+
+    parts, part_codes = [], []
+    seam_parts, seam_codes = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for p, c, seam in executor.map(lambda t: _tile_union(t[0], geoms, codes, tree, aoi_edge, grid_size), tiles):
+            parts.append(p[~seam])
+            part_codes.append(c[~seam])
+            seam_parts.append(p[seam])
+            seam_codes.append(c[seam])
+
+        # stitch the parts across the tile seams
+        seam_parts, seam_codes = np.concatenate(seam_parts), np.concatenate(seam_codes)
+
+        def _stitch(code):
+            union = shapely.union_all(seam_parts[seam_codes == code], grid_size=grid_size)
+            p = shapely.get_parts(union)
+            return p[shapely.get_type_id(p) == 3], code
+
+        for p, code in executor.map(_stitch, np.unique(seam_codes)):
+            parts.append(p)
+            part_codes.append(np.full(len(p), code))
+
+    parts, part_codes = np.concatenate(parts), np.concatenate(part_codes)
+    if not len(parts):
+        return values[:0], parts
+    xmin, ymin = shapely.bounds(parts)[:, 0], shapely.bounds(parts)[:, 1]
+    order = np.lexsort((shapely.area(parts), ymin, xmin, part_codes))
+    parts, part_codes = parts[order], part_codes[order]
+
+    if explode:
+        return values[part_codes], parts
+
+    # parts of a group are disjoint: no further union needed
+    starts = np.flatnonzero(np.r_[True, part_codes[1:] != part_codes[:-1]])
+    merged = [shapely.multipolygons(p) if len(p) > 1 else p[0]
+              for p in np.split(parts, starts[1:])]
+
+    return values[part_codes[starts]], np.array(merged, dtype=object)
+
+
+def dissolve_gdf(gdf, by=None, explode=False, **kwargs):
+    """Returns the gdf dissolved by the column (all together if None), as
+       gdf.dissolve(by).reset_index() without the other columns. With
+       explode, one row per single part with a stable PART_ID"""
+    groups = gdf[by].to_numpy() if by else None
+    values, geoms = dissolve_geometries(gdf.geometry.values, groups, explode, **kwargs)
+
+    df = pd.DataFrame({by: values}) if by else pd.DataFrame(index=range(len(geoms)))
+    if explode:
+        df['PART_ID'] = np.arange(1, len(geoms) + 1)
+
+    return gpd.GeoDataFrame(df, geometry=geoms, crs=gdf.crs)
+
+
+def dissolve_table(dckCnx, table, source, by=None, explode=False, geom_col='geometry', **kwargs):
+    """Dissolves the rows of a duckdb query or table (source) by the column
+       (all together if None) into table; with explode, one row per single
+       part with a stable PART_ID. Returns the row count"""
+    cols = f'{by}, ' if by else ''
+    source = f'({source})' if len(source.split()) > 1 else source
+    data = dckCnx.execute(f"""SELECT {cols}ST_AsWKB({geom_col}) AS _wkb
+                              FROM {source}""").fetch_arrow_table()
+    geoms = shapely.from_wkb(data.column('_wkb').to_numpy(zero_copy_only=False))
+    groups = data.column(by).to_numpy(zero_copy_only=False) if by else None
+
+    values, geoms = dissolve_geometries(geoms, groups, explode, **kwargs)
+
+    arrays, names = [], []
+    if by:
+        arrays.append(pa.array(values))
+        names.append(by)
+    if explode:
+        arrays.append(pa.array(np.arange(1, len(geoms) + 1)))
+        names.append('PART_ID')
+    arrays.append(pa.array(shapely.to_wkb(geoms), pa.binary()))
+    names.append(geom_col)
+
+    stage = f'{table}_stage'
+    arrow_to_duckdb(dckCnx, stage, pa.Table.from_arrays(arrays, names=names), geom_col)
+
+    return replace_if_changed(dckCnx, table, stage)
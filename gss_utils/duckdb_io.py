@@ -0,0 +1,242 @@
+"""
+Helpers for loading spatial data into DuckDB.
+
+Loads go through a staging table. The _load_manifest table records, for
+each loaded table, the signature of its source (file path/mtime or SQL
+hash) and a fingerprint of its content (row count, columns and an
+order-independent sum of the row hashes, geometry included). A load is
+skipped when the content is unchanged; small changes are applied in place
+(rows deleted/inserted by hash) instead of replacing the table.
+
+Loaded tables are stored sorted on the Hilbert key of the feature bbox
+centers, so that nearby features share row groups, and get an RTREE
+index on each GEOMETRY column. With a schema registry (schemas=, e.g.
+schemas.TOR_FLP_SCHEMAS), the stages of its tables are cast to their
+declared types before loading.
+"""
+
+import hashlib
+import pyarrow as pa
+
+from gss_utils.schemas import apply_schema
+
+
+MANIFEST_TABLE = '_load_manifest'
+
+
+def geom_from_sql(schema, geom_col='GEOMETRY'):
+    """Returns the SQL expression building a GEOMETRY from a WKT or WKB column"""
+    field = schema.field(geom_col)
+    if pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type):
+        return f'ST_GeomFromWKB({geom_col})'
+
+    return f'ST_GeomFromText({geom_col})'
+
+
+def select_sql(schema, view, geom_col='GEOMETRY'):
+    """Returns a SELECT over an Arrow view converting the geometry column"""
+    if geom_col not in schema.names:
+        return f'SELECT * FROM {view}'
+
+    return f'SELECT * EXCLUDE {geom_col}, {geom_from_sql(schema, geom_col)} AS {geom_col} FROM {view}'
+
+
+def list_tables(dckCnx):
+    """Returns the list of tables in the duckdb database"""
+    return [r[0] for r in dckCnx.execute('SHOW TABLES').fetchall()]
+
+
+def get_columns(dckCnx, table):
+    """Returns the column names of a duckdb table"""
+    rows = dckCnx.execute("""SELECT column_name
+                             FROM INFORMATION_SCHEMA.COLUMNS
+                             WHERE table_name = ?
+                             ORDER BY ordinal_position""", [table]).fetchall()
+    return [r[0] for r in rows]
+
+
+def arrow_to_duckdb(dckCnx, table, data, geom_col='GEOMETRY', append=False):
+    """Creates (or appends to) a duckdb table from an Arrow table, batch or reader.
+       Readers are consumed by duckdb as batches are produced"""
+    if isinstance(data, pa.RecordBatch):
+        data = pa.Table.from_batches([data])
+
+    view = f'{table}_arrow_src'
+    dckCnx.register(view, data)
+    try:
+        query = select_sql(data.schema, view, geom_col)
+        if append:
+            dckCnx.execute(f'INSERT INTO {table} {query};')
+        else:
+            dckCnx.execute(f'CREATE OR REPLACE TABLE {table} AS {query};')
+    finally:
+        dckCnx.unregister(view)
+
+
+def geometry_columns(dckCnx, table):
+    """Returns the GEOMETRY columns of a duckdb table"""
+    return [c for c, t in _column_types(dckCnx, table) if t.startswith('GEOMETRY')]
+
+
+def hilbert_key_sql(dckCnx, table, geom_col):
+    """Returns the SQL expression of the Hilbert key of the bbox center of
+       geom_col, over the extent of the table (None if the table is empty)"""
+    extent = dckCnx.execute(f"""SELECT MIN(ST_XMin({geom_col})), MIN(ST_YMin({geom_col})),
+                                       MAX(ST_XMax({geom_col})), MAX(ST_YMax({geom_col}))
+                                FROM {table}""").fetchone()
+    if extent[0] is None:
+        return None
+    box = (f"{{'min_x': {extent[0]}, 'min_y': {extent[1]}, "
+           f"'max_x': {extent[2]}, 'max_y': {extent[3]}}}::BOX_2D")
+
+    return (f'ST_Hilbert((ST_XMin({geom_col}) + ST_XMax({geom_col})) / 2, '
+            f'(ST_YMin({geom_col}) + ST_YMax({geom_col})) / 2, {box})')
+
+
+def create_spatial_indexes(dckCnx, table, replace=True):
+    """Creates (or replaces) an RTREE index on each GEOMETRY column of a table"""
+    for geom_col in geometry_columns(dckCnx, table):
+        index = f'idx_{table}_{geom_col}'
+        if replace:
+            dckCnx.execute(f'DROP INDEX IF EXISTS {index}')
+        dckCnx.execute(f'CREATE INDEX IF NOT EXISTS {index} ON {table} USING RTREE ({geom_col})')
+
+
+def organize_spatial_table(dckCnx, table, source=None):
+    """Rewrites a table (or the source table into it) sorted on the Hilbert key
+       of its first GEOMETRY column, then indexes its GEOMETRY columns"""
+    source = source or table
+    geom_cols = geometry_columns(dckCnx, source)
+    key = hilbert_key_sql(dckCnx, source, geom_cols[0]) if geom_cols else None
+
+    if key is not None:
+        dckCnx.execute(f"""CREATE OR REPLACE TABLE {table} AS
+                             SELECT * FROM {source} ORDER BY {key} NULLS LAST""")
+        if source != table:
+            dckCnx.execute(f'DROP TABLE {source}')
+    elif source != table:
+        dckCnx.execute(f'ALTER TABLE {source} RENAME TO {table}')
+
+    create_spatial_indexes(dckCnx, table)
+
+
+def _ensure_manifest(dckCnx):
+    dckCnx.execute(f"""CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                         TABLE_NAME VARCHAR PRIMARY KEY,
+                         SOURCE VARCHAR,
+                         FINGERPRINT VARCHAR,
+                         ROW_COUNT BIGINT,
+                         LOADED_AT TIMESTAMP)""")
+
+
+def get_manifest_entry(dckCnx, table):
+    """Returns the (SOURCE, FINGERPRINT, ROW_COUNT) recorded for a table (None if never loaded)"""
+    _ensure_manifest(dckCnx)
+    return dckCnx.execute(f"""SELECT SOURCE, FINGERPRINT, ROW_COUNT
+                              FROM {MANIFEST_TABLE}
+                              WHERE TABLE_NAME = ?""", [table]).fetchone()
+
+
+def _record_load(dckCnx, table, source, fingerprint, n_rows):
+    _ensure_manifest(dckCnx)
+    dckCnx.execute(f"""INSERT OR REPLACE INTO {MANIFEST_TABLE}
+                       VALUES (?, ?, ?, ?, current_timestamp)""",
+                   [table, source, fingerprint, n_rows])
+
+
+def _column_types(dckCnx, table):
+    return [(r[0], r[1]) for r in dckCnx.execute(f'DESCRIBE {table}').fetchall()]
+
+
+def table_fingerprint(dckCnx, table):
+    """Returns the content fingerprint of a table: hash of its columns, row
+       count and the sum of the row hashes (independent of the row order)"""
+    n_rows, h_rows = dckCnx.execute(f"""SELECT COUNT(*), COALESCE(SUM(hash(t)::HUGEINT), 0)
+                                        FROM {table} t""").fetchone()
+    h = hashlib.sha256(repr(_column_types(dckCnx, table)).encode('utf-8'))
+    h.update(f'{n_rows}|{h_rows}'.encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def is_loaded(dckCnx, table, source):
+    """Returns True if the table was loaded from the same source signature
+       and its content has not changed since"""
+    entry = get_manifest_entry(dckCnx, table)
+    if source is None or entry is None or entry[0] != source or table not in list_tables(dckCnx):
+        return False
+
+    return table_fingerprint(dckCnx, table) == entry[1]
+
+
+def _refresh_in_place(dckCnx, table, stage, max_changed):
+    """Applies the row differences between stage and table to table (deletes,
+       then inserts, matched on row hash) if they are at most max_changed of
+       the rows. Returns the (deleted, inserted) counts, None if not applied"""
+    n_del = dckCnx.execute(f"""SELECT COUNT(*) FROM {table} t
+                               WHERE hash(t) NOT IN (SELECT hash(s) FROM {stage} s)""").fetchone()[0]
+    n_ins = dckCnx.execute(f"""SELECT COUNT(*) FROM {stage} s
+                               WHERE hash(s) NOT IN (SELECT hash(t) FROM {table} t)""").fetchone()[0]
+    n_rows = dckCnx.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    if n_del + n_ins > max_changed * max(n_rows, 1):
+        return None
+
+    dckCnx.execute('BEGIN TRANSACTION')
+    try:
+        dckCnx.execute(f"""DELETE FROM {table} t
+                           WHERE hash(t) NOT IN (SELECT hash(s) FROM {stage} s)""")
+        dckCnx.execute(f"""INSERT INTO {table}
+                           SELECT * FROM {stage} s
+                           WHERE hash(s) NOT IN (SELECT hash(t) FROM {table} t)""")
+        dckCnx.execute('COMMIT')
+    except Exception:
+        dckCnx.execute('ROLLBACK')
+        raise
+
+    return n_del, n_ins
+
+
+def replace_if_changed(dckCnx, table, stage, source=None, max_changed=0.2, schemas=None):
+    """Loads the stage table into table and records the load in the manifest.
+       Skips the load if the content is unchanged; applies the changes in
+       place if they touch at most max_changed of the rows; otherwise
+       replaces the table (Hilbert-sorted and indexed). The stage is first
+       cast to the types declared in the schemas registry, if any. Returns the row count"""
+    if schemas is not None:
+        apply_schema(dckCnx, table, stage, schemas)
+    n_rows = dckCnx.execute(f'SELECT COUNT(*) FROM {stage}').fetchone()[0]
+    fingerprint = table_fingerprint(dckCnx, stage)
+
+    if table in list_tables(dckCnx):
+        if _column_types(dckCnx, table) == _column_types(dckCnx, stage):
+            if table_fingerprint(dckCnx, table) == fingerprint:
+                print(f'....{table}: data already in db: skip importing')
+                dckCnx.execute(f'DROP TABLE {stage}')
+                create_spatial_indexes(dckCnx, table, replace=False)
+                _record_load(dckCnx, table, source, fingerprint, n_rows)
+                return n_rows
+
+            changes = _refresh_in_place(dckCnx, table, stage, max_changed)
+            # duplicated rows are not matched one to one by hash: replace if they differ
+            if changes is not None and table_fingerprint(dckCnx, table) == fingerprint:
+                print(f'....{table}: refreshed in place ({changes[0]} rows deleted, {changes[1]} inserted)')
+                dckCnx.execute(f'DROP TABLE {stage}')
+                _record_load(dckCnx, table, source, fingerprint, n_rows)
+                return n_rows
+
+        dckCnx.execute(f'DROP TABLE {table}')
+
+    print(f'....{table}: imported to Duckdb ({n_rows} rows)')
+    organize_spatial_table(dckCnx, table, stage)
+    _record_load(dckCnx, table, source, fingerprint, n_rows)
+
+    return n_rows
+
+
+def stream_to_duckdb(dckCnx, table, reader, geom_col='GEOMETRY', source=None, schemas=None):
+    """Streams a reader into a staging table, then loads it into the target
+       table unless its content is unchanged (see replace_if_changed)"""
+    stage = f'{table}_stage'
+    arrow_to_duckdb(dckCnx, stage, reader, geom_col)
+
+    return replace_if_changed(dckCnx, table, stage, source, schemas=schemas)
@@ -0,0 +1,96 @@
+"""
+Vectorized geometry normalization applied by the loaders before data
+reaches DuckDB: drop Z/M, repair invalid geometries, snap to a precision
+grid and drop empty geometries. Each step runs as a shapely array op, or
+as a DuckDB spatial statement for layers read with ST_Read.
+"""
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+
+# precision grid, in layer units (m for BC Albers)
+DEFAULT_GRID_SIZE = 0.001
+
+
+def normalize_geometries(geoms, grid_size=DEFAULT_GRID_SIZE):
+    """Returns the normalized geometries (2D, valid, snapped to grid_size if
+       set), a mask of the non-empty ones and the count of features fixed
+       by each step"""
+    geoms = np.asarray(geoms, dtype=object)
+    missing = shapely.is_missing(geoms)
+    counts = {}
+
+    has_z = shapely.has_z(geoms)
+    counts['flattened'] = int(has_z.sum())
+    if counts['flattened']:
+        geoms = shapely.force_2d(geoms)
+
+    invalid = ~shapely.is_valid(geoms) & ~missing
+    counts['made valid'] = int(invalid.sum())
+    if counts['made valid']:
+        # structure method: polygons stay polygonal, collapsed parts are dropped
+        geoms[invalid] = shapely.make_valid(geoms[invalid], method='structure', keep_collapsed=False)
+
+    if grid_size:
+        snapped = shapely.set_precision(geoms, grid_size)
+        # almost every feature moves at the last digit: only count those whose
+        # parts collapsed or merged (set_precision output is valid)
+        changed = ((shapely.get_num_geometries(snapped) != shapely.get_num_geometries(geoms))
+                   | (shapely.is_empty(snapped) & ~shapely.is_empty(geoms)))
+        counts['parts changed by snapping'] = int((changed & ~missing).sum())
+        geoms = snapped
+
+    keep = ~(missing | shapely.is_empty(geoms))
+    counts['empty dropped'] = int((~keep).sum())
+
+    return geoms, keep, counts
+
+
+def report_counts(label, counts):
+    """Prints the count of features fixed by each normalization step"""
+    fixed = [f'{n} {step}' for step, n in counts.items() if n]
+    print(f"....{label}: {', '.join(fixed) if fixed else 'no geometry fixes'}")
+
+
+def normalize_duckdb_table(dckCnx, table, geom_col='GEOMETRY', grid_size=DEFAULT_GRID_SIZE):
+    """Normalizes the geometries of a duckdb table in place, with the same
+       steps as normalize_geometries, and deletes the empty ones. Returns the
+       count of features fixed by each step"""
+    def _rows(sql):
+        return dckCnx.execute(sql).fetchone()[0]
+
+    counts = {}
+    counts['flattened'] = _rows(f"""UPDATE {table} SET {geom_col} = ST_Force2D({geom_col})
+                                    WHERE ST_HasZ({geom_col}) OR ST_HasM({geom_col})""")
+    counts['made valid'] = _rows(f"""UPDATE {table} SET {geom_col} = ST_MakeValid({geom_col})
+                                     WHERE NOT ST_IsValid({geom_col})""")
+
+    if grid_size:
+        snapped = f'ST_ReducePrecision({geom_col}, {grid_size})'
+        counts['parts changed by snapping'] = _rows(f"""
+            SELECT COUNT(*) FROM {table}
+            WHERE ST_NumGeometries({snapped}) <> ST_NumGeometries({geom_col})
+               OR (ST_IsEmpty({snapped}) AND NOT ST_IsEmpty({geom_col}))""")
+        dckCnx.execute(f'UPDATE {table} SET {geom_col} = {snapped}')
+
+    counts['empty dropped'] = _rows(f"""DELETE FROM {table}
+                                        WHERE {geom_col} IS NULL OR ST_IsEmpty({geom_col})""")
+
+    return counts
+
+
+def normalize_gdf(gdf, grid_size=DEFAULT_GRID_SIZE, label='geometries'):
+    """Returns the gdf with normalized geometries, without the empty ones.
+       No snapping is done in a geographic CRS"""
+    if gdf.crs is not None and gdf.crs.is_geographic:
+        grid_size = None
+
+    geoms, keep, counts = normalize_geometries(gdf.geometry.values, grid_size)
+    report_counts(label, counts)
+
+    gdf = gdf.copy()
+    gdf[gdf.geometry.name] = gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs)
+
+    return gdf.loc[keep].reset_index(drop=True)
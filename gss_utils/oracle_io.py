@@ -0,0 +1,242 @@
+"""
+BCGW (Oracle) connection and streaming extraction of query results
+as Arrow record batches.
+"""
+
+import re
+import json
+import threading
+import cx_Oracle
+import pyarrow as pa
+
+from gss_utils.bcgw_cache import query_key
+
+
+def inline_lob_handler(cursor, name, default_type, size, precision, scale):
+    """Output type handler returning CLOB/BLOB values inline as str/bytes.
+       Avoids one network round trip per LOB (e.g. SDO_UTIL.TO_WKTGEOMETRY)"""
+    if default_type == cx_Oracle.DB_TYPE_CLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG, arraysize=cursor.arraysize)
+    if default_type == cx_Oracle.DB_TYPE_BLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
+
+
+class OracleConnector:
+    def __init__(self, dbname='BCGW', inline_lobs=True, arraysize=1000, prefetchrows=1000):
+        self.dbname = dbname
+        self.cnxinfo = self.get_db_cnxinfo()
+        self.inline_lobs = inline_lobs
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+
+    def get_db_cnxinfo(self):
+        """ Retrieves db connection params from the config file"""
+        with open(r'H:\config\db_config.json', 'r') as file:
+            data = json.load(file)
+        
+        if self.dbname in data:
+            return data[self.dbname]
+        
+        raise KeyError(f"Database '{self.dbname}' not found.")
+    
+    def connect_to_db(self):
+        """ Connects to Oracle DB and create a cursor.
+            With inline_lobs, LOB columns are fetched as str/bytes"""
+        try:
+            self.connection = cx_Oracle.connect(self.cnxinfo['username'], 
+                                                self.cnxinfo['password'], 
+                                                self.cnxinfo['hostname'], 
+                                                encoding="UTF-8")
+            if self.inline_lobs:
+                self.connection.outputtypehandler = inline_lob_handler
+            self.cursor = self.connection.cursor()
+            self.cursor.arraysize = self.arraysize
+            self.cursor.prefetchrows = self.prefetchrows
+            print  ("..Successffuly connected to the database")
+        except Exception as e:
+            raise Exception(f'..Connection failed: {e}')
+
+    def disconnect_db(self):
+        """Close the Oracle connection and cursor"""
+        if hasattr(self, 'cursor') and self.cursor:
+            self.cursor.close()
+        if hasattr(self, 'connection') and self.connection:
+            self.connection.close()
+            print("....Disconnected from the database")
+
+
+class OraclePoolConnector(OracleConnector):
+    """Session pool of N BCGW connections for concurrent extracts"""
+    def __init__(self, dbname='BCGW', sessions=4, inline_lobs=True, arraysize=1000, prefetchrows=1000):
+        super().__init__(dbname, inline_lobs, arraysize, prefetchrows)
+        self.sessions = sessions
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def connect_to_db(self):
+        """ Creates a session pool with a fixed number of sessions"""
+        try:
+            self.pool = cx_Oracle.SessionPool(user=self.cnxinfo['username'],
+                                              password=self.cnxinfo['password'],
+                                              dsn=self.cnxinfo['hostname'],
+                                              min=self.sessions,
+                                              max=self.sessions,
+                                              increment=0,
+                                              threaded=True,
+                                              getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+                                              encoding="UTF-8")
+            print  (f"..Successffuly created a pool of {self.sessions} sessions")
+        except Exception as e:
+            raise Exception(f'..Connection failed: {e}')
+
+    def acquire(self):
+        """Returns a pooled connection configured like OracleConnector's.
+           The pool is created on first use: runs served from the
+           query cache never connect"""
+        with self._lock:
+            if self.pool is None:
+                self.connect_to_db()
+        connection = self.pool.acquire()
+        if self.inline_lobs:
+            connection.outputtypehandler = inline_lob_handler
+        return connection
+
+    def release(self, connection):
+        """Returns a connection to the pool"""
+        self.pool.release(connection)
+
+    def disconnect_db(self):
+        """Close the session pool"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            print("....Disconnected from the database")
+
+
+def _arrow_type(col_desc):
+    """Returns the Arrow type matching an Oracle cursor.description entry"""
+    name, db_type, display_size, internal_size, precision, scale, null_ok = col_desc
+
+    if db_type == cx_Oracle.DB_TYPE_NUMBER:
+        if scale == 0 and 0 < precision <= 18:
+            return pa.int64()
+        return pa.float64()
+
+    if db_type in (cx_Oracle.DB_TYPE_BINARY_FLOAT, cx_Oracle.DB_TYPE_BINARY_DOUBLE):
+        return pa.float64()
+
+    if db_type in (cx_Oracle.DB_TYPE_DATE, cx_Oracle.DB_TYPE_TIMESTAMP):
+        return pa.timestamp('us')
+
+    if db_type in (cx_Oracle.DB_TYPE_BLOB, cx_Oracle.DB_TYPE_RAW,
+                   cx_Oracle.DB_TYPE_LONG_RAW):
+        return pa.binary()
+
+    return pa.string()
+
+
+def _read_lob(value):
+    """Returns the content of a LOB locator (values fetched inline pass through)"""
+    if value is not None and hasattr(value, 'read'):
+        return value.read()
+    return value
+
+
+def _rows_to_batch(rows, schema):
+    """Returns an Arrow record batch built column-wise from a list of row tuples"""
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_string(field.type) or pa.types.is_binary(field.type):
+            values = [_read_lob(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def description_schema(description):
+    """Returns the Arrow schema of a cursor.description"""
+    return pa.schema([(d[0], _arrow_type(d)) for d in description])
+
+
+def read_query_batches(cursor, query, bvars, batch_size=10000, prefetchrows=None, verbose=True,
+                       progress_every=50):
+    """Yields the SQL Query results as Arrow record batches of batch_size rows.
+       Only one batch is held in memory at a time. If verbose, prints the row
+       count every progress_every batches and the total at the end"""
+    cursor.arraysize = batch_size
+    if prefetchrows is not None:
+        cursor.prefetchrows = prefetchrows
+
+    cursor.execute(query, bvars)
+    schema = description_schema(cursor.description)
+
+    n_rows, n_batches = 0, 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        n_rows += len(rows)
+        n_batches += 1
+        if verbose and n_batches % progress_every == 0:
+            print(f'......fetched {n_rows} rows')
+        yield _rows_to_batch(rows, schema)
+
+    if verbose:
+        print(f'......fetched {n_rows} rows in total')
+
+
+def query_to_reader(cursor, query, bvars, batch_size=10000, prefetchrows=None):
+    """Returns a RecordBatchReader streaming the SQL Query results.
+       The query is executed before the first batch is requested"""
+    batches = read_query_batches(cursor, query, bvars, batch_size, prefetchrows)
+    first = next(batches, None)
+    schema = description_schema(cursor.description)
+
+    def _chain():
+        if first is not None:
+            yield first
+        yield from batches
+
+    return pa.RecordBatchReader.from_batches(schema, _chain())
+
+
+def query_binds(query, bvars):
+    """Returns the bind variables actually used by a query (whole bind
+       names only: wkb is not used by a query binding :wkb_aoi)"""
+    return {k: v for k, v in bvars.items()
+            if re.search(rf':{re.escape(k)}\b', query, re.IGNORECASE)}
+
+
+def oracle_job(pool_connector, query, bvars, batch_size=10000, cache=None, label=''):
+    """Returns a parallel_ingest job streaming a query over a pooled session.
+       The job yields the Arrow schema first, then the record batches.
+       With a QueryCache, results are served from / written to the cache"""
+    def _job():
+        connection = pool_connector.acquire()
+        try:
+            cursor = connection.cursor()
+            binds = query_binds(query, bvars)
+            blobs = {k: cx_Oracle.BLOB for k, v in binds.items() if isinstance(v, bytes)}
+            if blobs:
+                cursor.setinputsizes(**blobs)
+
+            batches = read_query_batches(cursor, query, binds, batch_size,
+                                         prefetchrows=batch_size, verbose=False)
+            first = next(batches, None)
+            yield description_schema(cursor.description)
+            if first is not None:
+                yield first
+            yield from batches
+            cursor.close()
+        finally:
+            pool_connector.release(connection)
+
+    if cache is not None:
+        job = cache.wrap(query, query_binds(query, bvars), _job, label, batch_size=batch_size)
+    else:
+        job = _job
+    # recorded in the duckdb load manifest
+    job.source = 'sql:' + query_key(query, query_binds(query, bvars))
+
+    return job
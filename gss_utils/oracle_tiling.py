@@ -0,0 +1,162 @@
+"""
+Extraction of very large BCGW layers in adaptive tiles of the AOI.
+
+Tiles are sized on a cheap row-count estimate (SDO_FILTER, see
+filter_count_sql) by tiling.quadtree_tiles; each tile is one
+parallel_ingest job. Finished tiles are kept as plain tables
+({table}_tile{i}, not sorted, indexed nor recorded in the load manifest)
+with the tile layout ({table}_tile_layout): a failed or interrupted run
+only extracts the missing tiles when it is restarted. Features spanning
+several tiles are returned by each of them and deduplicated on a key when
+the tiles are merged into the loaded table.
+"""
+
+import re
+import shapely
+import cx_Oracle
+
+from gss_utils.oracle_io import oracle_job
+from gss_utils.bcgw_cache import query_key
+from gss_utils.duckdb_io import list_tables, replace_if_changed
+from gss_utils.parallel_ingest import parallel_ingest
+from gss_utils.tiling import quadtree_tiles
+
+
+def filter_count_sql(table, geom_col='GEOMETRY', where=None):
+    """Returns a row-count estimate query for a tile. SDO_FILTER only runs the
+       spatial index primary filter, so the count is cheap but approximate"""
+    sql = f"""SELECT COUNT(*) FROM {table}
+              WHERE SDO_FILTER({geom_col}, SDO_GEOMETRY(:wkb_aoi, :srid)) = 'TRUE'"""
+    if where:
+        sql += f' AND {where}'
+    return sql
+
+
+def oracle_count_fn(pool_connector, count_sql, srid):
+    """Returns a count_fn running count_sql for a tile over a pooled session"""
+    def _count(geom):
+        connection = pool_connector.acquire()
+        try:
+            cursor = connection.cursor()
+            cursor.setinputsizes(wkb_aoi=cx_Oracle.BLOB)
+            cursor.execute(count_sql, {'wkb_aoi': shapely.to_wkb(geom, output_dimension=2),
+                                       'srid': srid})
+            n = cursor.fetchone()[0]
+            cursor.close()
+            return n
+        finally:
+            pool_connector.release(connection)
+
+    return _count
+
+
+def stage_tile(dckCnx, table, stage):
+    """parallel_ingest load of a finished tile: keeps the stage as is"""
+    dckCnx.execute(f'DROP TABLE IF EXISTS {table}')
+    dckCnx.execute(f'ALTER TABLE {stage} RENAME TO {table}')
+
+
+def drop_tiles(dckCnx, table):
+    """Drops the tile tables and the tile layout of a tiled extraction"""
+    tile = re.compile(rf'{re.escape(table)}_tile\d+(_stage)?', re.IGNORECASE)
+    for t in list_tables(dckCnx):
+        if tile.fullmatch(t):
+            dckCnx.execute(f'DROP TABLE {t}')
+    dckCnx.execute(f'DROP TABLE IF EXISTS {table}_tile_layout')
+
+
+def tile_layout(pool_connector, dckCnx, table, query, count_sql, aoi_geom, srid,
+                max_rows=50000, max_depth=6):
+    """Returns the tiles (geometry, estimated rows) of a tiled extraction: the
+       layout of a previous run of the same extraction if any, otherwise a
+       new one, recorded in {table}_tile_layout"""
+    layout = f'{table}_tile_layout'
+    signature = query_key(query + count_sql, {'wkb_aoi': shapely.to_wkb(aoi_geom, output_dimension=2),
+                                              'srid': srid, 'max_rows': max_rows,
+                                              'max_depth': max_depth})
+    if layout in list_tables(dckCnx):
+        rows = dckCnx.execute(f"""SELECT GEOMETRY_WKB, ROWS_EST, SIGNATURE
+                                  FROM {layout} ORDER BY TILE_ID""").fetchall()
+        if rows and rows[0][2] == signature:
+            return [(shapely.from_wkb(g), n) for g, n, sig in rows]
+        # tiles of another query or AOI
+        drop_tiles(dckCnx, table)
+
+    count_fn = oracle_count_fn(pool_connector, count_sql, srid)
+    tiles = quadtree_tiles(aoi_geom, count_fn, max_rows, max_depth,
+                           max_workers=pool_connector.sessions)
+    if tiles:
+        dckCnx.execute(f"""CREATE TABLE {layout} (TILE_ID INTEGER, GEOMETRY_WKB BLOB,
+                                                  ROWS_EST BIGINT, SIGNATURE VARCHAR)""")
+        dckCnx.executemany(f'INSERT INTO {layout} VALUES (?, ?, ?, ?)',
+                           [[i, shapely.to_wkb(g), n, signature] for i, (g, n) in enumerate(tiles)])
+
+    return tiles
+
+
+def tiled_jobs(pool_connector, dckCnx, table, query, count_sql, aoi_geom, srid,
+               max_rows=50000, max_depth=6, batch_size=10000):
+    """Returns the parallel_ingest jobs of the tiles not extracted yet
+       ({table}_tile{i}) running the query once per adaptive tile, and the
+       names of all the tile tables. The query must filter on :wkb_aoi and :srid"""
+    tiles = tile_layout(pool_connector, dckCnx, table, query, count_sql, aoi_geom, srid,
+                        max_rows, max_depth)
+    tile_tables = [f'{table}_tile{i}' for i in range(len(tiles))]
+    done = set(t.lower() for t in list_tables(dckCnx))
+
+    jobs = {}
+    for (geom, n), tile_table in zip(tiles, tile_tables):
+        if tile_table.lower() in done:
+            continue
+        bvars = {'wkb_aoi': shapely.to_wkb(geom, output_dimension=2), 'srid': srid}
+        job = oracle_job(pool_connector, query, bvars, batch_size)
+        job.load = stage_tile
+        jobs[tile_table] = job
+    print(f'....{table}: {len(tiles)} tiles (~{sum(n for g, n in tiles)} rows estimated), '
+          f'{len(tiles) - len(jobs)} already extracted')
+
+    return jobs, tile_tables
+
+
+def merge_tiles(dckCnx, table, tile_tables, key, schemas=None):
+    """Unions the tile tables into table keeping one row per key (features
+       spanning several tiles are returned by each of them), then drops the tiles"""
+    stage = f'{table}_stage'
+    union = ' UNION ALL BY NAME '.join(f'SELECT * FROM {t}' for t in tile_tables)
+    dckCnx.execute(f"""CREATE OR REPLACE TABLE {stage} AS
+                         SELECT * FROM ({union})
+                         QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(key)}) = 1""")
+    n_rows = replace_if_changed(dckCnx, table, stage, schemas=schemas)
+    drop_tiles(dckCnx, table)
+
+    return n_rows
+
+
+def tiled_ingest(pool_connector, dckCnx, tiled, aoi_geom, srid, jobs=None,
+                 max_rows=50000, max_depth=6, schemas=None):
+    """Extracts the tiled tables ({table: (query, count_sql, key)}) tile by tile,
+       together with any other parallel_ingest jobs, then merges the tiles.
+       Tiles extracted by a previous run are not extracted again. Loads are
+       cast to the types of the schemas registry, if any.
+       Returns the per-table status df"""
+    jobs = dict(jobs or {})
+    tile_tables = {}
+    for table, (query, count_sql, key) in tiled.items():
+        t_jobs, tile_tables[table] = tiled_jobs(pool_connector, dckCnx, table, query, count_sql,
+                                                aoi_geom, srid, max_rows, max_depth)
+        jobs.update(t_jobs)
+
+    df_status = parallel_ingest(dckCnx, jobs, max_workers=pool_connector.sessions, schemas=schemas)
+
+    for table, (query, count_sql, key) in tiled.items():
+        if not tile_tables[table]:
+            print(f'..{table}: no features in the AOI')
+            continue
+        tiles = df_status['TABLE'].isin(tile_tables[table])
+        if (df_status.loc[tiles, 'STATUS'] != 'OK').any():
+            print(f'..{table}: some tiles FAILED, not merged (rerun to extract the missing tiles)')
+            continue
+        n_rows = merge_tiles(dckCnx, table, tile_tables[table], key, schemas)
+        print(f'..{table}: merged {len(tile_tables[table])} tiles ({n_rows} rows)')
+
+    return df_status
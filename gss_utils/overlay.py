@@ -0,0 +1,158 @@
+"""
+SQL builders for overlays of spatial tables in DuckDB.
+
+The intersection of each candidate pair (or n-tuple) is computed once, in a
+MATERIALIZED CTE; areas and thlb-weighted areas are then derived from that
+single result instead of calling ST_Intersection again for each of them.
+
+tiled_overlay runs an overlay tile by tile over a density-adaptive quadtree,
+each tile in a worker process reading the database in read_only mode. The
+pieces are clipped to their tile: tiles do not overlap, so the areas of the
+pieces sum exactly to those of the untiled overlay.
+"""
+
+import os
+import shutil
+import duckdb
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gss_utils.duckdb_io import replace_if_changed
+from gss_utils.tiling import quadtree_tiles, duckdb_count_fn, tables_extent
+
+
+def _alias(layer):
+    """Returns the alias of a 'table alias' (or 'table AS alias') layer"""
+    return layer.split()[-1]
+
+
+def overlay_sql(layers, columns, measures=None, where=None, left=False,
+                geom_col='geometry', out_geom='geometry', clip=None):
+    """Returns a SELECT overlaying the layers (['table alias', ...]). Each layer
+       is joined on ST_Intersects with all the previous ones, and the
+       intersection of their geometries is computed once.
+
+       columns: list of expressions over the layer aliases, selected as is.
+       measures: {name: expression} computed from the intersection: {area}
+       is replaced by its area, other columns are referred to by their output
+       name, e.g. {'THLB_HA': 'ROUND({area} * thlb_fact / 10000, 4)'}.
+       Default is AREA_HA ({area} / 10000.0).
+       left: LEFT JOINs; rows without a match keep the geometry of the first layer.
+       out_geom: name of the intersection geometry column (None to leave it out)
+       clip: WKT of a polygon the pieces are clipped to (features of the
+       first layer not intersecting it are skipped)"""
+    if measures is None:
+        measures = {'AREA_HA': '{area} / 10000.0'}
+
+    aliases = [_alias(l) for l in layers]
+    geom = f'{aliases[0]}.{geom_col}'
+    for alias in aliases[1:]:
+        geom = f'ST_Intersection({geom}, {alias}.{geom_col})'
+    if left:
+        geom = f'COALESCE({geom}, {aliases[0]}.{geom_col})'
+    if clip:
+        clip_geom = f"ST_GeomFromText('{clip}')"
+        geom = f'ST_Intersection({geom}, {clip_geom})'
+        clip_where = f'ST_Intersects({aliases[0]}.{geom_col}, {clip_geom})'
+        where = f'{clip_where} AND ({where})' if where else clip_where
+
+    join = 'LEFT JOIN' if left else 'JOIN'
+    from_sql = layers[0]
+    for i, layer in enumerate(layers[1:], 1):
+        on = ' AND '.join(f'ST_Intersects({a}.{geom_col}, {aliases[i]}.{geom_col})' for a in aliases[:i])
+        from_sql += f'\n                 {join} {layer} ON {on}'
+
+    select = ['* EXCLUDE (_ovl_geom)']
+    select += [m.format(area='ST_Area(_ovl_geom)') + f' AS {name}' for name, m in measures.items()]
+    if out_geom:
+        select.append(f'_ovl_geom AS {out_geom}')
+
+    return f"""WITH ovl AS MATERIALIZED (
+               SELECT {', '.join(columns)},
+                      {geom} AS _ovl_geom
+               FROM {from_sql}
+               {'WHERE ' + where if where else ''}
+             )
+             SELECT {', '.join(select)}
+             FROM ovl
+             {'WHERE NOT ST_IsEmpty(_ovl_geom)' if clip else ''}"""
+
+
+def _run_tile(db_path, query, out_file, geom_col):
+    """Worker: writes the overlay of one tile to a parquet file, geometries as WKB.
+       Returns the row count"""
+    dckCnx = duckdb.connect(db_path, read_only=True)
+    try:
+        dckCnx.load_extension('spatial')
+        if geom_col:
+            query = f'SELECT * EXCLUDE ({geom_col}), ST_AsWKB({geom_col}) AS {geom_col} FROM ({query})'
+        dckCnx.execute(f"COPY ({query}) TO '{out_file}.tmp' (FORMAT PARQUET)")
+        os.replace(f'{out_file}.tmp', out_file)
+        return dckCnx.execute(f"SELECT COUNT(*) FROM '{out_file}'").fetchone()[0]
+    finally:
+        dckCnx.close()
+
+
+def tiled_overlay(db_path, table, layers, columns, measures=None, where=None, left=False,
+                  aoi_geom=None, max_rows=50000, max_depth=8, max_workers=4,
+                  geom_col='geometry', out_geom='geometry'):
+    """Runs an overlay (see overlay_sql) into a table of the duckdb database,
+       tile by tile over a quadtree of at most about max_rows features per
+       tile, in max_workers processes. The AOI defaults to the extent of the
+       first layer. Tile outputs are kept in {db}_tiles/{table} until the
+       table is loaded, and are not run again if the run is restarted.
+       No other connection may hold the database open. Returns the row count"""
+    work_dir = os.path.join(os.path.splitext(db_path)[0] + '_tiles', table)
+    os.makedirs(work_dir, exist_ok=True)
+
+    dckCnx = duckdb.connect(db_path, read_only=True)
+    try:
+        dckCnx.load_extension('spatial')
+        tables = [l.split()[0] for l in layers]
+        if aoi_geom is None:
+            aoi_geom = tables_extent(dckCnx, tables[:1], geom_col)
+        tiles = quadtree_tiles(aoi_geom, duckdb_count_fn(dckCnx, tables, geom_col),
+                               max_rows, max_depth, max_workers)
+    finally:
+        dckCnx.close()
+    print(f'....{table}: {len(tiles)} tiles (~{sum(n for g, n in tiles)} features)')
+    if not tiles:
+        raise Exception(f'..{table}: no features in the AOI')
+
+    # outputs of a previous run are only reused for the same tiles
+    layout = os.path.join(work_dir, 'tiles.wkt')
+    wkts = '\n'.join(g.wkt for g, n in tiles)
+    if not os.path.exists(layout) or open(layout).read() != wkts:
+        shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+        with open(layout, 'w') as f:
+            f.write(wkts)
+
+    files = [os.path.join(work_dir, f'tile_{i}.parquet') for i in range(len(tiles))]
+    todo = [i for i, f in enumerate(files) if not os.path.exists(f)]
+    if len(todo) < len(tiles):
+        print(f'....{len(tiles) - len(todo)} tiles already done')
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i in todo:
+            query = overlay_sql(layers, columns, measures, where, left, geom_col, out_geom,
+                                clip=tiles[i][0].wkt)
+            futures[executor.submit(_run_tile, db_path, query, files[i], out_geom)] = i
+        for n_done, future in enumerate(as_completed(futures), 1):
+            print(f'......tile {futures[future]}: {future.result()} rows ({n_done} of {len(todo)} tiles done)')
+
+    dckCnx = duckdb.connect(db_path)
+    try:
+        dckCnx.load_extension('spatial')
+        stage = f'{table}_stage'
+        source = f"read_parquet({[f.replace(os.sep, '/') for f in files]})"
+        if out_geom:
+            source = f'(SELECT * EXCLUDE ({out_geom}), ST_GeomFromWKB({out_geom}) AS {out_geom} FROM {source})'
+        dckCnx.execute(f'CREATE OR REPLACE TABLE {stage} AS SELECT * FROM {source}')
+        n_rows = replace_if_changed(dckCnx, table, stage)
+    finally:
+        dckCnx.close()
+
+    shutil.rmtree(work_dir)
+
+    return n_rows
@@ -0,0 +1,112 @@
+"""
+Concurrent extraction of several tables feeding a single DuckDB writer.
+
+Each job is a generator function yielding an Arrow schema followed by record
+batches (see oracle_io.oracle_job); a source attribute on the job, if any,
+is recorded in the load manifest, and a load attribute (load(dckCnx,
+table, stage)) replaces the default load of the stage (replace_if_changed).
+Jobs run in a thread pool; the calling thread is the only one writing to
+DuckDB.
+"""
+
+import queue
+import timeit
+import threading
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+
+from gss_utils.duckdb_io import arrow_to_duckdb, replace_if_changed
+
+
+def _put(q, item, stop):
+    """Puts an item on the queue unless the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _run_job(table, job, q, stop):
+    """Producer: streams the batches of one job onto the queue"""
+    start_t = timeit.default_timer()
+    try:
+        stream = job()
+        schema = next(stream)
+        if not _put(q, ('start', table, schema), stop):
+            stream.close()
+            return
+        for batch in stream:
+            if not _put(q, ('batch', table, batch), stop):
+                stream.close()
+                return
+        _put(q, ('done', table, timeit.default_timer() - start_t), stop)
+    except Exception as e:
+        _put(q, ('error', table, e), stop)
+
+
+def parallel_ingest(dckCnx, jobs, max_workers=4, queue_size=16, geom_col='GEOMETRY', schemas=None):
+    """Runs the jobs ({table: job}) concurrently and writes their batches
+       to duckdb as they arrive, cast to the types of the schemas registry
+       if any. Returns a per-table status df"""
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    status = {t: {'TABLE': t, 'STATUS': 'PENDING', 'ROWS': 0,
+                  'SECONDS': None, 'ERROR': None} for t in jobs}
+    pending = set(jobs)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    for table, job in jobs.items():
+        executor.submit(_run_job, table, job, q, stop)
+
+    try:
+        while pending:
+            kind, table, payload = q.get()
+            stage = f'{table}_stage'
+            st = status[table]
+            # last message of the table: stop waiting for it even if its load fails
+            if kind in ('done', 'error'):
+                pending.discard(table)
+
+            if st['STATUS'] == 'FAILED':
+                continue
+
+            try:
+                if kind == 'start':
+                    st['STATUS'] = 'RUNNING'
+                    arrow_to_duckdb(dckCnx, stage, pa.Table.from_batches([], payload), geom_col)
+
+                elif kind == 'batch':
+                    arrow_to_duckdb(dckCnx, stage, payload, geom_col, append=True)
+                    st['ROWS'] += payload.num_rows
+                    print(f'....{table}: {st["ROWS"]} rows')
+
+                elif kind == 'done':
+                    load = getattr(jobs[table], 'load', None)
+                    if load is not None:
+                        load(dckCnx, table, stage)
+                    else:
+                        replace_if_changed(dckCnx, table, stage, getattr(jobs[table], 'source', None),
+                                           schemas=schemas)
+                    st['STATUS'] = 'OK'
+                    st['SECONDS'] = round(payload, 1)
+                    print(f'..{table} completed in {st["SECONDS"]} s '
+                          f'({len(jobs) - len(pending)} of {len(jobs)} tables done)')
+
+                elif kind == 'error':
+                    raise payload
+
+            except Exception as e:
+                st['STATUS'] = 'FAILED'
+                st['ERROR'] = str(e)
+                dckCnx.execute(f'DROP TABLE IF EXISTS {stage}')
+                print(f'..{table} FAILED: {e}')
+
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+    return pd.DataFrame(list(status.values()))
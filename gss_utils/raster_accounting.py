@@ -0,0 +1,210 @@
+"""
+Raster approximation of the resultant, for fast area accounting.
+
+Scenario accounting only needs areas by attribute combination, never the
+geometry of the pieces. Each layer is burnt into a grid of feature indices
+(cell centres, see rasterio.features.rasterize) block by block, and the
+cells are summed by combination of feature indices (np.bincount). The
+output table has the columns of the vector resultant (see resultant.py)
+without the geometry, one row per attribute combination.
+
+EDGE_HA is the area of the cells next to a boundary of any layer: the
+raster error of a combination is expected to be within it. Check it
+against the vector resultant on a calibration tile (calibrate_accounting).
+"""
+
+import numpy as np
+import shapely
+import pyarrow as pa
+from shapely.geometry import box
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+
+from gss_utils.duckdb_io import arrow_to_duckdb, replace_if_changed
+from gss_utils.resultant import _read_tile, build_resultant
+from gss_utils.tiling import tables_extent
+
+
+def _burn(geoms, out_shape, transform):
+    """Returns the grid of the index of the first geometry covering each cell centre (-1 if none)"""
+    shapes = [(g, i) for i, g in enumerate(geoms) if not shapely.is_empty(g)]
+    if not shapes:
+        return np.full(out_shape, -1, dtype=np.int32)
+    # burnt in reverse order: the first feature overwrites the others
+    return rasterize(shapes[::-1], out_shape=out_shape, transform=transform,
+                     fill=-1, dtype='int32')
+
+
+def _edges(grids):
+    """Returns the mask of the cells next to a change of value in any grid"""
+    edge = np.zeros(grids[0].shape, dtype=bool)
+    for grid in grids:
+        d = grid[:, 1:] != grid[:, :-1]
+        edge[:, 1:] |= d
+        edge[:, :-1] |= d
+        d = grid[1:, :] != grid[:-1, :]
+        edge[1:, :] |= d
+        edge[:-1, :] |= d
+
+    return edge
+
+
+def _combinations(codes):
+    """Returns the distinct columns of codes (layers x cells) and the index of
+       the combination of each cell"""
+    if codes.shape[1] == 0:
+        return codes, np.zeros(0, dtype=np.intp)
+    local = [np.unique(c, return_inverse=True) for c in codes]
+    dims = [len(u) for u, inv in local]
+    if np.prod(dims, dtype=float) < 2 ** 62:
+        keys, inverse = np.unique(np.ravel_multi_index([inv for u, inv in local], dims),
+                                  return_inverse=True)
+        combos = np.stack([u[i] for (u, inv), i in zip(local, np.unravel_index(keys, dims))])
+        return combos, inverse
+
+    combos, inverse = np.unique(codes, axis=1, return_inverse=True)
+    return combos, inverse.ravel()
+
+
+def block_accounting(block, layer_data, cell_size, aoi_geom=None, required=None):
+    """Returns the areas of the layers ({name: (attributes, geometries)}) in a
+       block by attribute combination, as an Arrow table: the attributes of
+       the first feature of each layer covering the cell centres, an
+       IN_{LAYER} flag, AREA_HA and EDGE_HA"""
+    xmin, ymin, xmax, ymax = block.bounds
+    out_shape = (round((ymax - ymin) / cell_size), round((xmax - xmin) / cell_size))
+    transform = from_origin(xmin, ymax, cell_size, cell_size)
+
+    grids = {name: _burn(geoms, out_shape, transform) for name, (data, geoms) in layer_data.items()}
+    inside = np.ones(out_shape, dtype=bool)
+    if aoi_geom is not None and not aoi_geom.contains(block):
+        inside = _burn([aoi_geom.intersection(block)], out_shape, transform) == 0
+    edge = _edges(list(grids.values()) + [inside])
+
+    keep = inside & np.any(np.stack([g >= 0 for g in grids.values()]), axis=0)
+    for name in (required or []):
+        keep &= grids[name] >= 0
+
+    combos, inverse = _combinations(np.stack([g[keep] for g in grids.values()]))
+    cell_ha = cell_size * cell_size / 10000.0
+    area = np.bincount(inverse, minlength=combos.shape[1]) * cell_ha
+    edge_area = np.bincount(inverse, weights=edge[keep], minlength=combos.shape[1]) * cell_ha
+
+    arrays, names = [], []
+    for hit, (name, (data, geoms)) in zip(combos, layer_data.items()):
+        indices = pa.array(hit, mask=hit < 0)
+        for col in data.column_names:
+            arrays.append(data.column(col).take(indices))
+            names.append(col)
+        arrays.append(pa.array(hit >= 0))
+        names.append(f'IN_{name.upper()}')
+
+    arrays += [pa.array(area), pa.array(edge_area)]
+    names += ['AREA_HA', 'EDGE_HA']
+
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def grid_blocks(aoi_geom, cell_size, block_size=2048):
+    """Returns the blocks of block_size x block_size cells covering the AOI,
+       aligned on multiples of the cell size"""
+    xmin, ymin, xmax, ymax = aoi_geom.bounds
+    step = cell_size * block_size
+    x0 = np.floor(xmin / cell_size) * cell_size
+    y0 = np.floor(ymin / cell_size) * cell_size
+    blocks = [box(x, y, x + step, y + step)
+              for x in np.arange(x0, xmax, step) for y in np.arange(y0, ymax, step)]
+    shapely.prepare(aoi_geom)
+
+    return [b for b in blocks if aoi_geom.intersects(b)]
+
+
+def build_raster_resultant(dckCnx, table, layers, required=None, aoi_geom=None,
+                           cell_size=10, block_size=2048, max_workers=4,
+                           geom_col='geometry'):
+    """Builds the raster approximation of the resultant of the layers
+       ({name: (table, [columns])}) into a duckdb table: the areas by
+       attribute combination, at cell_size over the AOI (the extent of the
+       layers if None). Returns the row count"""
+    tables = [t for t, cols in layers.values()]
+    if aoi_geom is None:
+        aoi_geom = tables_extent(dckCnx, tables, geom_col)
+
+    blocks = grid_blocks(aoi_geom, cell_size, block_size)
+    print(f'....{table}: {len(blocks)} blocks of {block_size}x{block_size} cells of {cell_size} m')
+
+    def _block(block):
+        cursor = dckCnx.cursor()
+        try:
+            layer_data = {name: _read_tile(cursor, t, cols, block, geom_col)
+                          for name, (t, cols) in layers.items()}
+        finally:
+            cursor.close()
+        return block_accounting(block, layer_data, cell_size, aoi_geom, required)
+
+    cells = f'{table}_blocks'
+    n_done = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data in executor.map(_block, blocks):
+            arrow_to_duckdb(dckCnx, cells, data, geom_col, append=n_done > 0)
+            n_done += 1
+            print(f'......block {n_done} of {len(blocks)}: {data.num_rows} combinations')
+
+    if not n_done:
+        raise Exception(f'..{table}: no features in the AOI')
+
+    # combinations spanning several blocks
+    stage = f'{table}_stage'
+    dckCnx.execute(f"""CREATE OR REPLACE TABLE {stage} AS
+                         SELECT * EXCLUDE (AREA_HA, EDGE_HA),
+                                SUM(AREA_HA) AS AREA_HA, SUM(EDGE_HA) AS EDGE_HA
+                         FROM {cells}
+                         GROUP BY ALL""")
+    dckCnx.execute(f'DROP TABLE {cells}')
+
+    return replace_if_changed(dckCnx, table, stage)
+
+
+def compare_accounting(dckCnx, raster_table, vector_table, by, weight=None):
+    """Returns the areas of the raster and vector resultants by the columns
+       in by (multiplied by the weight column, if set), their difference and
+       the EDGE_HA error bound of the raster"""
+    w = f' * {weight}' if weight else ''
+    cols = ', '.join(by)
+    on = ' AND '.join(f'v.{c} IS NOT DISTINCT FROM r.{c}' for c in by)
+
+    return dckCnx.execute(f"""
+        WITH v AS (SELECT {cols}, SUM(AREA_HA{w}) AS VECTOR_HA
+                   FROM {vector_table} GROUP BY ALL),
+             r AS (SELECT {cols}, SUM(AREA_HA{w}) AS RASTER_HA, SUM(EDGE_HA{w}) AS BOUND_HA
+                   FROM {raster_table} GROUP BY ALL)
+        SELECT {', '.join(f'COALESCE(v.{c}, r.{c}) AS {c}' for c in by)},
+               COALESCE(VECTOR_HA, 0) AS VECTOR_HA,
+               COALESCE(RASTER_HA, 0) AS RASTER_HA,
+               COALESCE(RASTER_HA, 0) - COALESCE(VECTOR_HA, 0) AS DIFF_HA,
+               COALESCE(BOUND_HA, 0) AS BOUND_HA,
+               ABS(COALESCE(RASTER_HA, 0) - COALESCE(VECTOR_HA, 0)) <= COALESCE(BOUND_HA, 0) AS WITHIN_BOUND
+        FROM v FULL OUTER JOIN r ON {on}
+        ORDER BY {', '.join(f'{c} NULLS FIRST' for c in by)}""").df()
+
+
+def calibrate_accounting(dckCnx, table, layers, tile, by, weight=None, required=None,
+                         cell_size=10, max_workers=4, geom_col='geometry'):
+    """Builds the vector and the raster resultants of the layers over a
+       calibration tile ({table}_vector, {table}_raster) and prints the raster
+       error against the vector areas. Returns the comparison by group"""
+    build_resultant(dckCnx, f'{table}_vector', layers, required, aoi_geom=tile,
+                    max_workers=max_workers, geom_col=geom_col)
+    build_raster_resultant(dckCnx, f'{table}_raster', layers, required, aoi_geom=tile,
+                           cell_size=cell_size, max_workers=max_workers, geom_col=geom_col)
+
+    df = compare_accounting(dckCnx, f'{table}_raster', f'{table}_vector', by, weight)
+    total_v, total_r = df['VECTOR_HA'].sum(), df['RASTER_HA'].sum()
+    rel_err = np.nan_to_num((df['DIFF_HA'].abs() / df['VECTOR_HA'].where(df['VECTOR_HA'] > 0)).max())
+    print(f'....{table}: {total_r:.2f} ha (raster) vs {total_v:.2f} ha (vector), '
+          f'total error {100 * (total_r - total_v) / max(total_v, 1e-9):.3f} %, '
+          f'max group error {100 * rel_err:.2f} %, '
+          f"{int(df['WITHIN_BOUND'].sum())} of {len(df)} groups within the edge bound")
+
+    return df
@@ -0,0 +1,160 @@
+"""
+Resultant (planar) overlay of several DuckDB polygon layers.
+
+The layers are overlaid in one pass instead of a chain of pairwise joins:
+within each tile, the boundaries of all the layers are noded and
+polygonized into faces, and each face gets the attributes of the feature
+covering it in every layer, plus an IN_{LAYER} flag. Filters on those
+columns replace new spatial joins for the derived tables.
+
+Features of a layer are expected not to overlap each other. A face covered
+by several features of a layer gets the attributes of the first one only
+(lowest row) and is counted once, where a pairwise ST_Intersects join
+returns one row per feature: areas and attributes differ for such layers
+(e.g. undissolved buffers, VRI slivers). build_resultant reports, by
+layer, the faces covered more than once; dissolve the layer first (see
+dissolve.py) or check the results against the pairwise join.
+
+Tiles are quadtree cells sized on the feature counts (see
+tiling.quadtree_tiles); pieces are cut on the tile edges. Tiles are
+computed in a thread pool (the shapely ops release the GIL) and written by
+the calling thread only.
+"""
+
+import numpy as np
+import shapely
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+
+from gss_utils.duckdb_io import arrow_to_duckdb, replace_if_changed
+from gss_utils.geom_utils import DEFAULT_GRID_SIZE
+from gss_utils.tiling import quadtree_tiles, duckdb_count_fn, tables_extent
+
+
+def _read_tile(cursor, table, columns, tile, geom_col):
+    """Returns the attributes (Arrow table) and the geometries clipped to the
+       tile bbox of the features of a layer intersecting the tile"""
+    cols = ''.join(f'{c}, ' for c in columns)
+    data = cursor.execute(f"""SELECT {cols}ST_AsWKB({geom_col}) AS _wkb FROM {table}
+                              WHERE ST_Intersects({geom_col}, ST_GeomFromText(?))""",
+                          [tile.wkt]).fetch_arrow_table()
+    geoms = shapely.from_wkb(data.column('_wkb').to_numpy(zero_copy_only=False))
+    geoms = shapely.clip_by_rect(geoms, *tile.bounds)
+
+    return data.drop(['_wkb']), geoms
+
+
+def _first_hit(points, geoms):
+    """Returns, for each point, the index of the first geometry containing it
+       (-1 if none) and the number of geometries containing it"""
+    hit = np.full(len(points), -1)
+    n_hits = np.zeros(len(points), dtype=int)
+    if len(geoms) == 0:
+        return hit, n_hits
+    i_pt, i_geom = shapely.STRtree(geoms).query(points, predicate='within')
+    order = np.lexsort((i_geom, i_pt))
+    pts, first, counts = np.unique(i_pt[order], return_index=True, return_counts=True)
+    hit[pts] = i_geom[order][first]
+    n_hits[pts] = counts
+
+    return hit, n_hits
+
+
+def tile_resultant(tile, layer_data, required=None, grid_size=DEFAULT_GRID_SIZE,
+                   geom_col='geometry'):
+    """Returns the resultant of the layers ({name: (attributes, geometries)})
+       within a tile as an Arrow table: one row per face of the noded
+       boundaries, with the attributes of the first feature of each layer
+       covering it. Faces outside the required layers (all, if None: any) are
+       dropped. Also returns, by layer, the count and area (ha) of the faces
+       kept that several features of the layer cover"""
+    edges = [shapely.boundary(tile)] + [shapely.boundary(g) for t, g in layer_data.values()]
+    lines = shapely.get_parts(np.concatenate([np.atleast_1d(e) for e in edges]))
+    noded = shapely.union_all(lines, grid_size=grid_size)
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(noded)))
+    faces = faces[shapely.area(faces) > 0]
+
+    points = shapely.point_on_surface(faces)
+    shapely.prepare(tile)
+    keep = shapely.within(points, tile)
+
+    hits, n_hits = {}, {}
+    for name, (data, geoms) in layer_data.items():
+        hits[name], n_hits[name] = _first_hit(points, geoms)
+    covered = np.zeros(len(faces), dtype=bool)
+    for hit in hits.values():
+        covered |= hit >= 0
+    keep &= covered
+    for name in (required or []):
+        keep &= hits[name] >= 0
+
+    arrays, names = [], []
+    for name, (data, geoms) in layer_data.items():
+        hit = hits[name][keep]
+        indices = pa.array(hit, mask=hit < 0)
+        for col in data.column_names:
+            arrays.append(data.column(col).take(indices))
+            names.append(col)
+        arrays.append(pa.array(hit >= 0))
+        names.append(f'IN_{name.upper()}')
+
+    faces = faces[keep]
+    area = shapely.area(faces) / 10000.0
+    arrays += [pa.array(area), pa.array(shapely.to_wkb(faces), pa.binary())]
+    names += ['AREA_HA', geom_col]
+
+    overlaps = {}
+    for name, n in n_hits.items():
+        multi = n[keep] > 1
+        overlaps[name] = (int(multi.sum()), float(area[multi].sum()))
+
+    return pa.Table.from_arrays(arrays, names=names), overlaps
+
+
+def build_resultant(dckCnx, table, layers, required=None, aoi_geom=None,
+                    max_rows=20000, max_depth=8, max_workers=4,
+                    grid_size=DEFAULT_GRID_SIZE, geom_col='geometry'):
+    """Builds the resultant of the layers ({name: (table, [columns])}) into a
+       duckdb table, tile by tile over the AOI (the extent of the layers if
+       None). Tiles hold at most about max_rows features. Faces covered by
+       overlapping features of a layer are reported. Returns the row count"""
+    tables = [t for t, cols in layers.values()]
+    if aoi_geom is None:
+        aoi_geom = tables_extent(dckCnx, tables, geom_col)
+
+    tiles = quadtree_tiles(aoi_geom, duckdb_count_fn(dckCnx, tables, geom_col),
+                           max_rows, max_depth, max_workers)
+    print(f'....{table}: {len(tiles)} tiles (~{sum(n for g, n in tiles)} features)')
+
+    def _tile(i_tile):
+        i, (tile, n) = i_tile
+        cursor = dckCnx.cursor()
+        try:
+            layer_data = {name: _read_tile(cursor, t, cols, tile, geom_col)
+                          for name, (t, cols) in layers.items()}
+        finally:
+            cursor.close()
+        data, overlaps = tile_resultant(tile, layer_data, required, grid_size, geom_col)
+        return data.append_column('TILE_ID', pa.array(np.full(data.num_rows, i, dtype=np.int32))), overlaps
+
+    stage = f'{table}_stage'
+    n_done = 0
+    overlaps = {name: [0, 0.0] for name in layers}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data, tile_overlaps in executor.map(_tile, enumerate(tiles)):
+            arrow_to_duckdb(dckCnx, stage, data, geom_col, append=n_done > 0)
+            n_done += 1
+            for name, (n, area) in tile_overlaps.items():
+                overlaps[name][0] += n
+                overlaps[name][1] += area
+            print(f'......tile {n_done} of {len(tiles)}: {data.num_rows} pieces')
+
+    if not n_done:
+        raise Exception(f'..{table}: no features in the AOI')
+
+    for name, (n, area) in overlaps.items():
+        if n:
+            print(f'....WARNING {table}: {n} pieces ({area:.2f} ha) covered by overlapping '
+                  f'features of layer {name}: only the first feature is kept')
+
+    return replace_if_changed(dckCnx, table, stage)
@@ -0,0 +1,98 @@
+"""
+Declared DuckDB types of the known tables, by project.
+
+Table names (tsa, vri, thlb...) are reused by the databases of other
+projects, with other contents: a registry only applies to the loads that
+pass it (schemas=, see duckdb_io.replace_if_changed). Staged loads of a
+table in the registry get their columns cast to the declared types: no
+type is guessed from the data.
+
+Columns closed to a known set of values are ENUMs; sentinel values
+standing for "no data" are loaded as NULL. Columns that are not declared
+keep the type of their source (Oracle, GDAL or Arrow metadata).
+"""
+
+ENUM_TYPES = {
+    'BEC_ZONE': ['BAFA', 'BG', 'BWBS', 'CDF', 'CMA', 'CWH', 'ESSF', 'ICH',
+                 'IDF', 'IMA', 'MH', 'MS', 'PP', 'SBPS', 'SBS', 'SWB'],
+}
+
+# TOR FLP database. table: {'columns': {column: type}, 'nulls': {column: sentinel}}
+TOR_FLP_SCHEMAS = {
+    'vri': {'columns': {'POLYGON_ID': 'BIGINT',
+                        'BEC_ZONE_CODE': 'BEC_ZONE',
+                        'BEC_SUBZONE': 'VARCHAR',
+                        'BEC_VARIANT': 'VARCHAR',
+                        'SITE_INDEX': 'DOUBLE',
+                        'LINE_3_TREE_SPECIES': 'VARCHAR',
+                        'SPECIES_CD_1': 'VARCHAR',
+                        'SPECIES_PCT_1': 'DOUBLE',
+                        'SPECIES_CD_2': 'VARCHAR',
+                        'SPECIES_PCT_2': 'DOUBLE',
+                        'SPECIES_CD_3': 'VARCHAR',
+                        'SPECIES_PCT_3': 'DOUBLE',
+                        'PROJ_AGE_1': 'SMALLINT',
+                        'PROJ_AGE_CLASS_CD_1': 'VARCHAR',
+                        'PROJ_AGE_2': 'SMALLINT',
+                        'PROJ_AGE_CLASS_CD_2': 'VARCHAR',
+                        'LIVE_STAND_VOLUME_125': 'DOUBLE'},
+            'nulls': {'PROJ_AGE_1': -999,
+                      'PROJ_AGE_2': -999}},
+
+    'thlb': {'columns': {'TSA_NAME': 'VARCHAR',
+                         'TSA_NUMBER_DESCRIPTION': 'VARCHAR',
+                         'THLB_FACT': 'DOUBLE'},
+             'nulls': {}},
+
+    # the AOI or its buffer can catch TSAs outside the TOR FLP
+    'tsa': {'columns': {'TSA_NAME': 'VARCHAR'},
+            'nulls': {}},
+
+    'mdwr_kam': {'columns': {'LEGAL_FEAT_PROVID': 'VARCHAR'},
+                 'nulls': {}},
+
+    'ogda': {'columns': {'OGSR_TOF_SYSID': 'BIGINT',
+                         'OGSR_PDAC_SYSID': 'BIGINT',
+                         'BGC_LABEL': 'VARCHAR'},
+             'nulls': {}},
+
+    'riparian_buffers_fbp': {'columns': {'RIPARIAN_CLASS': 'VARCHAR',
+                                         'BUFFER_WIDTH': 'DOUBLE'},
+                             'nulls': {}},
+}
+
+
+def registered_schema(table, schemas):
+    """Returns the declared schema of a table in a registry (None if not registered)"""
+    return schemas.get(table.lower())
+
+
+def create_enum_types(dckCnx):
+    """Creates the ENUM types missing from the database"""
+    existing = {r[0] for r in dckCnx.execute('SELECT type_name FROM duckdb_types()').fetchall()}
+    for name, values in ENUM_TYPES.items():
+        if name not in existing:
+            labels = ', '.join("'" + v.replace("'", "''") + "'" for v in values)
+            dckCnx.execute(f'CREATE TYPE {name} AS ENUM ({labels})')
+
+
+def apply_schema(dckCnx, table, stage, schemas):
+    """Casts the columns of the stage table to the types declared for table
+       in the registry (e.g. TOR_FLP_SCHEMAS), loading the sentinel values as NULL"""
+    schema = registered_schema(table, schemas)
+    if schema is None:
+        return
+
+    create_enum_types(dckCnx)
+    declared = {c.upper(): t for c, t in schema['columns'].items()}
+    nulls = {c.upper(): v for c, v in schema['nulls'].items()}
+
+    for col, col_type, *_ in dckCnx.execute(f'DESCRIBE {stage}').fetchall():
+        target = declared.get(col.upper())
+        if target is None:
+            continue
+        expr = f'"{col}"'
+        if col.upper() in nulls:
+            expr = f'NULLIF({expr}, {nulls[col.upper()]})'
+        if target != col_type or col.upper() in nulls:
+            dckCnx.execute(f'ALTER TABLE {stage} ALTER "{col}" SET DATA TYPE {target} USING CAST({expr} AS {target})')
@@ -0,0 +1,445 @@
+"""
+Batched statusing of AOI polygons against BCGW and local layers.
+
+BCGW: all polygons are bound into a single statement (in chunks of
+chunk_size) as rows of an (AOI_ID, AOI_GEOM) CTE joined to the target
+layer, instead of one query per polygon: N polygons x M rules cost M
+round trips.
+
+Local files: the target layer is read and reprojected once per run, and
+all polygons are intersected with it in one pass over its STRtree index.
+
+run_statusing runs the rules of a rules workbook concurrently: WHSE rules
+on a thread pool of Oracle sessions, local overlays on a process pool.
+Rules are first grouped by Dataset: each table is queried once for the
+columns used by all its rules and the OR of their Where clauses, then each
+rule's columns and Where clause are evaluated locally in DuckDB. Only the
+rules written in a simple grammar, evaluated the same way by Oracle and
+DuckDB, are evaluated locally (see is_local_rule): column lists and
+comparisons, IN, LIKE and IS NULL predicates on NUMBER and VARCHAR2
+columns, combined with AND/OR/NOT. Other rules run their own query.
+"""
+
+import os
+import re
+import duckdb
+import shapely
+import cx_Oracle
+import pandas as pd
+import geopandas as gpd
+from shapely import wkb
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from gss_utils.bcgw_catalog import BCGWCatalog
+from gss_utils.geom_utils import normalize_gdf
+
+
+_LOCAL_LAYERS = {}
+
+
+def dissolve_by_id(gdf, id_col):
+    """Returns a GeoSeries of one (dissolved) geometry per id"""
+    return gdf[[id_col, 'geometry']].dissolve(by=id_col)['geometry']
+
+
+def polygon_wkbs(gdf, id_col):
+    """Returns {id: 2D WKB}; rows sharing an id are dissolved into one geometry"""
+    geoms = dissolve_by_id(gdf, id_col)
+
+    return {i: wkb.dumps(g, output_dimension=2) for i, g in geoms.items()}
+
+
+def aoi_cte(n):
+    """Returns a WITH clause of n bound (AOI_ID, AOI_GEOM) rows"""
+    rows = [f'SELECT :id_{i} AS AOI_ID, SDO_GEOMETRY(:wkb_{i}, :srid) AS AOI_GEOM FROM DUAL'
+            for i in range(n)]
+
+    return 'WITH aoi AS (\n        ' + '\n        UNION ALL '.join(rows) + ')'
+
+
+def read_status_batched(cursor, template, wkbs, srid, chunk_size=200, **fmt):
+    """Runs a statusing query template for all the polygons ({id: wkb}).
+       The template starts with {aoi_cte} and joins the aoi rows; other
+       placeholders are filled from fmt. Returns a df with an AOI_ID column"""
+    items = list(wkbs.items())
+    dfs = []
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        query = template.format(aoi_cte=aoi_cte(len(chunk)), **fmt)
+
+        bvars = {'srid': srid}
+        for i, (poly_id, poly_wkb) in enumerate(chunk):
+            bvars[f'id_{i}'] = poly_id
+            bvars[f'wkb_{i}'] = poly_wkb
+        cursor.setinputsizes(**{f'wkb_{i}': cx_Oracle.BLOB for i in range(len(chunk))})
+
+        cursor.execute(query, bvars)
+        names = [x[0] for x in cursor.description]
+        dfs.append(pd.DataFrame(cursor.fetchall(), columns=names))
+
+    if not dfs:
+        return pd.DataFrame(columns=['AOI_ID'])
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def read_vector(path):
+    """Returns a gdf from an ESRI format vector (shp or featureclass/gdb)"""
+    if '.shp' in path:
+        return gpd.read_file(path)
+
+    if '.gdb' in path:
+        gdb = path.split('.gdb')[0] + '.gdb'
+        return gpd.read_file(filename=gdb, layer=os.path.basename(path))
+
+    raise Exception('Format not recognized. Please provide a shp or featureclass (gdb)!')
+
+
+def load_local_layer(path, read_fn=read_vector, epsg=3005):
+    """Returns a local layer reprojected to epsg. Layers are read once per
+       run: the gdf, and the spatial index built on it, are reused by every rule"""
+    key = (path, epsg)
+    if key not in _LOCAL_LAYERS:
+        gdf = normalize_gdf(read_fn(path), label=os.path.basename(path))
+        if gdf.crs.to_epsg() != epsg:
+            gdf = gdf.to_crs(epsg=epsg)
+        _LOCAL_LAYERS[key] = gdf
+
+    return _LOCAL_LAYERS[key]
+
+
+def overlay_local(gdf_polys, id_col, gdf_trg):
+    """Intersects all the polygons with the target layer at once.
+       Returns a gdf of the target attributes, id_col and the intersections"""
+    polys = dissolve_by_id(gdf_polys, id_col)
+
+    idx_poly, idx_trg = gdf_trg.sindex.query(polys.values, predicate='intersects')
+    geoms = shapely.intersection(polys.values[idx_poly], gdf_trg.geometry.values[idx_trg])
+
+    df = pd.DataFrame(gdf_trg.drop(columns=gdf_trg.geometry.name).iloc[idx_trg]).reset_index(drop=True)
+    df[id_col] = polys.index[idx_poly]
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geoms, crs=gdf_trg.crs))
+
+    return gdf.loc[~gdf.geometry.is_empty].reset_index(drop=True)
+
+
+def load_rules(rule_xls, sheet='rules'):
+    """Returns the statusing rules (Name, Dataset, Columns, Where) of a workbook"""
+    df_stat = pd.read_excel(rule_xls, sheet)
+    df_stat.fillna(value='nan', inplace=True)
+
+    return df_stat.to_dict('records')
+
+
+def rule_def_query(rule):
+    """Returns the definition query of a rule, to append to a WHERE clause"""
+    if rule['Where'] != 'nan':
+        return 'AND ' + rule['Where']
+    return ' '
+
+
+def compile_rules(rules):
+    """Groups the rules by Dataset. Returns {dataset: [rules]}, in rule order"""
+    groups = {}
+    for rule in rules:
+        groups.setdefault(rule['Dataset'], []).append(rule)
+
+    return groups
+
+
+def referenced_columns(expr, table_columns):
+    """Returns the columns of a table referenced in a SQL expression
+       (select list or where clause), ignoring string literals"""
+    tokens = set(re.findall(r'[A-Z_][A-Z0-9_$#]*', re.sub(r"'[^']*'", '', expr).upper()))
+
+    return [c for c in table_columns if c in tokens]
+
+
+_TOKEN = re.compile(r"\s*(?:('(?:[^']|'')*')|(\d+(?:\.\d+)?)|([A-Za-z_][A-Za-z0-9_$#]*)"
+                    r"|(<>|!=|<=|>=|=|<|>)|([(),]))")
+_KEYWORDS = {'AND', 'OR', 'NOT', 'IN', 'LIKE', 'IS', 'NULL', 'AS'}
+# Oracle types compared the same way in DuckDB (CHAR is blank-padded, DATEs convert implicitly)
+_LOCAL_TYPES = {'NUMBER': 'number', 'FLOAT': 'number', 'BINARY_DOUBLE': 'number',
+                'BINARY_FLOAT': 'number', 'VARCHAR2': 'string', 'NVARCHAR2': 'string'}
+
+
+def _tokens(expr):
+    """Returns the (kind, value) tokens of a SQL expression, None if it has
+       other tokens than strings, numbers, names, comparisons and ( ) ,"""
+    tokens, pos, expr = [], 0, expr.strip()
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if not m:
+            return None
+        kind = m.lastindex
+        value = m.group(kind)
+        if kind == 3:
+            value = value.upper()
+            kind = 'kw' if value in _KEYWORDS else 'name'
+        else:
+            kind = {1: 'string', 2: 'number', 4: 'op', 5: 'punct'}[kind]
+        tokens.append((kind, value))
+        pos = m.end()
+
+    return tokens
+
+
+class _Predicate:
+    """Recursive descent over the tokens of a where clause in the local grammar:
+       expr := term (OR term)*, term := factor (AND factor)*,
+       factor := NOT factor | ( expr ) | predicate"""
+
+    def __init__(self, tokens, column_types):
+        self.tokens = tokens
+        self.pos = 0
+        self.types = column_types
+
+    def _peek(self, value=None):
+        if self.pos >= len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        return token if value is None or token[1] == value else None
+
+    def _take(self, value=None):
+        token = self._peek(value)
+        if token is None:
+            raise ValueError
+        self.pos += 1
+        return token
+
+    def _column(self):
+        kind, name = self._take()
+        if kind != 'name' or name not in self.types:
+            raise ValueError
+        return self.types[name]
+
+    def _value(self, col_type):
+        """A literal, or a column, of the type of the compared column"""
+        kind, value = self._peek() or (None, None)
+        if kind == 'name':
+            if self._column() != col_type:
+                raise ValueError
+            return
+        self._take()
+        # Oracle reads '' as NULL
+        if kind != col_type or value == "''":
+            raise ValueError
+
+    def expr(self):
+        self.term()
+        while self._peek('OR'):
+            self._take()
+            self.term()
+
+    def term(self):
+        self.factor()
+        while self._peek('AND'):
+            self._take()
+            self.factor()
+
+    def factor(self):
+        if self._peek('NOT'):
+            self._take()
+            return self.factor()
+        if self._peek('('):
+            self._take()
+            self.expr()
+            self._take(')')
+            return
+        self.predicate()
+
+    def predicate(self):
+        col_type = self._column()
+        if self._peek('IS'):
+            self._take()
+            if self._peek('NOT'):
+                self._take()
+            self._take('NULL')
+            return
+        if self._peek('NOT'):
+            self._take()
+            if not (self._peek('IN') or self._peek('LIKE')):
+                raise ValueError
+        kind, value = self._take()
+        if kind == 'op':
+            self._value(col_type)
+        elif value == 'IN':
+            self._take('(')
+            self._value(col_type)
+            while self._peek(','):
+                self._take()
+                self._value(col_type)
+            self._take(')')
+        elif value == 'LIKE' and col_type == 'string':
+            kind, value = self._take()
+            if kind != 'string' or value == "''":
+                raise ValueError
+        else:
+            raise ValueError
+
+    def parse(self):
+        self.expr()
+        if self.pos != len(self.tokens):
+            raise ValueError
+
+
+def is_local_rule(rule, oracle_types):
+    """Returns True if the Columns and Where clause of a rule are in the local
+       grammar over the NUMBER/VARCHAR2 columns of its table ({column: Oracle
+       type}): a list of columns (optionally aliased), and column comparisons,
+       IN, LIKE and IS [NOT] NULL predicates combined with AND/OR/NOT"""
+    types = {c.upper(): _LOCAL_TYPES[t] for c, t in oracle_types.items() if t in _LOCAL_TYPES}
+
+    tokens = _tokens(rule['Columns'])
+    if not tokens:
+        return False
+    items, item = [], []
+    for token in tokens + [('punct', ',')]:
+        if token == ('punct', ','):
+            items.append(item)
+            item = []
+        else:
+            item.append(token)
+    for item in items:
+        if not item or item[0][0] != 'name' or item[0][1] not in types:
+            return False
+        alias = item[1:]
+        if alias and alias[0] == ('kw', 'AS'):
+            alias = alias[1:]
+        if alias and (len(alias) != 1 or alias[0][0] != 'name'):
+            return False
+
+    if rule['Where'] == 'nan':
+        return True
+    tokens = _tokens(rule['Where'])
+    if not tokens:
+        return False
+    try:
+        _Predicate(tokens, types).parse()
+    except ValueError:
+        return False
+
+    return True
+
+
+def group_query_parts(rules, table_columns):
+    """Returns the columns and definition query fetching the rows needed by
+       all the rules of a dataset: the columns referenced by their Columns and
+       Where clauses, and the OR of the Where clauses"""
+    cols = []
+    for rule in rules:
+        cols += referenced_columns(rule['Columns'], table_columns)
+        if rule['Where'] != 'nan':
+            cols += referenced_columns(rule['Where'], table_columns)
+
+    if any(rule['Where'] == 'nan' for rule in rules):
+        def_query = ' '
+    else:
+        def_query = 'AND (' + ' OR '.join(f"({rule['Where']})" for rule in rules) + ')'
+
+    return list(dict.fromkeys(cols)), def_query
+
+
+def apply_rule(df, rule, fetched_cols):
+    """Evaluates the Columns and Where clause of a rule in DuckDB on the rows
+       fetched for its dataset. The columns of df that were not fetched for
+       the rules (id, overlap area) are kept as is"""
+    keep = ', '.join(f'"{c}"' for c in df.columns if c not in fetched_cols)
+    where = f"WHERE {rule['Where']}" if rule['Where'] != 'nan' else ''
+
+    dckCnx = duckdb.connect()
+    try:
+        dckCnx.register('df_rule', df)
+        df_rule = dckCnx.execute(f"SELECT {rule['Columns']}, {keep} FROM df_rule {where}").df()
+    finally:
+        dckCnx.close()
+
+    n_rule = df_rule.shape[1] - (len(df.columns) - len(fetched_cols))
+    df_rule.columns = [c.upper() for c in df_rule.columns[:n_rule]] + list(df_rule.columns[n_rule:])
+
+    return df_rule
+
+
+def _status_whse(pool_connector, catalog, rules, template, wkbs, srid, id_col):
+    """Statuses all the polygons against the rules of a BCGW table over a
+       pooled session. The table is queried once for all the rules in the
+       local grammar (see is_local_rule); the other rules, and those DuckDB
+       fails to evaluate, are queried on their own. Returns a list of dfs, one per rule"""
+    connection = pool_connector.acquire()
+    try:
+        cursor = connection.cursor()
+        table = rules[0]['Dataset']
+        geom_col = catalog.geom_col(cursor, table)
+
+        def _read(cols, def_query):
+            df = read_status_batched(cursor, template, wkbs, srid, cols=cols, tab=table,
+                                     def_query=def_query, geom_col=geom_col)
+            df[id_col] = df.pop('AOI_ID')
+            return df
+
+        oracle_types = catalog.table_info(cursor, table)['columns']
+        local = [rule for rule in rules if is_local_rule(rule, oracle_types)]
+        fetched_cols, def_query = group_query_parts(local, list(oracle_types))
+        if len(local) < 2 or not fetched_cols:
+            local = []
+        else:
+            print(f'....{table}: {len(local)} of {len(rules)} rules in one query')
+            df_all = _read(', '.join(fetched_cols), def_query)
+
+        dfs = []
+        for rule in rules:
+            if rule in local:
+                try:
+                    dfs.append(apply_rule(df_all, rule, fetched_cols))
+                    continue
+                except duckdb.Error:
+                    print(f"....{rule['Name']}: clauses not supported locally, querying on its own")
+            dfs.append(_read(rule['Columns'], rule_def_query(rule)))
+        cursor.close()
+    finally:
+        pool_connector.release(connection)
+
+    return dfs
+
+
+def _status_local(path, gdf_polys, id_col):
+    """Statuses all the polygons against a local rule layer (process pool worker).
+       Returns the target attributes, id_col and the overlap area (AREA_M2)"""
+    gdf = overlay_local(gdf_polys, id_col, load_local_layer(path))
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    df['AREA_M2'] = gdf.geometry.area.values
+
+    return df
+
+
+def run_statusing(rules, gdf_polys, id_col, pool_connector, template,
+                  max_workers=4, max_processes=2, catalog=None):
+    """Runs the rules concurrently and yields (rule, df) as each one finishes.
+       WHSE rules return the columns of template (statused over the session
+       pool, one query per table); local rules return the target attributes
+       and AREA_M2 (one overlay per layer)"""
+    wkbs = polygon_wkbs(gdf_polys, id_col)
+    srid = gdf_polys.crs.to_epsg()
+    polys = gdf_polys[[id_col, 'geometry']]
+    catalog = catalog or BCGWCatalog()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as threads, \
+         ProcessPoolExecutor(max_workers=max_processes) as processes:
+        futures = {}
+        for dataset, group in compile_rules(rules).items():
+            if dataset.startswith('WHSE'):
+                future = threads.submit(_status_whse, pool_connector, catalog, group,
+                                        template, wkbs, srid, id_col)
+            else:
+                future = processes.submit(_status_local, dataset, polys, id_col)
+            futures[future] = group
+
+        n = 0
+        for future in as_completed(futures):
+            group = futures[future]
+            result = future.result()
+            dfs = result if isinstance(result, list) else [result.copy() for rule in group]
+            for rule, df in zip(group, dfs):
+                n += 1
+                print(f"...rule {n} of {len(rules)} completed: {rule['Name']}")
+                yield rule, df
@@ -0,0 +1,95 @@
+"""
+Subdivision of large polygons before spatial joins (as PostGIS ST_Subdivide).
+
+Dissolved boundaries (TSAs, herd ranges, management types, the dissolved
+riparian buffers) have hundreds of thousands of vertices: every
+ST_Intersects/ST_Intersection against them is slow, and their bbox covers
+most of the AOI, so the RTREE filters nothing. Their features are split on
+the middle of their bbox until each piece has at most max_vertices
+vertices. Pieces keep the attributes of their parent and its
+PARENT_ROWID; the join results are re-aggregated on the parent keys
+(reaggregate_sql). Pieces do not overlap, so summed areas are exact.
+"""
+
+import numpy as np
+import shapely
+import pyarrow as pa
+
+from gss_utils.duckdb_io import arrow_to_duckdb, replace_if_changed
+
+
+def _polygon_parts(geoms, parents):
+    """Returns the polygons of the geometries and their parents (drops the
+       lines and points left by the cuts)"""
+    parts, idx = shapely.get_parts(geoms, return_index=True)
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+
+    return parts[keep], parents[idx][keep]
+
+
+def subdivide_geometries(geoms, max_vertices=256, max_depth=32):
+    """Returns the pieces of the polygons with at most max_vertices vertices
+       each, and the index of the parent of each piece"""
+    if max_vertices < 8:
+        raise Exception(f'..max_vertices must be at least 8 (got {max_vertices})')
+
+    geoms, parents = _polygon_parts(np.asarray(geoms, dtype=object), np.arange(len(geoms)))
+    pieces, piece_parents = [], []
+    for depth in range(max_depth + 1):
+        big = shapely.get_num_coordinates(geoms) > max_vertices
+        if depth == max_depth:
+            big[:] = False
+        pieces.append(geoms[~big])
+        piece_parents.append(parents[~big])
+        geoms, parents = geoms[big], parents[big]
+        if not len(geoms):
+            break
+
+        # cut across the longer side of the bbox
+        xmin, ymin, xmax, ymax = shapely.bounds(geoms).T
+        wide = (xmax - xmin) >= (ymax - ymin)
+        xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+        low = shapely.box(xmin, ymin, np.where(wide, xmid, xmax), np.where(wide, ymax, ymid))
+        high = shapely.box(np.where(wide, xmid, xmin), np.where(wide, ymin, ymid), xmax, ymax)
+        halves = np.concatenate([shapely.intersection(geoms, low), shapely.intersection(geoms, high)])
+        geoms, parents = _polygon_parts(halves, np.concatenate([parents, parents]))
+
+    return np.concatenate(pieces), np.concatenate(piece_parents)
+
+
+def subdivide_table(dckCnx, table, out_table=None, max_vertices=256, geom_col='geometry'):
+    """Loads the features of a duckdb table split into pieces of at most
+       max_vertices vertices into out_table ({table}_subdiv), with the
+       attributes of their parent and its PARENT_ROWID. Returns the piece count"""
+    out_table = out_table or f'{table}_subdiv'
+    data = dckCnx.execute(f"""SELECT * EXCLUDE ({geom_col}), rowid AS PARENT_ROWID,
+                                     ST_AsWKB({geom_col}) AS _wkb
+                              FROM {table}""").fetch_arrow_table()
+    geoms = shapely.from_wkb(data.column('_wkb').to_numpy(zero_copy_only=False))
+
+    pieces, parents = subdivide_geometries(geoms, max_vertices)
+    data = data.drop(['_wkb']).take(pa.array(parents))
+    data = data.append_column(geom_col, pa.array(shapely.to_wkb(pieces), pa.binary()))
+    print(f'....{table}: {len(geoms)} features subdivided into {len(pieces)} pieces '
+          f'of at most {max_vertices} vertices')
+
+    stage = f'{out_table}_stage'
+    arrow_to_duckdb(dckCnx, stage, data, geom_col)
+
+    return replace_if_changed(dckCnx, out_table, stage)
+
+
+def reaggregate_sql(query, keys, measures=None, geom_col='geometry', group_only=None):
+    """Returns a SELECT re-aggregating the rows of a join against subdivided
+       tables on the parent keys: one row per keys (and group_only columns,
+       left out of the output), the measures ({name: aggregate expression},
+       e.g. {'AREA_HA': 'ROUND(SUM(AREA_HA), 4)'}) and the union of the
+       geometries (geom_col None to leave it out)"""
+    select = list(keys)
+    select += [f'{expr} AS {name}' for name, expr in (measures or {}).items()]
+    if geom_col:
+        select.append(f'ST_Union_Agg({geom_col}) AS {geom_col}')
+
+    return f"""SELECT {', '.join(select)}
+             FROM ({query})
+             GROUP BY {', '.join(list(keys) + list(group_only or []))}"""
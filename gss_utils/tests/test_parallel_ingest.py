@@ -0,0 +1,56 @@
+import threading
+
+import duckdb
+import pyarrow as pa
+
+from gss_utils import parallel_ingest as pi
+
+
+def _job(rows):
+    def _run():
+        data = pa.table({'ID': list(range(rows))})
+        yield data.schema
+        yield from data.to_batches()
+    return _run
+
+
+def _run_with_timeout(fn, timeout=30):
+    """Runs fn in a thread; fails instead of hanging the test run"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(df=fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'parallel_ingest did not return'
+    return result['df']
+
+
+def test_load_failure_does_not_hang(monkeypatch):
+    real_load = pi.replace_if_changed
+
+    def _load(dckCnx, table, stage, source=None, **kwargs):
+        if table == 'bad':
+            raise Exception('Conversion Error')
+        return real_load(dckCnx, table, stage, source, **kwargs)
+
+    monkeypatch.setattr(pi, 'replace_if_changed', _load)
+    dckCnx = duckdb.connect()
+
+    df = _run_with_timeout(lambda: pi.parallel_ingest(dckCnx, {'bad': _job(5), 'good': _job(3)},
+                                                      max_workers=2))
+    status = df.set_index('TABLE')['STATUS'].to_dict()
+
+    assert status == {'bad': 'FAILED', 'good': 'OK'}
+    assert dckCnx.execute('SELECT COUNT(*) FROM good').fetchone()[0] == 3
+    assert 'bad_stage' not in [r[0] for r in dckCnx.execute('SHOW TABLES').fetchall()]
+
+
+def test_job_failure_does_not_hang():
+    def _broken():
+        yield pa.schema([('ID', pa.int64())])
+        raise Exception('ORA-03113')
+
+    dckCnx = duckdb.connect()
+    df = _run_with_timeout(lambda: pi.parallel_ingest(dckCnx, {'broken': _broken, 'good': _job(2)}))
+    status = df.set_index('TABLE')['STATUS'].to_dict()
+
+    assert status == {'broken': 'FAILED', 'good': 'OK'}
@@ -0,0 +1,81 @@
+"""
+Adaptive spatial tiling of an AOI, used to split the extraction of very
+large BCGW layers (see oracle_tiling), or heavy DuckDB overlays, into
+smaller queries run concurrently. This module does not need the Oracle client.
+"""
+
+import shapely
+from shapely.geometry import box, MultiPolygon
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _polygonal(geom):
+    """Returns the polygonal part of a geometry (drops slivers of lower dimension)"""
+    if geom.geom_type in ('Polygon', 'MultiPolygon'):
+        return geom
+    polys = [g for g in shapely.get_parts(geom) if g.geom_type == 'Polygon']
+    return MultiPolygon(polys)
+
+
+def _quadrants(tile):
+    """Returns the 4 quadrants of a rectangular tile"""
+    xmin, ymin, xmax, ymax = tile.bounds
+    xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+    return [box(xmin, ymin, xmid, ymid), box(xmid, ymin, xmax, ymid),
+            box(xmin, ymid, xmid, ymax), box(xmid, ymid, xmax, ymax)]
+
+
+def quadtree_tiles(aoi_geom, count_fn, max_rows=50000, max_depth=6, max_workers=4):
+    """Splits the AOI extent into quadrants until the estimated row count of
+       each tile (count_fn(tile geometry)) is at most max_rows.
+       Returns a list of (tile clipped to the AOI, estimated rows)"""
+    leaves = []
+    level = [box(*aoi_geom.bounds)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for depth in range(max_depth + 1):
+            parts = [_polygonal(t.intersection(aoi_geom)) for t in level]
+            cells = [(t, p) for t, p in zip(level, parts) if not p.is_empty]
+            counts = executor.map(count_fn, [p for t, p in cells])
+
+            level = []
+            for (tile, part), n in zip(cells, counts):
+                if n == 0:
+                    continue
+                if n <= max_rows or depth == max_depth:
+                    leaves.append((part, n))
+                else:
+                    level.extend(_quadrants(tile))
+
+            if not level:
+                break
+
+    return leaves
+
+
+def duckdb_count_fn(dckCnx, tables, geom_col='geometry'):
+    """Returns a count_fn summing the features of the duckdb tables in a tile.
+       Each call runs on its own cursor (count_fn is called from threads)"""
+    def _count(geom):
+        cursor = dckCnx.cursor()
+        try:
+            return sum(cursor.execute(f"""SELECT COUNT(*) FROM {table}
+                                          WHERE ST_Intersects({geom_col}, ST_GeomFromText(?))""",
+                                      [geom.wkt]).fetchone()[0]
+                       for table in tables)
+        finally:
+            cursor.close()
+
+    return _count
+
+
+def tables_extent(dckCnx, tables, geom_col='geometry'):
+    """Returns the bbox polygon covering the duckdb tables"""
+    union = ' UNION ALL '.join(f"""SELECT MIN(ST_XMin({geom_col})) x0, MIN(ST_YMin({geom_col})) y0,
+                                          MAX(ST_XMax({geom_col})) x1, MAX(ST_YMax({geom_col})) y1
+                                   FROM {table}""" for table in tables)
+    x0, y0, x1, y1 = dckCnx.execute(f'SELECT MIN(x0), MIN(y0), MAX(x1), MAX(y1) FROM ({union})').fetchone()
+    if x0 is None:
+        raise Exception(f'..no features in {tables}')
+
+    return box(x0, y0, x1, y1)
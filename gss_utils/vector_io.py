@@ -0,0 +1,208 @@
+"""
+Readers for local vector data (shp or featureclass/gdb).
+
+Layers are read through pyogrio as record batches holding the geometry as
+WKB: there is no GeoDataFrame and no per-row Python work. DuckDB consumes
+the batches as they are read, so memory stays bounded by a few batches.
+vectors_to_duckdb reads several layers at once, each in a worker thread
+(GDAL reads and shapely ops release the GIL), feeding one DuckDB writer.
+
+st_read_to_duckdb reads a layer with the ST_Read function of the DuckDB
+spatial extension instead: GDAL runs inside DuckDB, with the column
+projection and the AOI bbox filter pushed into the read. The geometries
+are then normalized in DuckDB, with the same steps as the Arrow path.
+"""
+
+import os
+import hashlib
+import shapely
+import pandas as pd
+import pyarrow as pa
+from contextlib import contextmanager
+from pyproj import CRS
+from pyogrio import read_info
+from pyogrio.raw import open_arrow
+
+from gss_utils.duckdb_io import stream_to_duckdb, replace_if_changed, is_loaded
+from gss_utils.parallel_ingest import parallel_ingest
+from gss_utils.geom_utils import (DEFAULT_GRID_SIZE, normalize_geometries, normalize_duckdb_table,
+                                 report_counts)
+
+
+def vector_source(path):
+    """Returns the (dataset, layer) of an ESRI format vector (shp or featureclass/gdb)"""
+    if '.shp' in path:
+        return path, None
+
+    if '.gdb' in path:
+        gdb = path.split('.gdb')[0] + '.gdb'
+        return gdb, os.path.basename(path)
+
+    raise Exception('Format not recognized. Please provide a shp or featureclass (gdb)!')
+
+
+def source_signature(path, *params):
+    """Returns the signature of a local vector: path, layer, last modification
+       time and size of the dataset files, and a hash of the read parameters"""
+    dataset, layer = vector_source(path)
+    if os.path.isdir(dataset):
+        stats = [os.stat(os.path.join(dataset, f)) for f in os.listdir(dataset)]
+    else:
+        base = os.path.splitext(dataset)[0]
+        folder = os.path.dirname(dataset) or '.'
+        stats = [os.stat(os.path.join(folder, f)) for f in os.listdir(folder)
+                 if os.path.join(folder, f).startswith(base + '.')]
+    if not stats:
+        raise Exception(f'..{path} not found')
+    mtime = max(st.st_mtime for st in stats)
+    size = sum(st.st_size for st in stats)
+    h = hashlib.sha256(repr(params).encode('utf-8')).hexdigest()[:16]
+
+    return f'{dataset}|{layer}|{mtime}|{size}|{h}'
+
+
+@contextmanager
+def open_vector_arrow(path, columns=None, batch_size=65536, geom_col='GEOMETRY',
+                      normalize=True, grid_size=DEFAULT_GRID_SIZE):
+    """Opens a local vector as a pyarrow RecordBatchReader, with the geometry
+       as WKB in geom_col. Geometries are normalized (see geom_utils) unless
+       normalize is False; no snapping is done in a geographic CRS"""
+    dataset, layer = vector_source(path)
+
+    with open_arrow(dataset, layer=layer, columns=columns, batch_size=batch_size,
+                    use_pyarrow=True) as (meta, reader):
+        geom_name = meta['geometry_name'] or 'wkb_geometry'
+        # plain binary field: the geoarrow extension metadata would let duckdb
+        # convert the column itself, before ST_GeomFromWKB
+        schema = pa.schema([pa.field(geom_col if f.name == geom_name else f.name, f.type)
+                            for f in reader.schema])
+
+        i_geom = schema.get_field_index(geom_col)
+        if meta['crs'] and CRS.from_user_input(meta['crs']).is_geographic:
+            grid_size = None
+
+        def _batches():
+            counts = {}
+            for batch in reader:
+                if normalize:
+                    geoms = shapely.from_wkb(batch.column(i_geom).to_numpy(zero_copy_only=False))
+                    geoms, keep, n_fixed = normalize_geometries(geoms, grid_size)
+                    for step, n in n_fixed.items():
+                        counts[step] = counts.get(step, 0) + n
+
+                    arrays = batch.columns
+                    arrays[i_geom] = pa.array(shapely.to_wkb(geoms), type=schema.field(i_geom).type)
+                    batch = pa.RecordBatch.from_arrays(arrays, schema=schema).filter(pa.array(keep))
+                else:
+                    batch = pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+                yield batch
+
+            if normalize:
+                report_counts(os.path.basename(path), counts)
+
+        yield pa.RecordBatchReader.from_batches(schema, _batches())
+
+
+def vector_to_duckdb(dckCnx, table, path, columns=None, batch_size=65536, geom_col='GEOMETRY',
+                     schemas=None):
+    """Streams a local vector into a duckdb table, unless it was already
+       loaded from the same, unmodified file. Returns the row count"""
+    source = source_signature(path, columns)
+    if is_loaded(dckCnx, table, source):
+        print(f'....{table}: source unchanged: skip reading')
+        return dckCnx.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    with open_vector_arrow(path, columns, batch_size, geom_col) as reader:
+        return stream_to_duckdb(dckCnx, table, reader, geom_col, source, schemas)
+
+
+def vector_job(path, columns=None, batch_size=65536, geom_col='GEOMETRY'):
+    """Returns a parallel_ingest job reading a local vector: the layer is
+       read and normalized in the worker, duckdb only receives WKB batches"""
+    def _job():
+        with open_vector_arrow(path, columns, batch_size, geom_col) as reader:
+            yield reader.schema
+            yield from reader
+
+    # recorded in the duckdb load manifest
+    _job.source = source_signature(path, columns)
+
+    return _job
+
+
+def vectors_to_duckdb(dckCnx, loc_dict, max_workers=4, batch_size=65536, geom_col='GEOMETRY',
+                      schemas=None):
+    """Reads several local vectors ({table: path}) concurrently into duckdb
+       tables. Files already loaded and unmodified since are not read again.
+       Returns a per-table status df (see parallel_ingest)"""
+    jobs = {}
+    skipped = []
+    for table, path in loc_dict.items():
+        job = vector_job(path, batch_size=batch_size, geom_col=geom_col)
+        if is_loaded(dckCnx, table, job.source):
+            print(f'....{table}: source unchanged: skip reading')
+            skipped.append({'TABLE': table, 'STATUS': 'SKIPPED',
+                            'ROWS': dckCnx.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0],
+                            'SECONDS': 0, 'ERROR': None})
+        else:
+            jobs[table] = job
+
+    df_status = pd.DataFrame(skipped, columns=['TABLE', 'STATUS', 'ROWS', 'SECONDS', 'ERROR'])
+    if jobs:
+        print(f'..reading {len(jobs)} layers over {min(max_workers, len(jobs))} workers')
+        df_ingest = parallel_ingest(dckCnx, jobs, max_workers, geom_col=geom_col, schemas=schemas)
+        df_status = pd.concat([df_status, df_ingest], ignore_index=True)
+
+    return df_status
+
+
+def _sql_str(value):
+    """Returns a SQL string literal"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def st_read_sql(path, columns=None, aoi_geom=None, geom_col='GEOMETRY'):
+    """Returns the SELECT reading a local vector with ST_Read. Only the
+       columns (all if None) are read; with an AOI, GDAL only returns the
+       features within its bbox, which are then tested for intersection.
+       Geometries are not normalized (see normalize_duckdb_table)"""
+    dataset, layer = vector_source(path)
+    args = [_sql_str(dataset)]
+    if layer:
+        args.append(f'layer={_sql_str(layer)}')
+    if aoi_geom is not None:
+        xmin, ymin, xmax, ymax = aoi_geom.bounds
+        args.append(f"spatial_filter_box={{'min_x': {xmin}, 'min_y': {ymin}, "
+                    f"'max_x': {xmax}, 'max_y': {ymax}}}::BOX_2D")
+
+    cols = ', '.join(columns) + ', ' if columns else '* EXCLUDE geom, '
+    where = ''
+    if aoi_geom is not None:
+        where = f"WHERE ST_Intersects(geom, ST_GeomFromText('{aoi_geom.wkt}'))"
+
+    return f"""SELECT {cols}geom AS {geom_col}
+                FROM ST_Read({', '.join(args)})
+                {where}"""
+
+
+def st_read_to_duckdb(dckCnx, table, path, columns=None, aoi_geom=None, geom_col='GEOMETRY',
+                      schemas=None, grid_size=DEFAULT_GRID_SIZE):
+    """Reads a local vector into a duckdb table with ST_Read, unless it was
+       already loaded from the same, unmodified file. Geometries are
+       normalized (no snapping in a geographic CRS). Returns the row count"""
+    source = source_signature(path, columns, aoi_geom.wkb if aoi_geom is not None else None,
+                              grid_size)
+    if is_loaded(dckCnx, table, source):
+        print(f'....{table}: source unchanged: skip reading')
+        return dckCnx.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    stage = f'{table}_stage'
+    dckCnx.execute(f'CREATE OR REPLACE TABLE {stage} AS {st_read_sql(path, columns, aoi_geom, geom_col)}')
+
+    dataset, layer = vector_source(path)
+    crs = read_info(dataset, layer=layer)['crs']
+    if crs and CRS.from_user_input(crs).is_geographic:
+        grid_size = None
+    report_counts(os.path.basename(path), normalize_duckdb_table(dckCnx, stage, geom_col, grid_size))
+
+    return replace_if_changed(dckCnx, table, stage, source, schemas=schemas)
@@ -2,10 +2,14 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from gss_utils.overlay import overlay_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -52,19 +56,12 @@ def load_dck_sql():
 
     
     ########### IDF THLB TSA MDWR intersection ##############  
-    dkSql['idf_thlb_tsa_mdwr']="""
+    ovl= overlay_sql(['idf_thlb_tsa thlb', 'mdwr_kam mdr'],
+                     columns=['thlb.*', 'mdr.LEGAL_FEAT_PROVID AS MDWR_OVERLAP'],
+                     left=True)
+    dkSql['idf_thlb_tsa_mdwr']=f"""
         CREATE TABLE idf_thlb_tsa_mdwr AS
-            SELECT 
-              thlb.*,
-              mdr.LEGAL_FEAT_PROVID AS MDWR_OVERLAP,
-              COALESCE(ST_Area(ST_Intersection(mdr.geometry, thlb.geometry)) / 10000.0, ST_Area(thlb.geometry) / 10000.0) AS AREA_HA,
-              COALESCE(ST_Intersection(mdr.geometry, thlb.geometry), thlb.geometry) AS geometry
-            FROM 
-              idf_thlb_tsa thlb
-            LEFT JOIN 
-              mdwr_kam mdr
-            ON 
-              ST_Intersects(mdr.geometry, thlb.geometry);
+            {ovl};
 
         
         -- Fix geometry field name
@@ -100,7 +97,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     try:
         print ('Run Queries')
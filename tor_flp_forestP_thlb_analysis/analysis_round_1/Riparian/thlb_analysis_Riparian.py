@@ -2,10 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from gss_utils.overlay import overlay_sql
+from gss_utils.subdivide import subdivide_table, reaggregate_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -29,20 +34,15 @@ def load_dck_sql():
     dkSql= {}
              
             
-    dkSql['rip_fbp_thlb_tsa']="""
+    # intersection computed once, AREA_HA derived from it. The dissolved
+    # riparian buffers are subdivided: pieces are merged back by thlb feature
+    ovl= overlay_sql(['riparian_buffers_fbp_subdiv rip', 'thlb_tsa_qs thlb'],
+                     columns=['thlb.TSA_NAME', 'thlb.thlb_fact', 'thlb.rowid AS THLB_ROWID'])
+    ovl= reaggregate_sql(ovl, ['TSA_NAME', 'thlb_fact'], {'AREA_HA': 'SUM(AREA_HA)'},
+                         group_only=['THLB_ROWID'])
+    dkSql['rip_fbp_thlb_tsa']=f"""
         CREATE TABLE rip_fbp_thlb_tsa AS
-            SELECT 
-              thlb.TSA_NAME,
-              thlb.thlb_fact,
-              ST_Area(ST_Intersection(rip.geometry, thlb.geometry)) / 10000.0 AS AREA_HA,
-              ST_Intersection(rip.geometry, thlb.geometry) AS geometry
-              
-            FROM 
-                riparian_buffers_fbp rip
-            JOIN 
-                thlb_tsa_qs thlb
-            ON 
-                ST_Intersects(rip.geometry, thlb.geometry); 
+            {ovl}; 
                 """
 
    
@@ -75,9 +75,11 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     try:
+        print ('Subdivide the riparian buffers')
+        subdivide_table(dckCnx, 'riparian_buffers_fbp')
+        
         print ('Run Queries')
         dksql= load_dck_sql()
         run_duckdb_queries (dckCnx, dksql) 
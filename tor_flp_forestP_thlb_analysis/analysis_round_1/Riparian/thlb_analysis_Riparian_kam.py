@@ -2,10 +2,14 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from gss_utils.overlay import overlay_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -28,17 +32,11 @@ class DuckDBConnector:
 def load_dck_sql():
     dkSql= {}
                
-    dkSql['rip_kam_thlb']="""
+    ovl= overlay_sql(['riparian_buffers_kam rip', 'thlb'],
+                     columns=['thlb.thlb_fact'])
+    dkSql['rip_kam_thlb']=f"""
         CREATE TABLE rip_kam_thlb AS
-            SELECT 
-              thlb.thlb_fact,
-              ST_Area(ST_Intersection(rip.geometry, thlb.geometry)) / 10000.0 AS AREA_HA,
-              ST_Intersection(rip.geometry, thlb.geometry) AS geometry
-              
-            FROM 
-              riparian_buffers_kam rip
-                  JOIN 
-              thlb ON ST_Intersects(rip.geometry, thlb.geometry);
+            {ovl};
                     """
 
          
@@ -70,7 +68,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     try:
         print ('Run Queries')
@@ -2,10 +2,14 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from gss_utils.overlay import overlay_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -28,21 +32,11 @@ class DuckDBConnector:
 def load_dck_sql():
     dkSql= {}
        
-    dkSql['ogda_thlb_tsa']="""
+    ovl= overlay_sql(['ogda', 'thlb_tsa_qs thlb'],
+                     columns=['thlb.TSA_NAME', 'ogda.OGSR_PDAC_SYSID', 'thlb.thlb_fact'])
+    dkSql['ogda_thlb_tsa']=f"""
         CREATE TABLE ogda_thlb_tsa AS
-            SELECT 
-              thlb.TSA_NAME,
-              ogda.OGSR_PDAC_SYSID,
-              thlb.thlb_fact,
-              ST_Area(ST_Intersection(ogda.geometry, thlb.geometry)) / 10000.0 AS AREA_HA,
-              ST_Intersection(ogda.geometry, thlb.geometry) AS geometry
-              
-            FROM 
-                ogda
-            JOIN 
-                thlb_tsa_qs thlb
-            ON 
-                ST_Intersects(ogda.geometry, thlb.geometry); 
+            {ovl}; 
                 """
 
    
@@ -74,7 +68,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     try:
         print ('Run Queries')
@@ -2,10 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from gss_utils.overlay import overlay_sql
+from gss_utils.subdivide import subdivide_table, reaggregate_sql
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -28,20 +33,18 @@ class DuckDBConnector:
 def load_dck_sql():
     dkSql= {}
 
-    dkSql['thlb_tsa_qs']="""
+    # tsa_qs is subdivided: thlb pieces are merged back by thlb feature
+    ovl= overlay_sql(['tsa_qs_subdiv AS aoi', 'thlb'],
+                     columns=['aoi.TSA_NUMBER_DESCRIPTION AS TSA_NAME', 'thlb.thlb_fact',
+                              'thlb.rowid AS THLB_ROWID'],
+                     # removes overlapping thlb geometries
+                     where='aoi.TSA_NUMBER_DESCRIPTION = thlb.tsa_number_description')
+    ovl= reaggregate_sql(ovl, ['TSA_NAME', 'thlb_fact'], {'AREA_HA': 'ROUND(SUM(AREA_HA), 4)'},
+                         group_only=['THLB_ROWID'])
+    dkSql['thlb_tsa_qs']=f"""
     --Create a table for Gross THLB calulcation - THLB by plan area
     CREATE TABLE thlb_tsa_qs AS
-        SELECT 
-          aoi.TSA_NUMBER_DESCRIPTION AS TSA_NAME,
-          thlb.thlb_fact,
-          ROUND(ST_Area(
-                  ST_Intersection(aoi.geometry, thlb.geometry))/10000, 4) AS AREA_HA,
-          ST_Intersection(aoi.geometry, thlb.geometry) AS geometry
-        FROM 
-          tsa_qs AS aoi
-          JOIN thlb ON ST_Intersects(aoi.geometry, thlb.geometry)
-        WHERE 
-          aoi.TSA_NUMBER_DESCRIPTION = thlb.tsa_number_description --removes overlapping thlb geometries;  
+        {ovl};
                     """
                                
     
@@ -73,9 +76,11 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     try:
+        print ('Subdivide the TSA boundaries')
+        subdivide_table(dckCnx, 'tsa_qs')
+        
         print ('Run Queries')
         dksql= load_dck_sql()
         run_duckdb_queries (dckCnx, dksql) 
@@ -104,7 +104,12 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
+    
+    # tables read: 'resultant' filters over the THLB resultant (analysis_round_3/thlb_resultant_analysis.py),
+    # 'raster' quick-look accounting (analysis_round_3/thlb_raster_accounting.py) or 'overlay' (pairwise joins)
+    source= 'resultant'
+    sfx= {'resultant': '_res', 'raster': '_rst', 'overlay': ''}[source]
+    cols= '*' if source == 'raster' else '* EXCLUDE geometry'
     
     try:
 
@@ -113,7 +118,7 @@ if __name__ == "__main__":
 
         #df_rpog= dckCnx.execute("""SELECT* FROM r2_2_rip_ogda_thlb""").df()
         df_rpog= dckCnx.execute(
-            """SELECT* Exclude geometry FROM r2_2_rip_ogda_thlb_mdwr_fullattr
+            f"""SELECT {cols} FROM r2_2_rip_ogda_thlb_mdwr_fullattr{sfx}
                 
             """
             ).df()
@@ -148,7 +153,7 @@ if __name__ == "__main__":
         #df_rpdf= dckCnx.execute("""SELECT* FROM r2_2_rip_idf_thlb_mdwr""").df()
         
         df_rpdf= dckCnx.execute(
-            """SELECT* Exclude geometry FROM r2_2_rip_idf_thlb_mdwr_fullattr
+            f"""SELECT {cols} FROM r2_2_rip_idf_thlb_mdwr_fullattr{sfx}
 
                 
             """
@@ -294,7 +299,7 @@ if __name__ == "__main__":
  
         print ('\nCompute RIP/IDF/OGDA summaries')
         
-        df_rpdfog= dckCnx.execute("""SELECT* Exclude geometry FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr""").df()
+        df_rpdfog= dckCnx.execute(f"""SELECT {cols} FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr{sfx}""").df()
         
         df_rpdfog= df_rpdfog.rename(columns={'TSA_NUMBER_DESCRIPTION': 'TSA_NAME'})
         df_rpdfog['PROJ_AGE_1'] = df_rpdfog['PROJ_AGE_1'].replace(-999, np.nan)
@@ -2,10 +2,14 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.duckdb_io import organize_spatial_table
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -35,8 +39,6 @@ def load_dck_sql():
         FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr
         WHERE OVERLAP_TYPE IN ('OGDA only', 'IDF/OGDA overlap', 'Riparian/OGDA overlap', 'Riparian/IDF/OGDA overlap');
 
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_ogda_thlb_mdwr_fullattr ON r2_2_ogda_thlb_mdwr_fullattr USING RTREE (geometry);
                  """   
 
     dkSql['r2_2_idf_thlb_mdwr_fullattr']="""
@@ -45,8 +47,6 @@ def load_dck_sql():
         FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr
         WHERE OVERLAP_TYPE IN ('IDF only', 'IDF/OGDA overlap', 'Riparian/IDF overlap', 'Riparian/IDF/OGDA overlap');
 
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_idf_thlb_mdwr_fullattr ON r2_2_idf_thlb_mdwr_fullattr USING RTREE (geometry);
                  """ 
                  
                  
@@ -56,8 +56,6 @@ def load_dck_sql():
         FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr
         WHERE OVERLAP_TYPE IN ('Riparian only', 'Riparian/IDF overlap', 'Riparian/OGDA overlap', 'Riparian/IDF/OGDA overlap');
 
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_rip_thlb_mdwr_fullattr ON r2_2_rip_thlb_mdwr_fullattr USING RTREE (geometry);
                  """                  
     '''
     
@@ -75,8 +73,6 @@ def load_dck_sql():
         FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr
         WHERE OVERLAP_TYPE IN ('OGDA only', 'IDF/OGDA overlap','Riparian only' ,'Riparian/IDF overlap' ,'Riparian/OGDA overlap', 'Riparian/IDF/OGDA overlap') ;
 
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_rip_ogda_thlb_mdwr_fullattr ON r2_2_rip_ogda_thlb_mdwr_fullattr USING RTREE (geometry);
                  """     
     
 
@@ -92,8 +88,6 @@ def load_dck_sql():
         FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr
         WHERE OVERLAP_TYPE IN ('IDF only', 'IDF/OGDA overlap','Riparian only' ,'Riparian/OGDA overlap' ,'Riparian/IDF overlap', 'Riparian/IDF/OGDA overlap')  ;
 
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_rip_idf_thlb_mdwr_fullattr ON r2_2_rip_idf_thlb_mdwr_fullattr USING RTREE (geometry);
                  """ 
                  
     
@@ -107,6 +101,8 @@ def run_duckdb_queries (dckCnx, dict_sqls):
     for k, v in dict_sqls.items():
         print(f'..running query {counter} of {len(dict_sqls)}: {k}')
         results[k]= dckCnx.execute(v).df()
+        # Hilbert-sorted storage and RTREE index
+        organize_spatial_table(dckCnx, k)
         
         counter+= 1
         
@@ -125,7 +121,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     dckCnx.execute("PRAGMA max_temp_directory_size='100GiB'")
     
     try:
@@ -2,10 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.duckdb_io import organize_spatial_table
+from gss_utils.overlay import tiled_overlay
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -48,35 +53,32 @@ def load_dck_sql():
         ALTER TABLE r2_2_rip_idf_ogda_thlb DROP COLUMN IF EXISTS geometry;  
         ALTER TABLE r2_2_rip_idf_ogda_thlb RENAME COLUMN geometry_1 TO geometry; 
         
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_rip_idf_ogda_thlb ON r2_2_rip_idf_ogda_thlb USING RTREE (geometry);
                  """   
     '''      
+    return dkSql
+
+
+def load_tiled_overlays():
+    """Overlays run tile by tile in worker processes (see gss_utils.overlay.tiled_overlay)"""
+    ovSpecs= {}
+    
     ########### MDWR intersection ##############  
-    dkSql['r2_2_rip_idf_ogda_thlb_mdwr_fullattr']="""
-        CREATE TABLE r2_2_rip_idf_ogda_thlb_mdwr_fullattr AS
-            SELECT 
-              thlb.*,
-              mdr.LEGAL_FEAT_PROVID AS MDWR_OVERLAP,
-              COALESCE(ST_Area(ST_Intersection(mdr.geometry, thlb.geometry)) / 10000.0, ST_Area(thlb.geometry) / 10000.0) AS AREA_HA,
-              COALESCE(ST_Intersection(mdr.geometry, thlb.geometry), thlb.geometry) AS geometry
-            FROM 
-              r2_2_rip_idf_ogda_thlb_fullattr thlb
-            LEFT JOIN 
-              mdwr_kam mdr
-            ON 
-              ST_Intersects(mdr.geometry, thlb.geometry);
+    ovSpecs['r2_2_rip_idf_ogda_thlb_mdwr_fullattr']= {
+        'layers': ['r2_2_rip_idf_ogda_thlb_fullattr thlb', 'mdwr_kam mdr'],
+        'columns': ['thlb.* EXCLUDE (geometry)', 'mdr.LEGAL_FEAT_PROVID AS MDWR_OVERLAP'],
+        'left': True}
 
-        
-        -- Fix geometry field name
-        ALTER TABLE r2_2_rip_idf_ogda_thlb_mdwr_fullattr DROP COLUMN IF EXISTS geometry;  
-        ALTER TABLE r2_2_rip_idf_ogda_thlb_mdwr_fullattr RENAME COLUMN geometry_1 TO geometry; 
-        
-        -- Build a spatial index
-        CREATE INDEX idx_r2_2_rip_idf_ogda_thlb_mdwr_fullattr ON r2_2_rip_idf_ogda_thlb_mdwr_fullattr USING RTREE (geometry);
-                    """ 
+    return ovSpecs
 
-    return dkSql
+
+def run_tiled_overlays (projDB, ov_specs):
+    """Run the overlays tile by tile. The database must not be open"""
+    counter = 1
+    for k, v in ov_specs.items():
+        print(f'..running tiled overlay {counter} of {len(ov_specs)}: {k}')
+        tiled_overlay(projDB, k, **v)
+        
+        counter+= 1
 
 
 def run_duckdb_queries (dckCnx, dict_sqls):
@@ -86,6 +88,8 @@ def run_duckdb_queries (dckCnx, dict_sqls):
     for k, v in dict_sqls.items():
         print(f'..running query {counter} of {len(dict_sqls)}: {k}')
         results[k]= dckCnx.execute(v).df()
+        # Hilbert-sorted storage and RTREE index
+        organize_spatial_table(dckCnx, k)
         
         counter+= 1
         
@@ -98,13 +102,16 @@ if __name__ == "__main__":
     
     wks= r'W:\lwbc\visr\Workarea\moez_labiadh\WORKSPACE_2024\20240819_flp_to_thlb_analysis'
 
+    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
+    
+    print ('Run tiled overlays')
+    run_tiled_overlays(projDB, load_tiled_overlays())
+
     print ('Connecting to databases')    
     print ('..connect to Duckdb') 
-    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     dckCnx.execute("PRAGMA max_temp_directory_size='100GiB'")
     
     try:
@@ -120,9 +127,9 @@ if __name__ == "__main__":
         Duckdb.disconnect_db()
         
         
-finish_t = timeit.default_timer() #finish time
-t_sec = round(finish_t-start_t)
-mins = int (t_sec/60)
-secs = int (t_sec%60)
-print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')  
+    finish_t = timeit.default_timer() #finish time
+    t_sec = round(finish_t-start_t)
+    mins = int (t_sec/60)
+    secs = int (t_sec%60)
+    print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')  
         
\ No newline at end of file
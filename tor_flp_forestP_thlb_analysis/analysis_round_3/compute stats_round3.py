@@ -94,12 +94,17 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
+    
+    # tables read: 'resultant' filters over the THLB resultant (analysis_round_3/thlb_resultant_analysis.py),
+    # 'raster' quick-look accounting (analysis_round_3/thlb_raster_accounting.py) or 'overlay' (pairwise joins)
+    source= 'resultant'
+    sfx= {'resultant': '_res', 'raster': '_rst', 'overlay': ''}[source]
+    cols= '*' if source == 'raster' else '* EXCLUDE geometry'
     
     try:
         '''
         print ('\nCompute Total THLB summary')
-        df_tot= dckCnx.execute("""SELECT* EXCLUDE geometry FROM r3_vri_thlb""").df()
+        df_tot= dckCnx.execute("""SELECT* EXCLUDE geometry REPLACE (BEC_ZONE_CODE::VARCHAR AS BEC_ZONE_CODE) FROM r3_vri_thlb""").df()
         
         bins = [0, 79, 139, 249, 400, float('inf')]
         labels = ['0-79', '80-139', '140-249', '250-400', '400+']
@@ -119,7 +124,7 @@ if __name__ == "__main__":
 
         print ('\nCompute IDF summaries')
         
-        df_idf= dckCnx.execute("""SELECT* EXCLUDE geometry FROM r3_idf_vri_thlb WHERE BEC_ZONE_CODE='IDF'""").df()
+        df_idf= dckCnx.execute(f"""SELECT {cols} REPLACE (BEC_ZONE_CODE::VARCHAR AS BEC_ZONE_CODE) FROM r3_idf_vri_thlb{sfx} WHERE BEC_ZONE_CODE='IDF'""").df()
 
         df_idf = df_idf.rename(columns={"TSA_NUMBER_DESCRIPTION": "TSA_NAME"})
         
@@ -246,7 +251,7 @@ if __name__ == "__main__":
         
         print ('\nCompute Riparian summary')
         
-        df_rip= dckCnx.execute("""SELECT* EXCLUDE geometry FROM r3_rip_vri_thlb""").df()
+        df_rip= dckCnx.execute(f"""SELECT {cols} REPLACE (BEC_ZONE_CODE::VARCHAR AS BEC_ZONE_CODE) FROM r3_rip_vri_thlb{sfx}""").df()
         
         bins = [0, 79, 139, 249, 400, float('inf')]
         labels = ['0-79', '80-139', '140-249', '250-400', '400+']
@@ -0,0 +1,101 @@
+import warnings
+warnings.simplefilter(action='ignore')
+
+import os
+import sys
+import timeit
+import duckdb
+import pandas as pd
+from shapely.geometry import box
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.raster_accounting import build_raster_resultant, calibrate_accounting
+from gss_utils.tiling import tables_extent
+from thlb_resultant_views import load_resultant_layers, load_dck_sql
+
+class DuckDBConnector:
+    def __init__(self, db=':memory:'):
+        self.db = db
+        self.conn = None
+
+    def connect_to_db(self):
+        """Connects to a DuckDB database and installs spatial extension."""
+        self.conn = duckdb.connect(self.db)
+        self.conn.install_extension('spatial')
+        self.conn.load_extension('spatial')
+        return self.conn
+
+    def disconnect_db(self):
+        """Disconnects from the DuckDB database."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_duckdb_queries (dckCnx, dict_sqls):
+    """Run duckdb queries """
+    counter = 1
+    for k, v in dict_sqls.items():
+        print(f'..running query {counter} of {len(dict_sqls)}: {k}')
+        dckCnx.execute(v)
+
+        counter+= 1
+
+
+def calibration_tile(dckCnx, table, size):
+    """Returns a size x size tile at the centre of the extent of the table"""
+    x, y = tables_extent(dckCnx, [table]).centroid.coords[0]
+
+    return box(x - size/2, y - size/2, x + size/2, y + size/2)
+
+
+
+if __name__ == "__main__":
+    start_t = timeit.default_timer() #start time
+
+    wks= r'W:\lwbc\visr\Workarea\moez_labiadh\WORKSPACE_2024\20240819_flp_to_thlb_analysis'
+
+    cell_size= 10      # m. 5 to 25 m
+    calib_size= 10000  # m
+
+    print ('Connecting to databases')
+    print ('..connect to Duckdb')
+    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
+    Duckdb= DuckDBConnector(db= projDB)
+    Duckdb.connect_to_db()
+    dckCnx= Duckdb.conn
+
+    try:
+        layers= load_resultant_layers()
+
+        print ('Calibrate the raster accounting against the vector resultant')
+        tile= calibration_tile(dckCnx, 'thlb_tsa_qs', calib_size)
+        df_calib= calibrate_accounting(dckCnx, 'thlb_resultant_calib', layers, tile,
+                                       by=['TSA_NAME', 'BEC_ZONE_CODE', 'IN_RIP', 'IN_IDF', 'IN_OGDA'],
+                                       weight='thlb_fact', required=['thlb'], cell_size=cell_size)
+
+        print ('Build the raster THLB resultant')
+        build_raster_resultant(dckCnx, 'thlb_resultant_rst', layers, required=['thlb'],
+                               cell_size=cell_size)
+
+        print ('Run Queries')
+        dksql= load_dck_sql('thlb_resultant_rst', '_rst', 'EDGE_HA')
+        run_duckdb_queries (dckCnx, dksql)
+
+
+    except Exception as e:
+        raise Exception(f"Error occurred: {e}")
+
+    finally:
+        Duckdb.disconnect_db()
+
+
+    print ('\n Export calibration table')
+    df_calib.to_csv(os.path.join(wks, 'outputs', f'raster_accounting_calibration_{cell_size}m.csv'), index=False)
+
+
+    finish_t = timeit.default_timer() #finish time
+    t_sec = round(finish_t-start_t)
+    mins = int (t_sec/60)
+    secs = int (t_sec%60)
+    print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')
@@ -0,0 +1,77 @@
+import warnings
+warnings.simplefilter(action='ignore')
+
+import os
+import sys
+import timeit
+import duckdb
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.resultant import build_resultant
+from thlb_resultant_views import load_resultant_layers, load_dck_sql
+
+class DuckDBConnector:
+    def __init__(self, db=':memory:'):
+        self.db = db
+        self.conn = None
+
+    def connect_to_db(self):
+        """Connects to a DuckDB database and installs spatial extension."""
+        self.conn = duckdb.connect(self.db)
+        self.conn.install_extension('spatial')
+        self.conn.load_extension('spatial')
+        return self.conn
+
+    def disconnect_db(self):
+        """Disconnects from the DuckDB database."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_duckdb_queries (dckCnx, dict_sqls):
+    """Run duckdb queries """
+    counter = 1
+    for k, v in dict_sqls.items():
+        print(f'..running query {counter} of {len(dict_sqls)}: {k}')
+        dckCnx.execute(v)
+
+        counter+= 1
+
+
+
+if __name__ == "__main__":
+    start_t = timeit.default_timer() #start time
+
+    wks= r'W:\lwbc\visr\Workarea\moez_labiadh\WORKSPACE_2024\20240819_flp_to_thlb_analysis'
+
+    print ('Connecting to databases')
+    print ('..connect to Duckdb')
+    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
+    Duckdb= DuckDBConnector(db= projDB)
+    Duckdb.connect_to_db()
+    dckCnx= Duckdb.conn
+    dckCnx.execute("PRAGMA max_temp_directory_size='100GiB'")
+
+    try:
+        print ('Build the THLB resultant')
+        build_resultant(dckCnx, 'thlb_resultant', load_resultant_layers(), required=['thlb'])
+
+        print ('Run Queries')
+        dksql= load_dck_sql('thlb_resultant', '_res', 'geometry')
+        run_duckdb_queries (dckCnx, dksql)
+
+
+    except Exception as e:
+        raise Exception(f"Error occurred: {e}")
+
+    finally:
+        Duckdb.disconnect_db()
+
+
+    finish_t = timeit.default_timer() #finish time
+    t_sec = round(finish_t-start_t)
+    mins = int (t_sec/60)
+    secs = int (t_sec%60)
+    print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')
@@ -0,0 +1,103 @@
+"""
+Layers of the THLB netdown resultant and the round 2/3 views over it,
+shared by the vector (thlb_resultant_analysis) and raster
+(thlb_raster_accounting) scripts so that both accountings compare.
+"""
+
+
+# overlap classification of a resultant face
+OVERLAP_TYPE= """
+            CASE
+                WHEN IN_RIP AND IN_IDF AND IN_OGDA THEN 'Riparian/IDF/OGDA overlap'
+                WHEN IN_RIP AND IN_IDF THEN 'Riparian/IDF overlap'
+                WHEN IN_RIP AND IN_OGDA THEN 'Riparian/OGDA overlap'
+                WHEN IN_IDF AND IN_OGDA THEN 'IDF/OGDA overlap'
+                WHEN IN_RIP THEN 'Riparian only'
+                WHEN IN_IDF THEN 'IDF only'
+                WHEN IN_OGDA THEN 'OGDA only'
+            END"""
+
+
+def load_resultant_layers():
+    """Layers of the THLB netdown resultant: {name: (table, columns)}.
+       thlb_tsa_qs already holds the THLB split by TSA"""
+    layers= {}
+    layers['thlb']= ('thlb_tsa_qs', ['TSA_NAME', 'thlb_fact'])
+    layers['idf']= ('idf', [])
+    layers['ogda']= ('ogda', ['OGSR_PDAC_SYSID'])
+    layers['rip']= ('riparian_buffers_fbp', [])
+    layers['mdwr']= ('mdwr_kam', ['LEGAL_FEAT_PROVID AS MDWR_OVERLAP'])
+    layers['vri']= ('vri', ['BEC_ZONE_CODE', 'BEC_SUBZONE', 'PROJ_AGE_1', 'LIVE_STAND_VOLUME_125'])
+
+    return layers
+
+
+def load_dck_sql(resultant, sfx, last_col):
+    """Round 2/3 tables read by the compute stats scripts ({name}{sfx}), as
+       attribute filters over the resultant table instead of chains of
+       spatial joins. last_col is kept as the last column of each view:
+       geometry for the vector resultant, EDGE_HA for the raster one"""
+    dkSql= {}
+
+    base= f"""
+        SELECT TSA_NAME, thlb_fact, BEC_ZONE_CODE, BEC_SUBZONE, PROJ_AGE_1,
+            LIVE_STAND_VOLUME_125,
+            {OVERLAP_TYPE} AS OVERLAP_TYPE,
+            MDWR_OVERLAP, AREA_HA, {last_col}
+        FROM {resultant}"""
+
+    ########### Round 2 ##############
+    dkSql[f'r2_2_rip_idf_ogda_thlb_mdwr_fullattr{sfx}']=f"""
+        CREATE OR REPLACE VIEW r2_2_rip_idf_ogda_thlb_mdwr_fullattr{sfx} AS
+        {base}
+        WHERE IN_RIP OR IN_IDF OR IN_OGDA;
+                 """
+
+    dkSql[f'r2_2_rip_ogda_thlb_mdwr_fullattr{sfx}']=f"""
+        CREATE OR REPLACE VIEW r2_2_rip_ogda_thlb_mdwr_fullattr{sfx} AS
+        SELECT * EXCLUDE ({last_col}),
+            CASE
+                WHEN OVERLAP_TYPE IN ('OGDA only', 'IDF/OGDA overlap') THEN 'OGDA only'
+                WHEN OVERLAP_TYPE IN ('Riparian only', 'Riparian/IDF overlap') THEN 'Riparian only'
+                WHEN OVERLAP_TYPE IN ('Riparian/OGDA overlap', 'Riparian/IDF/OGDA overlap') THEN 'Riparian/OGDA overlap'
+            END AS OVERLAP_TYPE_2,
+            {last_col}
+        FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr{sfx}
+        WHERE OVERLAP_TYPE != 'IDF only';
+                 """
+
+    dkSql[f'r2_2_rip_idf_thlb_mdwr_fullattr{sfx}']=f"""
+        CREATE OR REPLACE VIEW r2_2_rip_idf_thlb_mdwr_fullattr{sfx} AS
+        SELECT * EXCLUDE ({last_col}),
+            CASE
+                WHEN OVERLAP_TYPE IN ('IDF only', 'IDF/OGDA overlap') THEN 'IDF only'
+                WHEN OVERLAP_TYPE IN ('Riparian only', 'Riparian/OGDA overlap') THEN 'Riparian only'
+                WHEN OVERLAP_TYPE IN ('Riparian/IDF overlap', 'Riparian/IDF/OGDA overlap') THEN 'Riparian/IDF overlap'
+            END AS OVERLAP_TYPE_2,
+            {last_col}
+        FROM r2_2_rip_idf_ogda_thlb_mdwr_fullattr{sfx}
+        WHERE OVERLAP_TYPE != 'OGDA only';
+                 """
+
+    ########### Round 3 ##############
+    dkSql[f'r3_vri_thlb{sfx}']=f"""
+        CREATE OR REPLACE VIEW r3_vri_thlb{sfx} AS
+        SELECT TSA_NAME, thlb_fact, BEC_ZONE_CODE, BEC_SUBZONE, PROJ_AGE_1,
+            LIVE_STAND_VOLUME_125, AREA_HA, {last_col}
+        FROM {resultant}
+        WHERE IN_VRI;
+                 """
+
+    dkSql[f'r3_idf_vri_thlb{sfx}']=f"""
+        CREATE OR REPLACE VIEW r3_idf_vri_thlb{sfx} AS
+        {base}
+        WHERE IN_IDF AND IN_VRI;
+                 """
+
+    dkSql[f'r3_rip_vri_thlb{sfx}']=f"""
+        CREATE OR REPLACE VIEW r3_rip_vri_thlb{sfx} AS
+        {base}
+        WHERE IN_RIP AND IN_VRI;
+                 """
+
+    return dkSql
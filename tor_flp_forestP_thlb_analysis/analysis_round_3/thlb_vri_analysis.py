@@ -2,10 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.duckdb_io import organize_spatial_table
+from gss_utils.overlay import overlay_sql, tiled_overlay
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -47,8 +52,6 @@ def load_dck_sql():
              ON 
                  ST_Intersects(thlb.geometry, vri.geometry); 
 
-        -- Build a spatial index
-        CREATE INDEX idx_r3_vri_thlb ON r3_vri_thlb USING RTREE (geometry);
                  """   
 
     dkSql['r3_rip_vri_thlb']="""
@@ -72,44 +75,47 @@ def load_dck_sql():
              ON 
                  ST_Intersects(thlb.geometry, rip.geometry); 
 
-        -- Build a spatial index
-        CREATE INDEX idx_r3_rip_vri_thlb ON r3_rip_vri_thlb USING RTREE (geometry);
                  """ 
    
                  
    
     '''
 
-    dkSql['r3_idf_vri_thlb']="""
+    ovl= overlay_sql(['r2_2_idf_thlb_mdwr_fullattr idf', 'r3_vri_thlb thlb'],
+                     columns=['thlb.TSA_NAME', 'thlb.thlb_fact', 'thlb.BEC_ZONE_CODE',
+                              'thlb.BEC_SUBZONE', 'thlb.PROJ_AGE_1', 'thlb.LIVE_STAND_VOLUME_125',
+                              'idf.OVERLAP_TYPE', 'idf.MDWR_OVERLAP'])
+    dkSql['r3_idf_vri_thlb']=f"""
          CREATE TABLE r3_idf_vri_thlb AS
-             SELECT 
-               thlb.TSA_NAME,
-               thlb.thlb_fact,
-               thlb.BEC_ZONE_CODE,
-               thlb.BEC_SUBZONE,
-               thlb.PROJ_AGE_1,
-               thlb.LIVE_STAND_VOLUME_125,
-               idf.OVERLAP_TYPE,
-               idf.MDWR_OVERLAP,
-               ST_Area(ST_Intersection(idf.geometry, thlb.geometry)) / 10000.0 AS AREA_HA,
-               ST_Intersection(idf.geometry, thlb.geometry) AS geometry
-               
-             FROM 
-                 r2_2_idf_thlb_mdwr_fullattr idf 
-             JOIN 
-                 r3_vri_thlb thlb
-                
-             ON 
-                 ST_Intersects(idf.geometry, thlb.geometry); 
-
-        -- Build a spatial index
-        CREATE INDEX idx_r3_idf_vri_thlb ON r3_idf_vri_thlb USING RTREE (geometry);
+             {ovl}; 
                      """                         
 
                  
     return dkSql
 
 
+def load_tiled_overlays():
+    """Overlays run tile by tile in worker processes (see gss_utils.overlay.tiled_overlay)"""
+    ovSpecs= {}
+    
+    ovSpecs['r3_vri_thlb']= {
+        'layers': ['thlb_tsa_qs thlb', 'vri'],
+        'columns': ['thlb.TSA_NAME', 'thlb.thlb_fact', 'vri.BEC_ZONE_CODE', 'vri.BEC_SUBZONE',
+                    'vri.PROJ_AGE_1', 'vri.LIVE_STAND_VOLUME_125']}
+
+    return ovSpecs
+
+
+def run_tiled_overlays (projDB, ov_specs):
+    """Run the overlays tile by tile. The database must not be open"""
+    counter = 1
+    for k, v in ov_specs.items():
+        print(f'..running tiled overlay {counter} of {len(ov_specs)}: {k}')
+        tiled_overlay(projDB, k, **v)
+        
+        counter+= 1
+
+
 def run_duckdb_queries (dckCnx, dict_sqls):
     """Run duckdb queries """
     results= {}
@@ -117,6 +123,8 @@ def run_duckdb_queries (dckCnx, dict_sqls):
     for k, v in dict_sqls.items():
         print(f'..running query {counter} of {len(dict_sqls)}: {k}')
         results[k]= dckCnx.execute(v).df()
+        # Hilbert-sorted storage and RTREE index
+        organize_spatial_table(dckCnx, k)
         
         counter+= 1
         
@@ -129,13 +137,16 @@ if __name__ == "__main__":
     
     wks= r'W:\lwbc\visr\Workarea\moez_labiadh\WORKSPACE_2024\20240819_flp_to_thlb_analysis'
 
+    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
+    
+    print ('Run tiled overlays')
+    run_tiled_overlays(projDB, load_tiled_overlays())
+
     print ('Connecting to databases')    
     print ('..connect to Duckdb') 
-    projDB= os.path.join(wks, 'inputs', 'tor_flp_thlb_analysis.db')
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     dckCnx.execute("PRAGMA max_temp_directory_size='100GiB'")
     
     try:
@@ -151,9 +162,9 @@ if __name__ == "__main__":
         Duckdb.disconnect_db()
         
         
-finish_t = timeit.default_timer() #finish time
-t_sec = round(finish_t-start_t)
-mins = int (t_sec/60)
-secs = int (t_sec%60)
-print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')  
+    finish_t = timeit.default_timer() #finish time
+    t_sec = round(finish_t-start_t)
+    mins = int (t_sec/60)
+    secs = int (t_sec%60)
+    print (f'\nProcessing Completed in {mins} minutes and {secs} seconds')  
         
\ No newline at end of file
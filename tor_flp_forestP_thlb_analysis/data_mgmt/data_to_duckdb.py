@@ -2,11 +2,13 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
-import pandas as pd
-import geopandas as gpd
-from shapely import wkb, wkt
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.vector_io import vectors_to_duckdb, st_read_to_duckdb
+from gss_utils.schemas import TOR_FLP_SCHEMAS
 
 
 class DuckDBConnector:
@@ -28,116 +30,24 @@ class DuckDBConnector:
             self.conn = None
             
 
-def esri_to_gdf (aoi):
-    """Returns a Geopandas file (gdf) based on 
-       an ESRI format vector (shp or featureclass/gdb)"""
-    
-    if '.shp' in aoi: 
-        gdf = gpd.read_file(aoi)
-    
-    elif '.gdb' in aoi:
-        l = aoi.split ('.gdb')
-        gdb = l[0] + '.gdb'
-        fc = os.path.basename(aoi)
-        gdf = gpd.read_file(filename= gdb, layer= fc)
+def add_data_to_duckdb(dckCnx, loc_dict, aoi_geom=None, use_st_read=False):
+    """Reads the local files into duckdb, streamed as Arrow batches of WKB,
+       several layers at a time. With use_st_read, the files are read with
+       ST_Read inside duckdb instead (features intersecting the AOI only,
+       if provided)"""
+    if not use_st_read:
+        df_status = vectors_to_duckdb(dckCnx, loc_dict, schemas=TOR_FLP_SCHEMAS)
+        print(df_status.to_string(index=False))
         
-    else:
-        raise Exception ('Format not recognized. Please provide a shp or featureclass (gdb)!')
+        failed = df_status.loc[~df_status['STATUS'].isin(['OK', 'SKIPPED']), 'TABLE'].to_list()
+        if failed:
+            raise Exception(f'..failed to load: {failed}')
+        return
     
-    return gdf
-
-
-def read_local_data(loc_dict, data_dict):
     counter = 1
     for k, v in loc_dict.items():
-        print(f'....table {counter} of {len(loc_dict)}: {k}')
-        df= esri_to_gdf (v)
-        df['GEOMETRY']= df['geometry'].apply(lambda x: wkt.dumps(x, output_dimension=2))
-        df['GEOMETRY'] = df['GEOMETRY'].astype(str)
-        
-        df = df.drop(columns=['geometry'])
-        
-        data_dict[k]= df
-        
-        counter+=1
-        
-    return data_dict   
-
-
-def add_data_to_duckdb(dckCnx, data_dict):
-    counter = 1
-    for k, v in data_dict.items():
-        print(f'..table {counter} of {len(data_dict)}: {k}')
-        dck_tab_list = dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-
-        if k in dck_tab_list:
-            dck_row_count = dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams = dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-
-            if (dck_row_count != len(v)) or (set(list(v.columns)) != set(dck_col_nams)):
-                print(f'....import to Duckdb ({v.shape[0]} rows)')
-                chunk_size = 10000
-                total_chunks = (len(v) + chunk_size - 1) // chunk_size
-                
-                # Process the initial chunk and create the table
-                initial_chunk = v.iloc[0:chunk_size]
-                print(f'.......processing chunk 1 of {total_chunks}')
-                create_table_query = f"""
-                CREATE TABLE IF NOT EXISTS {k} AS
-                    SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                    FROM initial_chunk;
-                """
-                dckCnx.execute(create_table_query)
-                
-                # Process and append the rest of the chunks
-                for i in range(chunk_size, len(v), chunk_size):
-                    chunk = v.iloc[i:i + chunk_size]
-                    chunk_number = (i // chunk_size) + 1
-                    print(f'.......processing chunk {chunk_number} of {total_chunks}')
-                    
-                    insert_query = f"""
-                    INSERT INTO {k}
-                        SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                        FROM chunk;
-                    """
-                    dckCnx.execute(insert_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-
-        else:
-            print(f'....import to Duckdb ({v.shape[0]} rows)')
-            chunk_size = 10000
-            total_chunks = (len(v) + chunk_size - 1) // chunk_size
-            
-            # Process the initial chunk and create the table
-            initial_chunk = v.iloc[0:chunk_size]
-            print(f'.......processing chunk 1 of {total_chunks}')
-            create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {k} AS
-                SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                FROM initial_chunk;
-            """
-            dckCnx.execute(create_table_query)
-            
-            # Process and append the rest of the chunks
-            for i in range(chunk_size, len(v), chunk_size):
-                chunk = v.iloc[i:i + chunk_size]
-                chunk_number = (i // chunk_size) + 1
-                print(f'.......processing chunk {chunk_number} of {total_chunks}')
-                
-                insert_query = f"""
-                INSERT INTO {k}
-                    SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                    FROM chunk;
-                """
-                dckCnx.execute(insert_query)
-                
-        #Add a spatial index to the table
-        print(f'....creating a spatial RTREE index')
-        dckCnx.execute(f'CREATE INDEX idx_2_{k} ON {k} USING RTREE (GEOMETRY);')
+        print(f'..table {counter} of {len(loc_dict)}: {k}')
+        st_read_to_duckdb(dckCnx, k, v, aoi_geom=aoi_geom, schemas=TOR_FLP_SCHEMAS)
 
         counter += 1
 
@@ -156,7 +66,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
 
     try:
@@ -185,13 +94,8 @@ if __name__ == "__main__":
         
         loc_dict['vri']= os.path.join(gdb, 'vri_qs_attr_v2')
         
-        data_dict= {}
-        
-        print('\n..reading from Local files')
-        data_dict= read_local_data(loc_dict, data_dict)
-        
-        print('\nWriting data to duckdb')
-        add_data_to_duckdb(dckCnx, data_dict)
+        print('\nWriting local files to duckdb')
+        add_data_to_duckdb(dckCnx, loc_dict)
         
 
     except Exception as e:
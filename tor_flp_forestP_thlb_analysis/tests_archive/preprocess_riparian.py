@@ -2,10 +2,15 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
+import sys
 import timeit
 import duckdb
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.dissolve import dissolve_table
+from gss_utils.subdivide import subdivide_table
+
 class DuckDBConnector:
     def __init__(self, db=':memory:'):
         self.db = db
@@ -30,6 +35,9 @@ def add_buffer_width(dckCnx, wks, tables):
     specs_file= os.path.join(wks, 'inputs', 'riparian_buffers.xlsx')
     df= pd.read_excel(specs_file)
     df=df[['Riparian Class Match', 'Buffer width @ 100% Retention']]
+    # explicit dtypes: duckdb does not need to sniff the object columns
+    df=df.astype({'Riparian Class Match': 'string',
+                  'Buffer width @ 100% Retention': 'float64'})
     
     for table in tables:
         print (f'...working on {table}')
@@ -62,26 +70,20 @@ def create_buffers (dckCnx, wks, tables):
     
 
 def merge_riparian (dckCnx):
-    dckCnx.execute("""
-        -- Step 1: Merge the tables and union the geometries
-        CREATE TABLE merged_geometry AS
-            SELECT buffered_geometry AS geometry
-            FROM (
-                SELECT buffered_geometry FROM rivers_buffered
-                UNION ALL
-                SELECT buffered_geometry FROM lakes_buffered
-                UNION ALL
-                SELECT buffered_geometry FROM wetlands_buffered
-                UNION ALL
-                SELECT buffered_geometry FROM streams_buffered
-            ) AS combined_geometries;
-        
-        -- Step 2: Dissolve any overlaps
-        CREATE TABLE dissolved_geometry AS
-            SELECT ST_Union(geometry) AS geometry
-            FROM merged_geometry;
-                   
-        """)
+    # Step 1-2: merge the buffered tables and dissolve any overlaps, tile
+    # by tile in parallel. Single parts, with a PART_ID
+    dissolve_table(dckCnx, 'dissolved_geometry', """
+            SELECT buffered_geometry AS geometry FROM rivers_buffered
+            UNION ALL
+            SELECT buffered_geometry FROM lakes_buffered
+            UNION ALL
+            SELECT buffered_geometry FROM wetlands_buffered
+            UNION ALL
+            SELECT buffered_geometry FROM streams_buffered
+                   """, explode=True)
+    
+    # Step 3: split the dissolved geometry into pieces the RTREE can filter
+    subdivide_table(dckCnx, 'dissolved_geometry')
         
         
      
@@ -96,7 +98,6 @@ if __name__ == "__main__":
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     
     try:
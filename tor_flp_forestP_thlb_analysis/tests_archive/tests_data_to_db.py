@@ -2,49 +2,21 @@ import warnings
 warnings.simplefilter(action='ignore')
 
 import os
-import json
+import sys
 import timeit
-import cx_Oracle
 import duckdb
 import pandas as pd
+import pyarrow.compute as pc
 import geopandas as gpd
-from shapely import wkb, wkt
+from shapely import wkb
 
-
-class OracleConnector:
-    def __init__(self, dbname='BCGW'):
-        self.dbname = dbname
-        self.cnxinfo = self.get_db_cnxinfo()
-
-    def get_db_cnxinfo(self):
-        """ Retrieves db connection params from the config file"""
-        with open(r'H:\config\db_config.json', 'r') as file:
-            data = json.load(file)
-        
-        if self.dbname in data:
-            return data[self.dbname]
-        
-        raise KeyError(f"Database '{self.dbname}' not found.")
-    
-    def connect_to_db(self):
-        """ Connects to Oracle DB and create a cursor"""
-        try:
-            self.connection = cx_Oracle.connect(self.cnxinfo['username'], 
-                                                self.cnxinfo['password'], 
-                                                self.cnxinfo['hostname'], 
-                                                encoding="UTF-8")
-            self.cursor = self.connection.cursor()
-            print  ("..Successffuly connected to the database")
-        except Exception as e:
-            raise Exception(f'..Connection failed: {e}')
-
-    def disconnect_db(self):
-        """Close the Oracle connection and cursor"""
-        if hasattr(self, 'cursor') and self.cursor:
-            self.cursor.close()
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-            print("....Disconnected from the database")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from gss_utils.oracle_io import OraclePoolConnector, oracle_job
+from gss_utils.bcgw_cache import QueryCache
+from gss_utils.bcgw_mirror import mirror_exists, mirror_job
+from gss_utils.oracle_tiling import tiled_ingest, filter_count_sql
+from gss_utils.vector_io import vectors_to_duckdb, st_read_to_duckdb
+from gss_utils.schemas import TOR_FLP_SCHEMAS
 
 
 class DuckDBConnector:
@@ -97,8 +69,7 @@ def esri_to_gdf (aoi):
 
 def df_2_gdf (df, geometry_col, crs):
     """ Return a geopandas gdf based on a df with Geometry column"""
-    df[geometry_col] = df[geometry_col].astype(str)
-    df['geometry'] = gpd.GeoSeries.from_wkt(df[geometry_col])
+    df['geometry'] = gpd.GeoSeries.from_wkb(df[geometry_col])
     
     gdf = gpd.GeoDataFrame(df, geometry='geometry')
     gdf.crs = "EPSG:" + str(crs)
@@ -129,7 +100,7 @@ def load_Orc_sql():
             FEATURE_CODE,
             GNIS_NAME_1,
             AREA_HA,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY
              
         FROM
             WHSE_BASEMAPPING.FWA_LAKES_POLY
@@ -151,7 +122,7 @@ def load_Orc_sql():
             STREAM_ORDER,
             STREAM_MAGNITUDE,
             WATERBODY_KEY,
-            SDO_UTIL.TO_WKTGEOMETRY(SDO_CS.MAKE_2D(GEOMETRY)) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(SDO_CS.MAKE_2D(GEOMETRY)) AS GEOMETRY
         FROM
             WHSE_BASEMAPPING.FWA_STREAM_NETWORKS_SP
         WHERE
@@ -163,7 +134,7 @@ def load_Orc_sql():
     orSql['tsa'] = """
          SELECT
              TSA_NUMBER_DESCRIPTION AS TSA_NAME,
-             SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+             SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
          FROM
          WHSE_ADMIN_BOUNDARIES.FADM_TSA
          WHERE
@@ -182,7 +153,7 @@ def load_Orc_sql():
             FEATURE_CODE,
             GNIS_NAME_1,
             AREA_HA,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY
              
         FROM
             WHSE_BASEMAPPING.FWA_WETLANDS_POLY
@@ -212,7 +183,7 @@ def load_Orc_sql():
             PROJ_AGE_2,
             PROJ_AGE_CLASS_CD_2,
             LIVE_STAND_VOLUME_125,
-            SDO_UTIL.TO_WKTGEOMETRY(SDO_GEOM.SDO_INTERSECTION(vri.GEOMETRY, bec.GEOMETRY, 0.005)) AS GEOMETRY
+            SDO_UTIL.TO_WKBGEOMETRY(SDO_GEOM.SDO_INTERSECTION(vri.GEOMETRY, bec.GEOMETRY, 0.005)) AS GEOMETRY
         FROM 
             WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY vri
         JOIN 
@@ -225,6 +196,7 @@ def load_Orc_sql():
             AND bec.SUBZONE IN ('dc', 'dh', 'dk', 'dm', 'dw', 
                                 'xc', 'xh', 'xk', 'xm', 'xw', 'xx') 
             AND SDO_RELATE(bec.GEOMETRY, SDO_GEOMETRY(:wkb_aoi, :srid), 'mask=ANYINTERACT') = 'TRUE' 
+            AND SDO_RELATE(vri.GEOMETRY, SDO_GEOMETRY(:wkb_aoi, :srid), 'mask=ANYINTERACT') = 'TRUE' 
                     """
                     
              
@@ -237,7 +209,7 @@ def load_Orc_sql():
             bec.NATURAL_DISTURBANCE,
             bec.MAP_LABEL,
             bec.BGC_LABEL,
-            SDO_UTIL.TO_WKTGEOMETRY(bec.GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(bec.GEOMETRY) AS GEOMETRY 
             
         FROM
             WHSE_FOREST_VEGETATION.BEC_BIOGEOCLIMATIC_POLY bec
@@ -267,7 +239,7 @@ def load_Orc_sql():
             PROJ_AGE_2,
             PROJ_AGE_CLASS_CD_2,
             LIVE_STAND_VOLUME_125,
-            SDO_UTIL.TO_WKTGEOMETRY(GEOMETRY) AS GEOMETRY 
+            SDO_UTIL.TO_WKBGEOMETRY(GEOMETRY) AS GEOMETRY 
         FROM
             WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY
         WHERE
@@ -277,112 +249,97 @@ def load_Orc_sql():
     return orSql
             
 
-def read_oracle_data (orcCnx, orcCur, dict_sqls, wkb_aoi, srid, data_dict):
-    counter = 1
+def load_tiled_specs():
+    """Large layers extracted tile by tile: row-count estimate query and
+       the key identifying features returned by several tiles"""
+    vri= 'WHSE_FOREST_VEGETATION.VEG_COMP_LYR_R1_POLY'
+    tiled= {}
+    tiled['vri']= (filter_count_sql(vri), ['POLYGON_ID'])
+    # one row per VRI x BEC intersection piece
+    tiled['bec_mature']= (filter_count_sql(vri, where='PROJ_AGE_1 >= 80'), 
+                          ['POLYGON_ID', 'GEOMETRY'])
+    tiled['lakes_2']= (filter_count_sql('WHSE_BASEMAPPING.FWA_LAKES_POLY'), 
+                       ['WATERBODY_POLY_ID'])
+    tiled['wetlands']= (filter_count_sql('WHSE_BASEMAPPING.FWA_WETLANDS_POLY'), 
+                        ['WATERBODY_POLY_ID'])
+    tiled['streams']= (filter_count_sql('WHSE_BASEMAPPING.FWA_STREAM_NETWORKS_SP'), 
+                       ['LINEAR_FEATURE_ID'])
+    
+    return tiled
+
+
+def load_mirror_jobs(aoi_geom):
+    """BCGW layers read from the local GeoParquet mirror, when snapshotted"""
+    fwa_cols= ['WATERBODY_POLY_ID', 'FEATURE_CODE', 'GNIS_NAME_1', 'AREA_HA']
+    idf= pc.field('ZONE') == 'IDF'
+    idf&= pc.field('SUBZONE').isin(['dc', 'dh', 'dk', 'dm', 'dw', 
+                                     'xc', 'xh', 'xk', 'xm', 'xw', 'xx'])
+    mrJobs= {}
+    if mirror_exists('tsa'):
+        mrJobs['tsa']= mirror_job('tsa', 
+                                  columns= ['TSA_NUMBER_DESCRIPTION'],
+                                  rename= {'TSA_NUMBER_DESCRIPTION': 'TSA_NAME'},
+                                  filter= pc.field('TSB_NUMBER').is_null() & 
+                                          pc.field('RETIREMENT_DATE').is_null() &
+                                          pc.field('TSA_NUMBER_DESCRIPTION').isin(['100 Mile House TSA', 'Kamloops TSA', 
+                                                                                  'Merritt TSA', 'Okanagan TSA']))
+    if mirror_exists('lakes'):
+        mrJobs['lakes_2']= mirror_job('lakes', aoi_geom, columns= fwa_cols)
+    if mirror_exists('wetlands'):
+        mrJobs['wetlands']= mirror_job('wetlands', aoi_geom, columns= fwa_cols)
+    if mirror_exists('bec'):
+        mrJobs['bec']= mirror_job('bec', aoi_geom, 
+                                  columns= ['ZONE', 'SUBZONE', 'VARIANT', 'PHASE', 
+                                            'NATURAL_DISTURBANCE', 'MAP_LABEL', 'BGC_LABEL'],
+                                  filter= idf)
+    return mrJobs
+
+
+def read_oracle_data (orcPool, dckCnx, dict_sqls, aoi_geom, srid, tiled_specs, cache=None, mirror_jobs=None):
+    """Streams BCGW query results into duckdb tables.
+       Tables are extracted concurrently over the session pool, large 
+       layers in adaptive tiles of the AOI. Mirrored layers are read locally"""
+    wkb_aoi= wkb.dumps(aoi_geom, output_dimension=2)
+    bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
+    
+    jobs= {}
+    tiled= {}
+    mirror_jobs= mirror_jobs or {}
     for k, v in dict_sqls.items():
-        print(f'....table {counter} of {len(dict_sqls)}: {k}')
-        if ':wkb_aoi' in v:
-            orcCur.setinputsizes(wkb_aoi=cx_Oracle.BLOB)
-            bvars = {'wkb_aoi':wkb_aoi,'srid':srid}
-            df = read_query(orcCnx, orcCur, v ,bvars)
+        if k in mirror_jobs:
+            jobs[k]= mirror_jobs[k]
+        elif k in tiled_specs:
+            count_sql, key= tiled_specs[k]
+            tiled[k]= (v, count_sql, key)
         else:
-            df = pd.read_sql(v, orcCnx)
-        
-        print (f'......{len(df)} rows')
-        data_dict[k]= df
+            jobs[k]= oracle_job(orcPool, v, bvars, cache=cache, label=k)
+    
+    df_status = tiled_ingest(orcPool, dckCnx, tiled, aoi_geom, srid, jobs, schemas=TOR_FLP_SCHEMAS)
+    print (df_status.to_string(index=False))
+    
+    failed = df_status.loc[df_status['STATUS'] != 'OK', 'TABLE'].to_list()
+    if failed:
+        raise Exception(f'..failed to load: {failed}')
+
+
+def add_data_to_duckdb(dckCnx, loc_dict, aoi_geom=None, use_st_read=False):
+    """Reads the local files into duckdb, streamed as Arrow batches of WKB,
+       several layers at a time. With use_st_read, the files are read with
+       ST_Read inside duckdb instead (features intersecting the AOI only,
+       if provided)"""
+    if not use_st_read:
+        df_status = vectors_to_duckdb(dckCnx, loc_dict, schemas=TOR_FLP_SCHEMAS)
+        print(df_status.to_string(index=False))
         
-        counter+=1
+        failed = df_status.loc[~df_status['STATUS'].isin(['OK', 'SKIPPED']), 'TABLE'].to_list()
+        if failed:
+            raise Exception(f'..failed to load: {failed}')
+        return
     
-    return data_dict
-
-
-def read_local_data(loc_dict, data_dict):
     counter = 1
     for k, v in loc_dict.items():
-        print(f'....table {counter} of {len(loc_dict)}: {k}')
-        df= esri_to_gdf (v)
-        df['GEOMETRY']= df['geometry'].apply(lambda x: wkt.dumps(x, output_dimension=2))
-        df['GEOMETRY'] = df['GEOMETRY'].astype(str)
-        
-        df = df.drop(columns=['geometry'])
-        
-        data_dict[k]= df
-        
-        counter+=1
-        
-    return data_dict   
-
-
-def add_data_to_duckdb(dckCnx, data_dict):
-    counter = 1
-    for k, v in data_dict.items():
-        print(f'..table {counter} of {len(data_dict)}: {k}')
-        dck_tab_list = dckCnx.execute('SHOW TABLES').df()['name'].to_list()
-
-        if k in dck_tab_list:
-            dck_row_count = dckCnx.execute(f'SELECT COUNT(*) FROM {k}').fetchone()[0]
-            dck_col_nams = dckCnx.execute(f"""SELECT column_name 
-                                             FROM INFORMATION_SCHEMA.COLUMNS 
-                                             WHERE table_name = '{k}'""").df()['column_name'].to_list()
-
-            if (dck_row_count != len(v)) or (set(list(v.columns)) != set(dck_col_nams)):
-                print(f'....import to Duckdb ({v.shape[0]} rows)')
-                chunk_size = 10000
-                total_chunks = (len(v) + chunk_size - 1) // chunk_size
-                
-                # Process the initial chunk and create the table
-                initial_chunk = v.iloc[0:chunk_size]
-                print(f'.......processing chunk 1 of {total_chunks}')
-                create_table_query = f"""
-                CREATE TABLE IF NOT EXISTS {k} AS
-                    SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                    FROM initial_chunk;
-                """
-                dckCnx.execute(create_table_query)
-                
-                # Process and append the rest of the chunks
-                for i in range(chunk_size, len(v), chunk_size):
-                    chunk = v.iloc[i:i + chunk_size]
-                    chunk_number = (i // chunk_size) + 1
-                    print(f'.......processing chunk {chunk_number} of {total_chunks}')
-                    
-                    insert_query = f"""
-                    INSERT INTO {k}
-                        SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                        FROM chunk;
-                    """
-                    dckCnx.execute(insert_query)
-            else:
-                print('....data already in db: skip importing')
-                pass
-
-        else:
-            print(f'....import to Duckdb ({v.shape[0]} rows)')
-            chunk_size = 10000
-            total_chunks = (len(v) + chunk_size - 1) // chunk_size
-            
-            # Process the initial chunk and create the table
-            initial_chunk = v.iloc[0:chunk_size]
-            print(f'.......processing chunk 1 of {total_chunks}')
-            create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {k} AS
-                SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                FROM initial_chunk;
-            """
-            dckCnx.execute(create_table_query)
-            
-            # Process and append the rest of the chunks
-            for i in range(chunk_size, len(v), chunk_size):
-                chunk = v.iloc[i:i + chunk_size]
-                chunk_number = (i // chunk_size) + 1
-                print(f'.......processing chunk {chunk_number} of {total_chunks}')
-                
-                insert_query = f"""
-                INSERT INTO {k}
-                    SELECT * EXCLUDE GEOMETRY, ST_GeomFromText(GEOMETRY) AS GEOMETRY
-                    FROM chunk;
-                """
-                dckCnx.execute(insert_query)
+        print(f'..table {counter} of {len(loc_dict)}: {k}')
+        st_read_to_duckdb(dckCnx, k, v, aoi_geom=aoi_geom, schemas=TOR_FLP_SCHEMAS)
 
         counter += 1
 
@@ -397,17 +354,15 @@ if __name__ == "__main__":
     print ('Connecting to databases')    
     
     print ('..connect to BCGW') 
-    Oracle = OracleConnector()
-    Oracle.connect_to_db()
-    orcCnx= Oracle.connection
-    orcCur= Oracle.cursor
+    # the session pool connects on the first query not served from the cache
+    Oracle = OraclePoolConnector(sessions=4)
+    cache = QueryCache()
     
     print ('..connect to Duckdb') 
     projDB= os.path.join(wks, 'inputs', 'to_flp_thlb_analysis.db')
     Duckdb= DuckDBConnector(db= projDB)
     Duckdb.connect_to_db()
     dckCnx= Duckdb.conn 
-    dckCnx.execute("SET GLOBAL pandas_analyze_sample=1000000")
     
     print ('\nReading the AOI file')
     gdf_aoi= esri_to_gdf(os.path.join(gdb, 'aoi'))
@@ -423,15 +378,11 @@ if __name__ == "__main__":
         loc_dict['vri']= os.path.join(gdb, 'vri')
         #loc_dict['aoi_test']= os.path.join(gdb, 'aoi')
         
-        data_dict= {}
-        print('..reading from Oracle')
-        #data_dict= read_oracle_data (orcCnx, orcCur, orSql, wkb_aoi, srid, data_dict)
-        
-        print('\n..reading from Local files')
-        data_dict= read_local_data(loc_dict, data_dict)
+        print('..reading from Oracle into duckdb')
+        #read_oracle_data (Oracle, dckCnx, orSql, gdf_aoi['geometry'].iloc[0], srid, load_tiled_specs(), cache, load_mirror_jobs(gdf_aoi['geometry'].iloc[0]))
         
-        print('\nWriting data to duckdb')
-        add_data_to_duckdb(dckCnx, data_dict)
+        print('\n..reading from Local files into duckdb')
+        add_data_to_duckdb(dckCnx, loc_dict, gdf_aoi['geometry'].iloc[0], use_st_read=True)
         
 
     except Exception as e: